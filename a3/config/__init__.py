@@ -33,10 +33,11 @@
 
     mq:
         message queue url with queue name
-        <protocol>://<ip:port>/<channel>
-        protocol - redis or amqp
+        <protocol>://<ip:port>/<channel>[?<name>=<value>&...]
+        protocol - redis, redis+streams, amqp or loopback (in-process, for tests and replay.py)
         ip:port - location of message queue server
         channel - channel name for media controller to listen
+        name=value - transport parameters (see a3.messaging)
 
     profile:
         <ip>:<ports> (<interface-ip>)
@@ -44,9 +45,84 @@
 
         ip - an IP address of machine which is used by clients (and send in SDP) to access media controller
         ports - ports ranges to open (ranges delimited by comma, values in range
-                delimited by minus, default is 0 - any port)
+                delimited by minus, single value is even rtp port of one pair, default is 0 - any port),
+                ports are given out by allocator of profile (see a3.config.profile), ports.* metrics
         interface-ip - ip address of interface (default 0.0.0.0 - any)
 
+    event-loop:
+        threads - listener, timer and stun-agent readers run in their own threads (default)
+        glib - timers, stun-agent pipes and outbound messages are driven by one GLib main loop,
+               message queue is still read in own thread (see a3.eventloop)
+
+    workers:
+        number of threads handling messages (default 0 - messages are handled in listener thread)
+        messages of one point are handled by the same thread in order they were received
+
+    inbound-queue-size:
+        max number of received messages waiting to be handled (default 1000),
+        when full, reading message queue is paused
+        REMOVE_MEDIA_POINT and UNJOIN_ROOM are handled before CREATE_MEDIA_POINT and JOIN_ROOM
+
+    inbound-queue-watermark:
+        number of waiting messages from which new CREATE_MEDIA_POINT are rejected (default 800)
+
+    overload-reason:
+        "reason" field of CREATE_MEDIA_POINT_FAILED sent to rejected CREATE_MEDIA_POINT (default overloaded)
+
+    record:
+        file to append received and sent messages to, one JSON object per line
+        (see a3.messaging.recorder), replayed with replay.py; empty - do not record (default)
+
+    rtp-pool-size:
+        number of rtp frontends (socket pair and gstreamer bins) kept ready for each media type
+        and profile (default 0 - frontends are created when point is created),
+        see a3.transcoding.pool, rtp_pool.* metrics show hit rate and checkout time
+
+    audio-mixing:
+        0 - room links two points to each other (default)
+        1 - audio of room points is mixed: any number of points, each hears mix of all others
+            (see a3.transcoding.gst1._mixer), video is linked for two points only unless video-forwarding=1
+
+    video-forwarding:
+        0 - video of two room points is linked with transcoding when codecs differ (default)
+        1 - video is forwarded without decoding: any number of points, each receiver gets
+            one sender with the same codec (see a3.transcoding.gst1._forwarder)
+
+    metrics-interval:
+        seconds between logging all metrics (a3.metrics) at INFO level (default 60),
+        point.state.* and point.handle.* show PointController transition timings; 0 - do not log
+
+    cpu-budget:
+        estimated CPU units node accepts (default 0 - unlimited), points are charged for rtp relay
+        of their media, room joins for transcoding of links they make (see a3.point.admission);
+        CREATE_MEDIA_POINT and JOIN_ROOM exceeding budget are rejected with CREATE_MEDIA_POINT_FAILED
+        and JOIN_ROOM_FAILED, GET_LOAD is answered with GET_LOAD_OK carrying the accounting
+
+    admission-redirect:
+        "redirect" field of rejections over cpu-budget, e.g. channel of another media controller
+        (default empty - no field)
+
+    drain-timeout:
+        seconds draining controller (DRAIN message or SIGTERM) waits for existing points to be removed
+        before removing them itself and exiting (default 600), new CREATE_MEDIA_POINT is rejected
+        with reason "draining" meanwhile, shared queues (redis+streams group) are left
+
+    journal:
+        file point state (ids, SDPs, ports, room, stun-agent conns) is written to on every transition
+        (see a3.point.journal), empty - off (default); restarted controller rebuilds rtp points
+        of the journal on the same ports and rejoins their rooms, srtp and rtmp points are removed
+        (REMOVE_MEDIA_POINT_OK with reason "restarted"), restore time is logged per 1000 points
+
+    ttl-creating-offer, ttl-waiting-remote-sdp:
+        seconds point may stay in CREATING_OFFER or RESTORING (default 30) and WAITING_REMOTE_SDP (default 120),
+        point outliving it is removed in background with reason "expired"
+        (CREATE_MEDIA_POINT_FAILED before SDP_OFFER, REMOVE_MEDIA_POINT_OK after); 0 - no limit
+
+    ttl-connected:
+        seconds connected point may receive no rtp before it is removed the same way
+        (default 0 - no limit, e.g. for calls on hold), checked against rtp session stats
+        once per ttl, so dead point is removed within 1-2 ttl
+
 
 """
 
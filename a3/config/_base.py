@@ -16,6 +16,30 @@ from .profile import Profile, ProfileError
 from .message_queue_url import MessageQueueUrl, MessageQueueUrlError
 
 
+#
+# known options and their default values
+#
+DEFAULT_OPTIONS = {
+    "event-loop": "threads",            # threads | glib
+    "workers": "0",                     # message handling threads, 0 - handle in listener thread
+    "inbound-queue-size": "1000",       # max received messages waiting to be handled
+    "inbound-queue-watermark": "800",   # queue depth from which CREATE_MEDIA_POINT is rejected
+    "overload-reason": "overloaded",    # reason in CREATE_MEDIA_POINT_FAILED sent when rejected
+    "record": "",                       # file to record bus traffic to (JSON lines), empty - off
+    "rtp-pool-size": "0",               # ready rtp frontends per media type and profile, 0 - no pool
+    "audio-mixing": "0",                # 1 - audio of rooms is mixed, any number of points per room
+    "video-forwarding": "0",            # 1 - video of rooms is forwarded without transcoding (SFU)
+    "metrics-interval": "60",           # seconds between metrics log dumps, 0 - off
+    "cpu-budget": "0",                  # CPU units of points and joins node accepts, 0 - unlimited
+    "admission-redirect": "",           # "redirect" hint in rejections over cpu-budget, empty - none
+    "drain-timeout": "600",             # seconds draining controller waits for points to finish
+    "journal": "",                      # file point state is kept in for hot restart, empty - off
+    "ttl-creating-offer": "30",         # seconds point may wait for its conns, 0 - forever
+    "ttl-waiting-remote-sdp": "120",    # seconds point may wait for SDP_ANSWER, 0 - forever
+    "ttl-connected": "0",               # seconds connected point may receive no rtp, 0 - forever
+}
+
+
 class IConfig(object):
     __metaclass__ = ABCMeta
 
@@ -31,6 +55,18 @@ class IConfig(object):
     def profiles(self):
         """return set of interfaces in use"""
 
+    @abstractmethod
+    def option(self, name):
+        """return str value of option or None"""
+
+    def int_option(self, name):
+        value = self.option(name)
+        return int(value) if value is not None else None
+
+    def float_option(self, name):
+        value = self.option(name)
+        return float(value) if value is not None else None
+
     def __str__(self):
         """string representation of all values """
         result = "mq=" + str(self.mq) + "\n"
@@ -38,6 +74,9 @@ class IConfig(object):
         for name in self.profiles:
             profile = self.profile(name)
             result += "  " + (name or "default") + "=" + str(profile) + "\n"
+        result += "options:\n"
+        for name in sorted(DEFAULT_OPTIONS.keys()):
+            result += "  " + name + "=" + str(self.option(name)) + "\n"
         return result
 
 
@@ -57,6 +96,7 @@ class BaseConfig(IConfig):
         super(BaseConfig, self).__init__()
         self._mq = None
         self._profiles = {}
+        self._options = {}
 
     @property
     def mq(self):
@@ -69,6 +109,10 @@ class BaseConfig(IConfig):
     def profile(self, name):
         return self._profiles[name] if name in self._profiles else None
 
+    def option(self, name):
+        assert name in DEFAULT_OPTIONS, "Unknown option %s" % name
+        return self._options[name] if name in self._options else None
+
     def parse_from_line(self, line):
         assert type(line) is str
         g = re.match(self.LINE_PARSER, line)
@@ -80,6 +124,8 @@ class BaseConfig(IConfig):
             self.__parse_media_queue_url_value(name, value)
         elif re.match("^profile(?:-(.*))?$", name):
             self.__parse_profile_value(name, value)
+        elif name in DEFAULT_OPTIONS:
+            self._options[name] = value
         else:
             raise ConfigParseError("Could not parse %s" % (line,))
 
@@ -123,3 +169,7 @@ class ChainedConfig(BaseConfig):
     def profile(self, name):
         return super(ChainedConfig, self).profile(name) or self._next.profile(name)
 
+    def option(self, name):
+        value = super(ChainedConfig, self).option(name)
+        return value if value is not None else self._next.option(name)
+
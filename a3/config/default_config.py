@@ -5,7 +5,7 @@
 """
 
 import socket
-from ._base import IConfig
+from ._base import IConfig, DEFAULT_OPTIONS
 from .profile import Profile
 from .message_queue_url import MessageQueueUrl
 
@@ -37,3 +37,7 @@ class DefaultConfig(IConfig):
         if name == "local":
             return self.__local_profile
         return None
+
+    def option(self, name):
+        assert name in DEFAULT_OPTIONS, "Unknown option %s" % name
+        return DEFAULT_OPTIONS[name]
@@ -16,16 +16,24 @@ class MessageQueueUrlError(Exception):
 
 
 class MessageQueueUrl(object):
-    def __init__(self, protocol, server, port, channel):
+    """
+    <protocol>://<server>[:<port>]/<channel>[?<name>=<value>&...]
+
+    query parameters tune the transport, e.g.
+        redis://127.0.0.1/media-controller?batch=32&flush-ms=1
+    """
+    def __init__(self, protocol, server, port, channel, params=None):
         assert type(protocol) is str
         assert type(server) is str
         assert port is None or type(port) is int
         assert type(channel) is str
+        assert params is None or type(params) is dict
 
         self.__protocol = protocol
         self.__server = server
         self.__port = port
         self.__channel = channel
+        self.__params = params if params is not None else {}
 
     @property
     def protocol(self):
@@ -63,19 +71,47 @@ class MessageQueueUrl(object):
         assert type(channel) is str
         self.__channel = channel
 
+    @property
+    def params(self):
+        return self.__params
+
+    def param(self, name, default_value=None):
+        assert type(name) is str
+        return self.__params[name] if name in self.__params else default_value
+
+    def int_param(self, name, default_value):
+        value = self.param(name)
+        if value is None:
+            return default_value
+        try:
+            return int(value)
+        except ValueError:
+            raise MessageQueueUrlError("Parameter %s is not an integer: %s" % (name, value))
+
     def __str__(self):
         if self.port is not None:
-            return "%s://%s:%d/%s" % (self.protocol, self.server, self.port, self.channel)
+            result = "%s://%s:%d/%s" % (self.protocol, self.server, self.port, self.channel)
         else:
-            return "%s://%s/%s" % (self.protocol, self.server, self.channel)
+            result = "%s://%s/%s" % (self.protocol, self.server, self.channel)
+        if self.__params:
+            result += "?" + "&".join("%s=%s" % (n, v) for (n, v) in sorted(self.__params.items()))
+        return result
 
     @classmethod
     def from_string(cls, url_str):
         assert type(url_str) is str
-        g = re.match("(.+?)://(.+?)(?::(\d+))?(?:/(.+))?$", url_str)
+        g = re.match("(.+?)://([^:/?]+)(?::(\d+))?(?:/([^?]+))?(?:\?(.*))?$", url_str)
         if g is None:
             raise MessageQueueUrlError("Could not parse %s" % (url_str,))
+        params = {}
+        if g.group(5):
+            for pair in g.group(5).split("&"):
+                if not pair:
+                    continue
+                name, _, value = pair.partition("=")
+                params[name] = value
         return cls(protocol=g.group(1),
                    server=g.group(2),
                    port=int(g.group(3)) if g.group(3) is not None else None,
-                   channel=g.group(4))
+                   channel=g.group(4),
+                   params=params)
@@ -1,10 +1,27 @@
 #!/usr/bin/env python
+"""
+Profile: ip, port ranges and interface for rtp connections
+
+Ports of profile are given out by its PortAllocator (profile.allocator):
+free rtp/rtcp pairs are kept in a queue (allocate/release are O(1)) and a bitmap of pairs in use,
+so opening a point does not probe busy ports with failing bind calls.
+A pair which turns out to be busy in OS (used by another process) is put back to the end of the queue.
+
+Metrics (<ports> is ports range of profile, e.g. "2000-2020,2030"):
+    ports.<ports>.used          pairs given out (gauge)
+    ports.<ports>.utilisation   used / all pairs (gauge)
+    ports.<ports>.exhausted     allocations failed as no pair was free (counter)
+    ports.<ports>.conflicts     pairs given out but busy in OS (counter)
+"""
 
 
 import re
 import collections
 import random
 import logging
+import threading
+
+from ..metrics import METRICS
 
 
 DEFAULT_MIN_PORT = 1024
@@ -84,6 +101,19 @@ class _Range(object):
         rtp_port = self.__start + (self.__start % 2) + key * 2
         return rtp_port, rtp_port + 1
 
+    def index(self, pair):
+        """
+        :return: index of pair, raises ValueError if pair is not in range
+        """
+        if pair not in self:
+            raise ValueError("%s is not in %s" % (pair, self))
+        return (pair[0] - self.__start - self.__start % 2) / 2
+
+
+    @property
+    def ranges(self):
+        return [self]
+
 
 class _RangeAny(_Range):
     def __init__(self):
@@ -93,19 +123,170 @@ class _RangeAny(_Range):
         return "*"
 
 
+class _MultiRange(object):
+    """
+    comma delimited ranges, pairs are indexed through ranges in given order
+    """
+
+    def __init__(self, ranges):
+        assert len(ranges) > 1 and all(isinstance(r, _Range) for r in ranges)
+        self.__ranges = ranges
+
+    def __len__(self):
+        return sum(len(r) for r in self.__ranges)
+
+    def __contains__(self, n):
+        return any(n in r for r in self.__ranges)
+
+    def __str__(self):
+        return ",".join(str(r) for r in self.__ranges)
+
+    def __iter__(self):
+        offset = random.randrange(len(self))
+        return self.offset_iterator(offset)
+
+    def offset_iterator(self, offset=0):
+        assert type(offset) is int
+        l = len(self)
+        for i in xrange(0, l):
+            yield self[(offset + i) % l]
+
+    @property
+    def start(self):
+        return min(r.start for r in self.__ranges)
+
+    @property
+    def end(self):
+        return max(r.end for r in self.__ranges)
+
+    @property
+    def ranges(self):
+        return list(self.__ranges)
+
+    def __getitem__(self, key):
+        if type(key) is not int:
+            raise TypeError()
+        if not 0 <= key < len(self):
+            raise IndexError()
+        for r in self.__ranges:
+            if key < len(r):
+                return r[key]
+            key -= len(r)
+
+    def index(self, pair):
+        offset = 0
+        for r in self.__ranges:
+            if pair in r:
+                return offset + r.index(pair)
+            offset += len(r)
+        raise ValueError("%s is not in %s" % (pair, self))
+
+
+def _parse_ranges(ports_str):
+    """
+    "2000-2020,2030" -> range of pairs, single port is rtp port of one pair, "*" and "0" - any port
+    """
+    if ports_str in ("*", "0"):
+        return _RangeAny()
+    ranges = []
+    for part in ports_str.split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            ranges.append(_Range(int(start), int(end)))
+        else:
+            port = int(part)
+            if port % 2:
+                raise ProfileError("Single port %d is not even rtp port" % port)
+            ranges.append(_Range(port, port + 2))
+    return ranges[0] if len(ranges) == 1 else _MultiRange(ranges)
+
+
+class PortAllocator(object):
+    """
+    gives out free (rtp, rtcp) pairs of ports range, thread-safe
+    """
+
+    def __init__(self, ports_range):
+        self.__ports_range = ports_range
+        self.__size = len(ports_range)
+        self.__in_use = bytearray((self.__size + 7) // 8)
+        offset = random.randrange(self.__size) if self.__size else 0
+        self.__free = collections.deque(range(offset, self.__size) + range(0, offset))
+        self.__index = {}                                   # rtp port -> index of pair
+        self.__lock = threading.Lock()
+
+        name = "ports.%s" % ports_range
+        self.__used_gauge = METRICS.gauge(name + ".used")
+        self.__utilisation_gauge = METRICS.gauge(name + ".utilisation")
+        self.__exhausted_counter = METRICS.counter(name + ".exhausted")
+        self.__conflicts_counter = METRICS.counter(name + ".conflicts")
+
+    def __len__(self):
+        return self.__size
+
+    @property
+    def used(self):
+        return self.__size - len(self.__free)
+
+    def allocate(self, pair=None):
+        """
+        :param pair: (rtp, rtcp) pair to take (e.g. ports of point restored after restart), None - any
+        :return: (rtp, rtcp) pair not given out yet or None if all pairs (or the given one) are in use
+        """
+        with self.__lock:
+            if pair is not None:
+                index = self.__ports_range.index(tuple(pair))
+                if self.__in_use[index >> 3] & (1 << (index & 7)):
+                    return None
+                self.__free.remove(index)
+            elif not self.__free:
+                self.__exhausted_counter.inc()
+                return None
+            else:
+                index = self.__free.popleft()
+            self.__in_use[index >> 3] |= 1 << (index & 7)
+            pair = self.__ports_range[index]
+            self.__index[pair[0]] = index
+            self.__update()
+            return pair
+
+    def release(self, pair, busy=False):
+        """
+        return pair given out by allocate
+        :param busy: pair could not be opened (OS has it in use), counted as conflict
+        """
+        with self.__lock:
+            index = self.__index.pop(pair[0], None)
+            if index is None or not self.__in_use[index >> 3] & (1 << (index & 7)):
+                logging.getLogger("MC").warning("PortAllocator: pair %s is not allocated", pair)
+                return
+            self.__in_use[index >> 3] &= ~(1 << (index & 7)) & 0xff
+            self.__free.append(index)
+            if busy:
+                self.__conflicts_counter.inc()
+            self.__update()
+
+    def __update(self):
+        used = self.__size - len(self.__free)
+        self.__used_gauge.set(used)
+        self.__utilisation_gauge.set(float(used) / self.__size if self.__size else 1.0)
+
+
 class Profile(object):
     def __init__(self, profile_str, default_ip=DEFAULT_IP):
         assert type(profile_str) is str
         assert type(default_ip) is str
 
-        g = re.match("^(\d+\.\d+\.\d+\.\d+)?(?:(?::|^)(\*|(?:(\d+)-(\d+))))?(?:\s*\((\d+\.\d+\.\d+\.\d+)\))?$",
+        g = re.match("^(\d+\.\d+\.\d+\.\d+)?(?:(?::|^)(\*|(?:\d+(?:-\d+)?(?:,\d+(?:-\d+)?)*)))?"
+                     "(?:\s*\((\d+\.\d+\.\d+\.\d+)\))?$",
                      profile_str)
         if not g:
             raise ProfileError("Cannot parse Profile string: %s" % profile_str)
         self.__ip = g.group(1) if g and g.group(1) else default_ip
-        self.__ports_range = _Range(int(g.group(3)), int(g.group(4))) if g and g.group(2) and g.group(2) != "*" \
-            else _RangeAny()
-        self.__interface = g.group(5) if g and g.group(5) else DEFAULT_INTERFACE
+        self.__ports_range = _parse_ranges(g.group(2)) if g and g.group(2) else _RangeAny()
+        self.__interface = g.group(3) if g and g.group(3) else DEFAULT_INTERFACE
+        self.__allocator = None
+        self.__allocator_lock = threading.Lock()
 
     @property
     def ip(self):
@@ -119,6 +300,16 @@ class Profile(object):
     def interface(self):
         return self.__interface
 
+    @property
+    def allocator(self):
+        """
+        PortAllocator of ports range, created on first use
+        """
+        with self.__allocator_lock:
+            if self.__allocator is None:
+                self.__allocator = PortAllocator(self.__ports_range)
+            return self.__allocator
+
     def __str__(self):
         return "%s:%s (interface=%s)" % (self.__ip, self.__ports_range, self.__interface)
 
@@ -226,8 +417,50 @@ if __name__ == "__main__":
             p = Profile("(1.1.1.1)")
             assert p.ip == DEFAULT_IP and type(p.ports_range) is _RangeAny and p.interface == "1.1.1.1"
             p = Profile("23-45")
-            assert p.ip == DEFAULT_IP and p.ports_range.start == 23 and p.port_range.end == 45 and \
+            assert p.ip == DEFAULT_IP and p.ports_range.start == 23 and p.ports_range.end == 45 and \
                 p.interface == DEFAULT_INTERFACE
+            p = Profile("1.2.3.4:0")
+            assert type(p.ports_range) is _RangeAny
+
+        def test_multi_range(self):
+            p = Profile("192.168.1.3:2000-2004,2030 (10.0.0.1)")
+            self.failUnlessEqual(p.ip, "192.168.1.3")
+            self.failUnlessEqual(p.interface, "10.0.0.1")
+            self.failUnlessEqual(str(p.ports_range), "2000-2004,2030-2032")
+            self.failUnlessEqual(len(p.ports_range), 3)
+            self.failUnlessEqual(list(p.ports_range.offset_iterator(0)), [(2000, 2001), (2002, 2003), (2030, 2031)])
+            self.failUnless((2030, 2031) in p.ports_range)
+            self.failIf((2004, 2005) in p.ports_range)
+            self.failUnlessRaises(ProfileError, Profile, "2031")
+
+    class PortAllocatorTest(unittest.TestCase):
+        def test_allocate_release(self):
+            allocator = PortAllocator(_parse_ranges("2000-2004,2030"))
+            pairs = [allocator.allocate() for _ in range(3)]
+            self.failUnlessEqual(sorted(pairs), [(2000, 2001), (2002, 2003), (2030, 2031)])
+            self.failUnlessEqual(allocator.used, 3)
+            self.failUnlessEqual(allocator.allocate(), None)
+            allocator.release(pairs[1])
+            allocator.release(pairs[1])                     # ignored
+            self.failUnlessEqual(allocator.used, 2)
+            self.failUnlessEqual(allocator.allocate(), pairs[1])
+
+        def test_busy_goes_last(self):
+            allocator = PortAllocator(_parse_ranges("2000-2006"))
+            first = allocator.allocate()
+            allocator.release(first, busy=True)
+            self.failIfEqual(allocator.allocate(), first)
+            self.failIfEqual(allocator.allocate(), first)
+            self.failUnlessEqual(allocator.allocate(), first)
+
+        def test_allocate_given_pair(self):
+            allocator = PortAllocator(_parse_ranges("2000-2004,2030"))
+            self.failUnlessEqual(allocator.allocate((2030, 2031)), (2030, 2031))
+            self.failUnlessEqual(allocator.allocate((2030, 2031)), None)
+            self.failUnlessRaises(ValueError, allocator.allocate, (2010, 2011))
+            self.failUnlessEqual(sorted([allocator.allocate(), allocator.allocate()]), [(2000, 2001), (2002, 2003)])
+            allocator.release((2030, 2031))
+            self.failUnlessEqual(allocator.allocate(), (2030, 2031))
 
     unittest.main()
 
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+eventloop
+
+GLib main loop driving timers, stun-agent pipes and outbound message flushes
+instead of a thread per reader
+
+Not everything runs on the loop:
+    message queue reader    redis-py and pika expose no socket to watch, the queue is read in own thread
+                            (so inbound queue backpressure blocks that thread, not the loop)
+    inbound queue, workers  message handling (see a3.messaging.inbound_queue, a3.executor)
+    rtp pool refill         pre-allocation of rtp frontends
+    GStreamer               streaming threads of pipelines
+    dtmf senders            one thread per dtmf sequence
+
+Example:
+    loop = EventLoop()
+    messaging.create(config.mq, listener, loop=loop).listen()
+    loop.call_periodic(1, listener.on_timer)
+    loop.run()
+
+Loop lag (how late timers fire) is probed every LAG_PROBE_INTERVAL seconds
+and exported as METRICS histogram "loop.lag".
+"""
+
+__author__ = 'RCSLabs'
+
+
+from ..logging import LOG
+from ..metrics import METRICS
+
+from gi.repository import GLib, GObject
+
+import time
+
+
+GObject.threads_init()
+
+
+LAG_PROBE_INTERVAL = 0.1
+
+
+class EventLoop(object):
+    def __init__(self, lag_probe_interval=LAG_PROBE_INTERVAL):
+        self.__loop = GLib.MainLoop()
+        self.__lag_histogram = METRICS.histogram("loop.lag")
+        if lag_probe_interval:
+            self.call_periodic(lag_probe_interval, lambda: None)
+
+    def run(self):
+        LOG.info("EventLoop: running")
+        self.__loop.run()
+
+    def stop(self):
+        self.__loop.quit()
+
+    def add_reader(self, fd, callback):
+        """
+        callback() is called each time fd is readable, closed or in error
+        :return: source id for remove_reader
+        """
+        def on_io(_, condition):
+            try:
+                callback()
+            except Exception:
+                LOG.exception("EventLoop: reader failed")
+            return True
+        return GLib.io_add_watch(fd, GLib.PRIORITY_DEFAULT, GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, on_io)
+
+    def remove_reader(self, source_id):
+        GLib.source_remove(source_id)
+
+    def call_later(self, delay, callback, *args):
+        """
+        call callback(*args) once after delay seconds
+        may be called from any thread
+        :return: source id for cancel
+        """
+        def on_timeout():
+            try:
+                callback(*args)
+            except Exception:
+                LOG.exception("EventLoop: timer callback failed")
+            return False
+        return GLib.timeout_add(int(delay * 1000), on_timeout)
+
+    def call_soon_threadsafe(self, callback, *args):
+        """
+        call callback(*args) on the loop thread
+        """
+        return self.call_later(0, callback, *args)
+
+    def call_periodic(self, interval, callback, *args):
+        """
+        call callback(*args) every interval seconds, lag is measured on each call
+        :return: source id for cancel
+        """
+        state = dict(expected=time.time() + interval)
+
+        def on_timeout():
+            now = time.time()
+            self.__lag_histogram.observe(max(0, now - state["expected"]))
+            state["expected"] = now + interval
+            try:
+                callback(*args)
+            except Exception:
+                LOG.exception("EventLoop: periodic callback failed")
+            return True
+        return GLib.timeout_add(int(interval * 1000), on_timeout)
+
+    def cancel(self, source_id):
+        GLib.source_remove(source_id)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+"""
+executor
+
+ShardedExecutor runs tasks on a fixed pool of worker threads,
+tasks submitted with the same key run on the same worker in submission order,
+tasks with different keys may run in parallel,
+task of many keys (submit_all) runs once, in order with the tasks of every key
+
+KeyedLocks gives a lock per key (e.g. room id) for state shared by several keys
+
+Example:
+    executor = ShardedExecutor(4)
+    executor.submit(point_id, "CREATE_MEDIA_POINT", on_create, message)
+    executor.submit_all(point_ids, "REMOVE_MEDIA_POINTS", on_remove_points, message)
+
+With 0 workers tasks run inline in the caller thread.
+With queue_size, submit() blocks while the worker queue is full,
+try_submit() does not (for timer callbacks which must not stall the timer thread).
+
+Metrics:
+    <name>.queue_depth          tasks waiting in all worker queues (gauge)
+    <name>.queue_wait           time from submit to start (histogram)
+    <name>.handle.<label>       task run time per label (histogram)
+"""
+
+__author__ = 'RCSLabs'
+
+
+from ..logging import LOG
+from ..metrics import METRICS
+
+from contextlib import contextmanager
+import Queue
+import threading
+import time
+
+
+class ShardedExecutor(object):
+    def __init__(self, workers, name="executor", queue_size=0):
+        assert type(workers) is int and workers >= 0
+        assert type(name) is str
+        assert type(queue_size) is int and queue_size >= 0
+        self.__name = name
+        self.__queues = [Queue.Queue(queue_size) for _ in range(workers)]
+        self.__submit_all_lock = threading.Lock()
+        self.__handle_histograms = {}
+        self.__queue_depth_gauge = METRICS.gauge("%s.queue_depth" % name)
+        self.__queue_wait_histogram = METRICS.histogram("%s.queue_wait" % name)
+
+        for (index, queue) in enumerate(self.__queues):
+            thread = threading.Thread(target=self.__run, args=(queue,), name="%s-%d" % (name, index))
+            thread.daemon = True
+            thread.start()
+
+    @property
+    def workers(self):
+        return len(self.__queues)
+
+    def submit(self, key, label, callback, *args):
+        """
+        run callback(*args) on the worker of key
+        :param label: task kind for latency metrics (e.g. message type)
+        """
+        assert type(label) is str
+        if not self.__queues:
+            self.__execute(label, callback, args)
+            return
+        queue = self.__queues[hash(key) % len(self.__queues)]
+        self.__queue_depth_gauge.inc()
+        queue.put((time.time(), label, callback, args, None))
+
+    def try_submit(self, key, label, callback, *args):
+        """
+        submit unless the worker queue of key is full
+        :return: False if task is not submitted
+        """
+        assert type(label) is str
+        if not self.__queues:
+            self.__execute(label, callback, args)
+            return True
+        queue = self.__queues[hash(key) % len(self.__queues)]
+        try:
+            queue.put_nowait((time.time(), label, callback, args, None))
+        except Queue.Full:
+            return False
+        self.__queue_depth_gauge.inc()
+        return True
+
+    def submit_all(self, keys, label, callback, *args):
+        """
+        run callback(*args) once, after tasks submitted before for any of keys
+        and before tasks submitted after it for any of them (e.g. bulk message of many points):
+        task is queued on the worker of every key, workers reaching it wait for the last one, which runs it
+        """
+        assert type(label) is str
+        assert keys
+        indexes = sorted(set(hash(key) % len(self.__queues) for key in keys)) if self.__queues else []
+        if len(indexes) <= 1:
+            self.submit(keys[0], label, callback, *args)
+            return
+        join = _Join(len(indexes))
+        # tasks of many workers are queued in the same order on all of them, so workers can not wait for each other
+        with self.__submit_all_lock:
+            submitted = time.time()
+            for index in indexes:
+                self.__queue_depth_gauge.inc()
+                self.__queues[index].put((submitted, label, callback, args, join))
+
+    def stop(self):
+        """
+        workers exit when tasks queued so far are done
+        """
+        for queue in self.__queues:
+            queue.put(None)
+
+    def __run(self, queue):
+        while True:
+            task = queue.get()
+            if task is None:
+                break
+            (submitted, label, callback, args, join) = task
+            self.__queue_depth_gauge.dec()
+            self.__queue_wait_histogram.observe(time.time() - submitted)
+            if join is None:
+                self.__execute(label, callback, args)
+            elif join.arrive():
+                try:
+                    self.__execute(label, callback, args)
+                finally:
+                    join.finish()
+            else:
+                join.wait()
+
+    def __execute(self, label, callback, args):
+        histogram = self.__handle_histograms.get(label)
+        if histogram is None:
+            histogram = METRICS.histogram("%s.handle.%s" % (self.__name, label))
+            self.__handle_histograms[label] = histogram
+        try:
+            with histogram.time():
+                callback(*args)
+        except Exception:
+            LOG.exception("Executor: task %s failed", label)
+
+
+class _Join(object):
+    """
+    task of submit_all queued on count workers
+    """
+    def __init__(self, count):
+        self.__left = count
+        self.__lock = threading.Lock()
+        self.__done = threading.Event()
+
+    def arrive(self):
+        """
+        :return: True for the last worker, it runs the task
+        """
+        with self.__lock:
+            self.__left -= 1
+            return self.__left == 0
+
+    def wait(self):
+        self.__done.wait()
+
+    def finish(self):
+        self.__done.set()
+
+
+class KeyedLocks(object):
+    """
+    RLock per key, created on first use and dropped when nobody holds or waits for it
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__locks = {}
+
+    @contextmanager
+    def hold(self, *keys):
+        """
+        acquire locks of all keys, always in sorted order so two holders can not deadlock
+        """
+        keys = sorted(set(keys))
+        entries = []
+        with self.__lock:
+            for key in keys:
+                entry = self.__locks.get(key)
+                if entry is None:
+                    entry = self.__locks[key] = [threading.RLock(), 0]
+                entry[1] += 1
+                entries.append(entry)
+
+        for entry in entries:
+            entry[0].acquire()
+        try:
+            yield
+        finally:
+            for entry in reversed(entries):
+                entry[0].release()
+            with self.__lock:
+                for (key, entry) in zip(keys, entries):
+                    entry[1] -= 1
+                    if entry[1] == 0:
+                        del self.__locks[key]
+
+
+if __name__ == "__main__":
+    import unittest
+
+    class ShardedExecutorTest(unittest.TestCase):
+        def test_inline(self):
+            result = []
+            ShardedExecutor(0, "test.inline").submit("a", "t", result.append, 1)
+            self.assertEqual(result, [1])
+
+        def test_order_per_key(self):
+            executor = ShardedExecutor(4, "test.order")
+            result = dict(a=[], b=[])
+            for i in range(100):
+                executor.submit("a", "t", result["a"].append, i)
+                executor.submit("b", "t", result["b"].append, i)
+            executor.stop()
+            time.sleep(0.1)
+            self.assertEqual(result["a"], range(100))
+            self.assertEqual(result["b"], range(100))
+
+        def test_submit_all(self):
+            executor = ShardedExecutor(4, "test.all", queue_size=2)
+            keys = ["k%d" % i for i in range(8)]
+            result = []
+            lock = threading.Lock()
+
+            def append(value):
+                with lock:
+                    result.append(value)
+
+            for i in range(50):
+                for key in keys:
+                    executor.submit(key, "t", append, (key, i))
+                executor.submit_all(keys[i % 3:], "all", append, ("all", i))
+            executor.stop()
+            time.sleep(0.2)
+            self.assertEqual(len(result), 50 * 9)
+            # every bulk task runs once, after earlier tasks of its keys and before later ones
+            for i in range(50):
+                position = result.index(("all", i))
+                for key in keys[i % 3:]:
+                    self.assertTrue(result.index((key, i)) < position)
+                    if i < 49:
+                        self.assertTrue(result.index((key, i + 1)) > position)
+
+        def test_try_submit(self):
+            executor = ShardedExecutor(1, "test.try", queue_size=1)
+            started = threading.Event()
+            gate = threading.Event()
+
+            def hold():
+                started.set()
+                gate.wait()
+
+            executor.submit("a", "t", hold)
+            started.wait(1)
+            result = []
+            self.assertTrue(executor.try_submit("a", "t", result.append, 1))
+            self.assertFalse(executor.try_submit("a", "t", result.append, 2))
+            gate.set()
+            executor.stop()
+            time.sleep(0.1)
+            self.assertEqual(result, [1])
+
+        def test_submit_all_inline(self):
+            result = []
+            ShardedExecutor(0, "test.all.inline").submit_all(["a", "b"], "t", result.append, 1)
+            self.assertEqual(result, [1])
+
+        def test_keyed_locks(self):
+            locks = KeyedLocks()
+            with locks.hold("b", "a"):
+                with locks.hold("a"):
+                    pass
+            with locks.hold("a"):
+                pass
+
+    unittest.main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""
+ledger
+
+process-wide record of resources held by points and rooms
+export LEDGER object
+
+Every resource is recorded against its owner: point id or ROOM_OWNER % room id.
+Code knowing the owner (point controller, manager) scopes its work with LEDGER.owner(),
+resources acquired in the scope, however deep in transcoding, are recorded against that owner.
+Owners are hierarchical: "p1.audio" and "p1/pool-3" belong to "p1".
+Entries keep their resources alive until released, so id() of a recorded resource is not reused.
+
+Manager verifies that removed point or room holds nothing, resources left are leaks:
+they are logged, counted and kept under LEAKED_OWNER % owner.
+
+Kinds:
+    socket          udp sockets of RtpSocketPair
+    gst_bin         bins of rtp frontends
+    gst_pipeline    transcoding contexts of rooms
+    link            links between media points of a room
+    agent_conn      stun-agent conns of srtp points
+    thread          dtmf sender threads
+
+Example:
+    with LEDGER.owner("p1"):
+        point.start()                                   # sockets, bins, threads of p1
+    LEDGER.acquire(KIND.AGENT_CONN, conn, owner="p1.audio")
+    LEDGER.release(KIND.AGENT_CONN, conn)
+    LEDGER.verify("p1")                                 # {kind: count} leaked
+
+Metrics:
+    ledger.<kind>       resources held (gauge)
+    ledger.leaked       resources left by removed points and rooms (counter)
+"""
+
+__author__ = 'RCSLabs'
+
+
+from ..logging import LOG
+from ..metrics import METRICS
+
+import collections
+import contextlib
+import threading
+
+
+class KIND:
+    SOCKET = "socket"
+    GST_BIN = "gst_bin"
+    GST_PIPELINE = "gst_pipeline"
+    LINK = "link"
+    AGENT_CONN = "agent_conn"
+    THREAD = "thread"
+
+
+ROOM_OWNER = "room:%s"
+LEAKED_OWNER = "leaked:%s"
+
+
+def _belongs(owner, parent):
+    return owner == parent or \
+        owner is not None and owner.startswith(parent) and owner[len(parent)] in "./"
+
+
+class Ledger(object):
+    def __init__(self):
+        self.__entries = {}                         # (kind, id(resource)) -> [owner, class name, resource]
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__gauges = {}
+        self.__leaked_counter = METRICS.counter("ledger.leaked")
+
+    @contextlib.contextmanager
+    def owner(self, owner):
+        """
+        resources acquired by this thread in the scope belong to owner
+        """
+        assert isinstance(owner, basestring)
+        stack = self.__stack()
+        stack.append(owner)
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    def current(self):
+        """
+        :return: owner of the innermost scope of this thread, None - unowned
+        """
+        stack = self.__stack()
+        return stack[-1] if stack else None
+
+    def acquire(self, kind, resource, owner=None):
+        if owner is None:
+            owner = self.current()
+        with self.__lock:
+            if (kind, id(resource)) not in self.__entries:
+                self.__gauge(kind).inc()
+            self.__entries[(kind, id(resource))] = [owner, type(resource).__name__, resource]
+
+    def release(self, kind, resource):
+        """
+        resources not acquired (or released already) are ignored
+        """
+        if resource is None:
+            return
+        with self.__lock:
+            if self.__entries.pop((kind, id(resource)), None) is not None:
+                self.__gauge(kind).dec()
+
+    def transfer(self, owner, new_owner):
+        """
+        resources of owner (and its sub-owners) go to new_owner
+        """
+        with self.__lock:
+            for entry in self.__entries.values():
+                if _belongs(entry[0], owner):
+                    entry[0] = new_owner + entry[0][len(owner):] if new_owner is not None else None
+
+    def held(self, owner):
+        """
+        :return: {kind: count} of resources of owner and its sub-owners
+        """
+        result = collections.defaultdict(int)
+        with self.__lock:
+            for ((kind, _), entry) in self.__entries.items():
+                if _belongs(entry[0], owner):
+                    result[kind] += 1
+        return dict(result)
+
+    def counts(self):
+        """
+        :return: {kind: count} of all resources
+        """
+        result = collections.defaultdict(int)
+        with self.__lock:
+            for (kind, _) in self.__entries.keys():
+                result[kind] += 1
+        return dict(result)
+
+    def leaked(self):
+        """
+        :return: {kind: count} of resources left by removed owners
+        """
+        result = collections.defaultdict(int)
+        with self.__lock:
+            for ((kind, _), entry) in self.__entries.items():
+                if entry[0] is not None and entry[0].startswith(LEAKED_OWNER % ""):
+                    result[kind] += 1
+        return dict(result)
+
+    def verify(self, owner):
+        """
+        check that removed owner holds nothing, resources left are flagged as leaked
+        :return: {kind: count} leaked
+        """
+        leaks = collections.defaultdict(int)
+        names = set()
+        with self.__lock:
+            for ((kind, _), entry) in self.__entries.items():
+                if _belongs(entry[0], owner):
+                    leaks[kind] += 1
+                    names.add(entry[1])
+                    entry[0] = LEAKED_OWNER % entry[0]
+        if leaks:
+            self.__leaked_counter.inc(sum(leaks.values()))
+            LOG.warning("Ledger: %s leaked %s (%s)", owner,
+                        ", ".join("%d %s" % (n, kind) for (kind, n) in sorted(leaks.items())),
+                        ", ".join(sorted(names)))
+        return dict(leaks)
+
+    #
+    # private
+    #
+    def __stack(self):
+        stack = getattr(self.__local, "stack", None)
+        if stack is None:
+            stack = self.__local.stack = []
+        return stack
+
+    def __gauge(self, kind):
+        gauge = self.__gauges.get(kind)
+        if gauge is None:
+            gauge = self.__gauges[kind] = METRICS.gauge("ledger." + kind)
+        return gauge
+
+
+LEDGER = Ledger()
+
+
+if __name__ == "__main__":
+    import unittest
+
+    class _Resource(object):
+        pass
+
+    class LedgerTest(unittest.TestCase):
+        def test_owner_scope(self):
+            ledger = Ledger()
+            (socket, conn, pipeline) = (_Resource(), _Resource(), _Resource())
+            with ledger.owner("p1"):
+                ledger.acquire(KIND.SOCKET, socket)
+                with ledger.owner(ROOM_OWNER % "r"):
+                    ledger.acquire(KIND.GST_PIPELINE, pipeline)
+                self.assertEqual(ledger.current(), "p1")
+            self.assertEqual(ledger.current(), None)
+            ledger.acquire(KIND.AGENT_CONN, conn, owner="p1.audio")
+            self.assertEqual(ledger.held("p1"), {KIND.SOCKET: 1, KIND.AGENT_CONN: 1})
+            self.assertEqual(ledger.held("p"), {})
+            self.assertEqual(ledger.held(ROOM_OWNER % "r"), {KIND.GST_PIPELINE: 1})
+
+            ledger.release(KIND.SOCKET, socket)
+            ledger.release(KIND.SOCKET, socket)
+            ledger.release(KIND.THREAD, None)
+            self.assertEqual(ledger.verify("p1"), {KIND.AGENT_CONN: 1})
+            self.assertEqual(ledger.held("p1"), {})
+            self.assertEqual(ledger.leaked(), {KIND.AGENT_CONN: 1})
+            self.assertEqual(ledger.verify(ROOM_OWNER % "r"), {KIND.GST_PIPELINE: 1})
+            self.assertEqual(ledger.counts(), {KIND.AGENT_CONN: 1, KIND.GST_PIPELINE: 1})
+
+        def test_transfer(self):
+            ledger = Ledger()
+            bin_ = _Resource()
+            with ledger.owner("pool-1"):
+                ledger.acquire(KIND.GST_BIN, bin_)
+            ledger.transfer("pool-1", "p1/pool-1")
+            self.assertEqual(ledger.held("p1"), {KIND.GST_BIN: 1})
+            ledger.transfer("p1/pool-1", "pool-1")
+            self.assertEqual(ledger.verify("p1"), {})
+            self.assertEqual(ledger.held("pool-1"), {KIND.GST_BIN: 1})
+
+        def test_resource_kept_alive(self):
+            import gc
+            import weakref
+            ledger = Ledger()
+            socket = _Resource()
+            ref = weakref.ref(socket)
+            ledger.acquire(KIND.SOCKET, socket, owner="p1")
+            del socket
+            gc.collect()
+            # id of a dropped but recorded resource must not be reused by another one
+            self.assertTrue(ref() is not None)
+            ledger.release(KIND.SOCKET, ref())
+            gc.collect()
+            self.assertTrue(ref() is None)
+
+    unittest.main()
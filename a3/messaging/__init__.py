@@ -5,40 +5,105 @@
 Examples:
     m = messaging.create("redis://127.0.0.1/channel", listener)
     m.listen()
+
+    loopback://local/<channel> - in-process transport (a3.messaging.transport.loopback_transport)
+
+MQ url parameters:
+    redis:
+        batch       max messages published in one pipeline (default 32, 1 disables batching)
+        flush-ms    max time a message waits in the outbound queue, ms (default 1)
+    amqp:
+        prefetch    max unacknowledged deliveries (basic_qos, default 64, 0 - unlimited)
+        ack-batch   messages acknowledged with one basic_ack (default 16)
+        batch, flush-ms as for redis, a batch is published in one transaction
+    redis+streams (a3.messaging.transport.redis_streams_transport):
+        group       consumer group shared by controllers (default channel name)
+        consumer    consumer name, stable across restarts (default <hostname>-<pid>)
+        batch, flush-ms as for redis
+        ack-batch   max messages acknowledged with one XACK (default 32)
+        block-ms    XREADGROUP block time, ms (default 1000)
+        maxlen      approximate max stream length kept by XADD (default 100000)
+    all:
+        format      json (default) or binary (a3.messaging.serdes.binary_serdes),
+                    binary also accepts JSON messages and replies to them in JSON
+        strip       comma separated fields of the request not echoed back in replies,
+                    e.g. sdp,cc,vv for peers not reading them (default empty - replies carry all fields)
 """
 
 import transport
 import serdes
 import message
 import serdes_transport
+import recorder
 from .transport import IMessageListener
 from .message import Message
+from .inbound_queue import InboundQueue
+from .batch import Batch, point_ids
 
 from ..config import MessageQueueUrl
 
 
+DEFAULT_STRIP = ""
+
+
 def _create_transport(url):
     assert type(url) is MessageQueueUrl
 
     if url.protocol == "amqp":
-        return transport.RabbitmqTransport(url.server, url.port, url.channel)
+        amqp = transport.rabbitmq_transport
+        return transport.RabbitmqTransport(url.server, url.port, url.channel,
+                                           prefetch=url.int_param("prefetch", amqp.DEFAULT_PREFETCH),
+                                           ack_batch=url.int_param("ack-batch", amqp.DEFAULT_ACK_BATCH),
+                                           batch_size=url.int_param("batch", amqp.DEFAULT_BATCH_SIZE),
+                                           flush_interval=url.int_param("flush-ms", 1) / 1000.0)
     elif url.protocol == "redis":
-        return transport.RedisTransport(url.server, url.port, url.channel)
+        return transport.RedisTransport(url.server, url.port, url.channel,
+                                        batch_size=url.int_param("batch", transport.redis_transport.DEFAULT_BATCH_SIZE),
+                                        flush_interval=url.int_param("flush-ms", 1) / 1000.0)
+    elif url.protocol == "loopback":
+        return transport.LoopbackTransport(url.channel)
+    elif url.protocol == "redis+streams":
+        streams = transport.redis_streams_transport
+        return transport.RedisStreamsTransport(url.server, url.port, url.channel,
+                                               group=url.param("group"),
+                                               consumer=url.param("consumer"),
+                                               batch_size=url.int_param("batch", streams.DEFAULT_BATCH_SIZE),
+                                               flush_interval=url.int_param("flush-ms", 1) / 1000.0,
+                                               ack_batch=url.int_param("ack-batch", streams.DEFAULT_ACK_BATCH),
+                                               block_ms=url.int_param("block-ms", streams.DEFAULT_BLOCK_MS),
+                                               maxlen=url.int_param("maxlen", streams.DEFAULT_MAXLEN))
     else:
         raise Exception("Unknown protocol for MQ: ")
 
 
-def create(url, listener=None):
+def _create_serdes(url):
+    assert type(url) is MessageQueueUrl
+    message_factory = message.Factory()
+    fmt = url.param("format", "json")
+    if fmt == "json":
+        return serdes.JsonSerDes(message_factory)
+    elif fmt == "binary":
+        return serdes.BinarySerDes(message_factory, fallback=serdes.JsonSerDes(message_factory))
+    else:
+        raise Exception("Unknown message format for MQ: " + fmt)
+
+
+def create(url, listener=None, loop=None, recorder=None):
     """
     Parse url and create message queue object
+    if loop (a3.eventloop.EventLoop) is given, outgoing messages are flushed on it, the queue is still read in own thread
+    if recorder (a3.messaging.recorder.Recorder) is given, all messages are recorded
     """
     assert type(url) is MessageQueueUrl
     assert listener is None or isinstance(listener, IMessageListener)
 
-    fmt = serdes.JsonSerDes(message.Factory())
-    t = serdes_transport.SerDesTransport(
-        transport.ThreadedMessagingTransport(_create_transport(url)),
-        fmt)
+    if loop is not None:
+        t = transport.EventLoopMessagingTransport(_create_transport(url), loop)
+    else:
+        t = transport.ThreadedMessagingTransport(_create_transport(url))
+
+    strip = [name for name in url.param("strip", DEFAULT_STRIP).split(",") if name]
+    t = serdes_transport.SerDesTransport(t, _create_serdes(url), strip=strip, recorder=recorder)
     t.listener = listener
     return t
 
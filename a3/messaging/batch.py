@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+Bulk requests
+
+Bulk message carries requests of many points in "points": [{<fields of one request>}, ...].
+Batch makes every entry a message of its own (BatchItem), an overlay on the bulk message,
+so fields common to all entries (sender, roomId, ...) are sent once in the bulk message.
+
+The first reply of every item is collected instead of being sent, when all items are done
+one reply is sent to the bulk message:
+    {"type": <reply type>, "results": [{"type": <item reply type>, "pointId": ..., <item reply fields>}, ...]}
+results are in order of "points". Item without reply on success (e.g. JOIN_ROOM) is finished with done(),
+its result type is DONE. Replies after the first one (e.g. CREATE_MEDIA_POINT_OK after SDP_ANSWER)
+are sent as usual replies of the item.
+
+Example:
+    batch = Batch(message, "JOIN_ROOM", "JOIN_ROOMS_OK")
+    for item in batch.items:
+        handle(item)
+        item.done()
+"""
+
+__author__ = 'RCSLabs'
+
+
+from .message import Message
+
+import threading
+
+
+ITEMS = "points"
+DONE = "OK"
+
+
+def point_ids(message):
+    """
+    :return: pointId of message, pointIds of items of bulk message, [] - message of no point
+    """
+    if message.has("pointId"):
+        return [message.point_id]
+    return [str(entry["pointId"]) for entry in message.get(ITEMS) or [] if "pointId" in entry]
+
+
+class BatchItem(Message):
+    def __init__(self, batch, index, type_, data, parent):
+        Message.__init__(self, type_, data, parent)
+        self.transport = parent.transport
+        self.serdes = parent.serdes
+        self.__batch = batch
+        self.__index = index
+
+    def reply(self, message_type, data=None):
+        if not self.__batch._collect(self.__index, self.get("pointId"), message_type, data):
+            Message.reply(self, message_type, data)
+
+    def done(self):
+        """
+        finish item which has not replied
+        """
+        self.__batch._collect(self.__index, self.get("pointId"), DONE, None)
+
+
+class Batch(object):
+    def __init__(self, message, item_type, reply_type):
+        """
+        :param message: received bulk message
+        :param item_type: message type of items
+        :param reply_type: type of aggregated reply
+        """
+        assert isinstance(message, Message)
+        assert type(item_type) is str
+        assert type(reply_type) is str
+        # replies and items must not echo the whole bulk
+        self.__base = Message(message.type, parent=message)
+        self.__base.delete(ITEMS)
+        self.__base.transport = message.transport
+        self.__base.serdes = message.serdes
+        self.__reply_type = reply_type
+        self.__lock = threading.Lock()
+
+        entries = message.get(ITEMS) or []
+        self.__results = [None] * len(entries)
+        self.__left = len(entries)
+        self.__items = [BatchItem(self, index, item_type, dict((str(name), value) for (name, value) in entry.items()),
+                                  self.__base)
+                        for (index, entry) in enumerate(entries)]
+        if not self.__items:
+            self.__base.reply(self.__reply_type, {"results": []})
+
+    @property
+    def items(self):
+        return list(self.__items)
+
+    def _collect(self, index, point_id, message_type, data):
+        """
+        :return: False if item is already done (reply is to be sent as usual)
+        """
+        with self.__lock:
+            if self.__results[index] is not None:
+                return False
+            result = dict(data or {})
+            result["type"] = message_type
+            if point_id is not None:
+                result["pointId"] = point_id
+            self.__results[index] = result
+            self.__left -= 1
+            finished = self.__left == 0
+        if finished:
+            self.__base.reply(self.__reply_type, {"results": self.__results})
+        return True
+
+
+if __name__ == "__main__":
+    import unittest
+    from .transport import MessagingTransport
+
+    class _Transport(MessagingTransport):
+        def __init__(self):
+            MessagingTransport.__init__(self)
+            self.sent = []
+
+        def send_message(self, message, channel=None):
+            self.sent.append(message)
+
+        def listen(self):
+            pass
+
+        channel_name = "mc"
+
+    class BatchTest(unittest.TestCase):
+        def setUp(self):
+            self.transport = _Transport()
+            self.message = Message("JOIN_ROOMS", {"sender": "app", "roomId": "r",
+                                                  ITEMS: [{"pointId": "a"}, {"pointId": "b"}]})
+            self.message.transport = self.transport
+
+        def test_aggregated_reply(self):
+            batch = Batch(self.message, "JOIN_ROOM", "JOIN_ROOMS_OK")
+            (a, b) = batch.items
+            self.assertEqual((a.type, a.point_id, a.room_id), ("JOIN_ROOM", "a", "r"))
+            self.assertFalse(a.has(ITEMS))
+            b.reply("JOIN_ROOM_FAILED", {"reason": "full"})
+            self.assertEqual(self.transport.sent, [])
+            a.done()
+            (reply,) = self.transport.sent
+            self.assertEqual((reply.type, reply.channel), ("JOIN_ROOMS_OK", "app"))
+            self.assertFalse(reply.has(ITEMS))
+            self.assertEqual(reply.get("results"), [{"type": DONE, "pointId": "a"},
+                                                    {"type": "JOIN_ROOM_FAILED", "pointId": "b", "reason": "full"}])
+
+        def test_later_replies(self):
+            batch = Batch(self.message, "CREATE_MEDIA_POINT", "CREATE_MEDIA_POINTS_OK")
+            for item in batch.items:
+                item.reply("SDP_OFFER", {"sdp": "v=0"})
+            batch.items[0].reply("CREATE_MEDIA_POINT_OK")
+            self.assertEqual([m.type for m in self.transport.sent], ["CREATE_MEDIA_POINTS_OK", "CREATE_MEDIA_POINT_OK"])
+            self.assertEqual(self.transport.sent[1].point_id, "a")
+
+        def test_point_ids(self):
+            self.assertEqual(point_ids(self.message), ["a", "b"])
+            self.assertEqual(point_ids(Message("REMOVE_MEDIA_POINT", {"pointId": "a"})), ["a"])
+            self.assertEqual(point_ids(Message("GET_LOAD")), [])
+
+        def test_empty(self):
+            self.message.delete(ITEMS)
+            Batch(self.message, "JOIN_ROOM", "JOIN_ROOMS_OK")
+            self.assertEqual(self.transport.sent[0].get("results"), [])
+
+    unittest.main()
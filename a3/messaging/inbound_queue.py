@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""
+Bounded priority queue between transport and listener
+
+Received messages are queued and handed to the listener by own thread,
+most urgent first (lower priority value), in arrival order within a priority.
+A message never overtakes earlier queued messages sharing a key with it
+(e.g. REMOVE of a point waits for CREATE of that point still in queue),
+a message may have many keys (bulk message of many points).
+
+When the queue is full, receiving blocks (backpressure to the transport).
+When depth reaches high_watermark, messages for which shed(message) is true
+are not queued and overload(message) is called instead (e.g. reply FAILED).
+
+Metrics:
+    <name>.depth        queued messages (gauge)
+    <name>.wait         time in queue (histogram)
+    <name>.shed         messages rejected above high watermark (counter)
+"""
+
+
+from transport import IMessageListener
+from ..logging import LOG
+from ..metrics import METRICS
+
+import heapq
+import itertools
+import threading
+import time
+
+
+class InboundQueue(IMessageListener):
+    def __init__(self, listener, size, high_watermark,
+                 priority=lambda message: 0,
+                 keys=lambda message: (),
+                 shed=lambda message: False,
+                 overload=lambda message: None,
+                 name="mq.inbound"):
+        assert isinstance(listener, IMessageListener)
+        assert type(size) is int and size > 0
+        assert type(high_watermark) is int and 0 < high_watermark <= size
+        self.__listener = listener
+        self.__size = size
+        self.__high_watermark = high_watermark
+        self.__priority = priority
+        self.__keys = keys
+        self.__shed = shed
+        self.__overload = overload
+
+        self.__heap = []
+        self.__sequence = itertools.count()
+        self.__pending = {}                         # key -> [count, max priority queued]
+        self.__changed = threading.Condition()
+
+        self.__depth_gauge = METRICS.gauge("%s.depth" % name)
+        self.__wait_histogram = METRICS.histogram("%s.wait" % name)
+        self.__shed_counter = METRICS.counter("%s.shed" % name)
+
+        thread = threading.Thread(target=self.__run, name=name)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def depth(self):
+        return len(self.__heap)
+
+    def on_message(self, message, transport):
+        priority = self.__priority(message)
+        keys = tuple(set(self.__keys(message)))
+        with self.__changed:
+            if len(self.__heap) >= self.__high_watermark and self.__shed(message):
+                shed = True
+            else:
+                shed = False
+                while len(self.__heap) >= self.__size:
+                    self.__changed.wait()
+                for key in keys:
+                    pending = self.__pending.get(key)
+                    if pending is not None:
+                        priority = max(pending[1], priority)
+                for key in keys:
+                    pending = self.__pending.get(key)
+                    if pending is None:
+                        pending = self.__pending[key] = [0, priority]
+                    pending[0] += 1
+                    pending[1] = max(pending[1], priority)
+                heapq.heappush(self.__heap, (priority, next(self.__sequence), time.time(),
+                                             keys, message, transport))
+                self.__depth_gauge.set(len(self.__heap))
+                self.__changed.notify_all()
+
+        if shed:
+            self.__shed_counter.inc()
+            LOG.warning("InboundQueue: overloaded (%d queued), rejecting %s", len(self.__heap), message.type)
+            self.__overload(message)
+
+    def __run(self):
+        while True:
+            with self.__changed:
+                while not self.__heap:
+                    self.__changed.wait()
+                (_, _, queued, keys, message, transport) = heapq.heappop(self.__heap)
+                for key in keys:
+                    pending = self.__pending[key]
+                    pending[0] -= 1
+                    if pending[0] == 0:
+                        del self.__pending[key]
+                self.__depth_gauge.set(len(self.__heap))
+                self.__changed.notify_all()
+
+            self.__wait_histogram.observe(time.time() - queued)
+            try:
+                self.__listener.on_message(message, transport)
+            except Exception:
+                LOG.exception("InboundQueue: listener failed")
+
+
+if __name__ == "__main__":
+    import unittest
+    from .message import Message
+    from .batch import ITEMS, point_ids
+
+    class _Listener(IMessageListener):
+        """
+        records handled messages, HOLD message blocks the queue thread until release()
+        """
+        def __init__(self):
+            self.handled = []
+            self.holding = threading.Event()
+            self.gate = threading.Event()
+            self.changed = threading.Condition()
+
+        def on_message(self, message, transport):
+            if message.type == "HOLD":
+                self.holding.set()
+                self.gate.wait()
+            with self.changed:
+                self.handled.append(message.get("name", message.type))
+                self.changed.notify_all()
+
+        def release(self):
+            self.gate.set()
+
+        def wait(self, count):
+            with self.changed:
+                deadline = time.time() + 2
+                while len(self.handled) < count and time.time() < deadline:
+                    self.changed.wait(0.1)
+            return self.handled
+
+    def _message(type_, name, *point_ids):
+        return Message(type_, {"name": name, "pointIds": list(point_ids)})
+
+    PRIORITIES = {"REMOVE": 0, "ANSWER": 1, "CREATE": 2, "REMOVE_MEDIA_POINTS": 0, "CREATE_MEDIA_POINTS": 2}
+
+    class InboundQueueTest(unittest.TestCase):
+        def queue(self, size=10, high_watermark=10, keys=lambda message: message.get("pointIds", []), **kwargs):
+            self.listener = _Listener()
+            queue = InboundQueue(self.listener, size, high_watermark,
+                                 priority=lambda message: PRIORITIES.get(message.type, 0),
+                                 keys=keys, name="test.inbound", **kwargs)
+            queue.on_message(Message("HOLD"), None)
+            self.assertTrue(self.listener.holding.wait(2))
+            return queue
+
+        def test_priority_order(self):
+            queue = self.queue()
+            for (type_, name) in (("CREATE", "c"), ("REMOVE", "r"), ("ANSWER", "a")):
+                queue.on_message(_message(type_, name), None)
+            self.listener.release()
+            self.assertEqual(self.listener.wait(4), ["HOLD", "r", "a", "c"])
+
+        def test_arrival_order_within_priority(self):
+            queue = self.queue()
+            for i in range(5):
+                queue.on_message(_message("ANSWER", i), None)
+            self.listener.release()
+            self.assertEqual(self.listener.wait(6), ["HOLD", 0, 1, 2, 3, 4])
+
+        def test_key_order_kept(self):
+            queue = self.queue()
+            queue.on_message(_message("CREATE", "create p", "p"), None)
+            queue.on_message(_message("REMOVE", "remove p", "p"), None)
+            queue.on_message(_message("REMOVE", "remove q", "q"), None)
+            queue.on_message(_message("ANSWER", "answer p", "p"), None)
+            self.listener.release()
+            self.assertEqual(self.listener.wait(5), ["HOLD", "remove q", "create p", "remove p", "answer p"])
+            # key is forgotten when its messages are handled
+            self.listener.gate.clear()
+            self.listener.holding.clear()
+            queue.on_message(Message("HOLD"), None)
+            self.assertTrue(self.listener.holding.wait(2))
+            queue.on_message(_message("CREATE", "create q", "q"), None)
+            queue.on_message(_message("REMOVE", "remove p", "p"), None)
+            self.listener.release()
+            self.assertEqual(self.listener.wait(8)[5:], ["HOLD", "remove p", "create q"])
+
+        def test_many_keys(self):
+            queue = self.queue()
+            queue.on_message(_message("CREATE", "create p q", "p", "q"), None)
+            queue.on_message(_message("REMOVE", "remove q r", "q", "r"), None)
+            queue.on_message(_message("REMOVE", "remove r", "r"), None)
+            queue.on_message(_message("REMOVE", "remove s", "s"), None)
+            self.listener.release()
+            self.assertEqual(self.listener.wait(5), ["HOLD", "remove s", "create p q", "remove q r", "remove r"])
+
+        def test_bulk_remove_waits_for_create(self):
+            queue = self.queue(keys=point_ids)
+            points = [{"pointId": "p"}, {"pointId": "q"}]
+            queue.on_message(Message("CREATE_MEDIA_POINTS", {ITEMS: points}), None)
+            queue.on_message(Message("REMOVE_MEDIA_POINTS", {ITEMS: points[1:], "name": "remove q"}), None)
+            queue.on_message(Message("REMOVE_MEDIA_POINTS", {ITEMS: [{"pointId": "r"}], "name": "remove r"}), None)
+            queue.on_message(Message("REMOVE_MEDIA_POINT", {"pointId": "p", "name": "remove p"}), None)
+            self.listener.release()
+            # removes of created points do not overtake the bulk create
+            self.assertEqual(self.listener.wait(5), ["HOLD", "remove r", "CREATE_MEDIA_POINTS", "remove q", "remove p"])
+
+        def test_shed_above_watermark(self):
+            overloaded = []
+            queue = self.queue(high_watermark=2,
+                               shed=lambda message: message.type == "CREATE",
+                               overload=lambda message: overloaded.append(message.get("name")))
+            shed = METRICS.counter("test.inbound.shed").value
+            for name in ("c1", "c2", "c3"):
+                queue.on_message(_message("CREATE", name), None)
+            queue.on_message(_message("REMOVE", "r"), None)
+            self.assertEqual(overloaded, ["c3"])
+            self.assertEqual(METRICS.counter("test.inbound.shed").value - shed, 1)
+            self.assertEqual(queue.depth, 3)
+            self.listener.release()
+            self.assertEqual(self.listener.wait(4), ["HOLD", "r", "c1", "c2"])
+
+        def test_full_queue_blocks(self):
+            queue = self.queue(size=2, high_watermark=2)
+            for name in ("a1", "a2"):
+                queue.on_message(_message("ANSWER", name), None)
+            producer = threading.Thread(target=queue.on_message, args=(_message("ANSWER", "a3"), None))
+            producer.daemon = True
+            producer.start()
+            producer.join(0.2)
+            self.assertTrue(producer.is_alive())
+            self.assertEqual(queue.depth, 2)
+            self.listener.release()
+            producer.join(2)
+            self.assertFalse(producer.is_alive())
+            self.assertEqual(self.listener.wait(4), ["HOLD", "a1", "a2", "a3"])
+
+    unittest.main()
@@ -10,14 +10,25 @@ from serdes import IMessage, ISerDes
 from transport import MessagingTransport
 
 
+_DELETED = object()
+
+
 class Message(IMessage):
     """
     Message implementation
+
+    fields set on the message are kept in own data,
+    fields not set here are inherited from the parent message (or the received frame, see LazyMessage)
+
+    forward()/reply() create an overlay on the original message: only the fields passed
+    in data are stored, the rest are read through the parent, nothing is copied
     """
-    def __init__(self, type_, data=None):
+    def __init__(self, type_, data=None, parent=None):
         assert type(type_) is str
+        assert parent is None or isinstance(parent, Message)
         self.__type = type_
-        self.__data = data if data is not None else {}
+        self._data = data if data is not None else {}
+        self._parent = parent
 
         self.__channel = None
         self.__serdes = None
@@ -59,6 +70,10 @@ class Message(IMessage):
         assert not "MESSAGE TYPE SETTER DEPRECATED"
         #self.__type = val
 
+    @property
+    def parent(self):
+        return self._parent
+
     @property
     def sender(self):
         return str(self.get("sender"))
@@ -77,32 +92,61 @@ class Message(IMessage):
         return str(self.get("roomId"))
 
     def set(self, key, value):
-        self.__data[key] = value
+        self._data[key] = value
 
     def get(self, key, default_value=None):
-        return self.__data[key] if key in self.__data else default_value
+        if key in self._data:
+            value = self._data[key]
+            return default_value if value is _DELETED else value
+        return self._inherited_get(key, default_value)
 
     def has(self, key):
-        return key in self.__data
+        if key in self._data:
+            return self._data[key] is not _DELETED
+        return self._inherited_has(key)
+
+    def keys(self):
+        if self._parent is None:
+            return self._data.keys()
+        return self._merged_keys()
 
     def all(self):
-        return self.__data.iteritems()
+        if self._parent is None:
+            return self._data.iteritems()
+        return self._merged_items()
 
     def delete(self, name):
-        if name in self.__data:
-            del self.__data[name]
+        if self._inherited_has(name):
+            self._data[name] = _DELETED
+        elif name in self._data:
+            del self._data[name]
 
     def extend(self, data=None):
         if data is not None:
             for name, value in data.iteritems():
                 self.set(name, value)
 
+    def strip_inherited(self, names):
+        """
+        hide inherited fields, fields set on this message are kept
+        """
+        for name in names:
+            if name not in self._data and self._inherited_has(name):
+                self._data[name] = _DELETED
+
+    def raw_field(self, key):
+        """
+        return encoded field as it was received if the value is unchanged, else None
+        """
+        if key in self._data or self._parent is None:
+            return None
+        return self._parent.raw_field(key)
+
     def forward(self, channel, message_type, data=None):
         assert type(channel) is str
         assert type(message_type) is str
 
-        m = Message(message_type)
-        m.extend(self.__data)
+        m = Message(message_type, parent=self)
         m.extend(data)
 
         m.transport = self.transport
@@ -120,13 +164,90 @@ class Message(IMessage):
     def to_str(self, spaces):
         s = " " * spaces
         result = s + "type=" + repr(self.type) + "\n"
-        for n, v in self.__data.iteritems():
+        for n, v in self.all():
             vv = str(v).replace("\n", "\\n").replace("\r", "")
             if len(vv) > 60:
                 vv = vv[:60] + "..."
             result += s + str(n) + "=" + vv + "\n"
         return result
 
+    #
+    # inherited fields
+    #
+    def _inherited_get(self, key, default_value):
+        return self._parent.get(key, default_value) if self._parent is not None else default_value
+
+    def _inherited_has(self, key):
+        return self._parent is not None and self._parent.has(key)
+
+    def _inherited_keys(self):
+        return self._parent.keys() if self._parent is not None else []
+
+    def _merged_keys(self):
+        result = [key for (key, value) in self._data.iteritems() if value is not _DELETED]
+        result.extend(key for key in self._inherited_keys() if key not in self._data)
+        return result
+
+    def _merged_items(self):
+        return ((key, self.get(key)) for key in self._merged_keys())
+
+
+class LazyMessage(Message):
+    """
+    Message over a received frame
+    field values are decoded on first get()/has()/all(), forwarded messages refer to this one
+    so unchanged fields are re-emitted from the frame without re-encoding
+    decoded values must be treated as read-only, use set() to change them
+    """
+    def __init__(self, type_, raw, index, decode):
+        """
+        :param raw: received frame
+        :param index: list of (key, tag, value offset, value length, field offset, field end)
+        :param decode: function(tag, bytes) -> value
+        """
+        assert type(raw) is str
+        Message.__init__(self, type_)
+        self.__raw = raw
+        self.__keys = []
+        self.__index = {}
+        for entry in index:
+            self.__keys.append(entry[0])
+            self.__index[entry[0]] = entry[1:]
+        self.__decode = decode
+        self.__decoded = {}
+
+    @property
+    def raw(self):
+        return self.__raw
+
+    def keys(self):
+        return self._merged_keys()
+
+    def all(self):
+        return self._merged_items()
+
+    def raw_field(self, key):
+        if key in self._data or key not in self.__index:
+            return None
+        _, _, _, field_offset, field_end = self.__index[key]
+        return self.__raw[field_offset:field_end]
+
+    def _inherited_get(self, key, default_value):
+        if key in self.__decoded:
+            return self.__decoded[key]
+        if key not in self.__index:
+            return default_value
+        tag, offset, length, _, _ = self.__index[key]
+        value = self.__decode(tag, self.__raw[offset:offset + length])
+        self.__decoded[key] = value
+        return value
+
+    def _inherited_has(self, key):
+        return key in self.__index
+
+    def _inherited_keys(self):
+        return self.__keys
+
 
 class Factory(object):
     def create_message(self, message_type):
@@ -134,3 +255,99 @@ class Factory(object):
         m = Message(message_type)
         return m
 
+    def create_lazy_message(self, message_type, raw, index, decode):
+        assert type(message_type) is str
+        return LazyMessage(message_type, raw, index, decode)
+
+
+if __name__ == "__main__":
+    import unittest
+
+    class MessageOverlayTest(unittest.TestCase):
+        def setUp(self):
+            self.parent = Message("CREATE_MEDIA_POINT", {"pointId": "p1", "sender": "app", "sdp": "v=0"})
+            self.message = Message("SDP_OFFER", parent=self.parent)
+
+        def test_read_through(self):
+            self.assertEqual(self.message.get("pointId"), "p1")
+            self.assertTrue(self.message.has("sdp"))
+            self.assertEqual(self.message.get("missing", 1), 1)
+            self.assertEqual(sorted(self.message.keys()), ["pointId", "sdp", "sender"])
+            self.assertEqual(self.message._data, {})
+
+        def test_override(self):
+            self.message.set("sdp", "v=1")
+            self.assertEqual(self.message.get("sdp"), "v=1")
+            self.assertEqual(self.parent.get("sdp"), "v=0")
+            self.assertEqual(dict(self.message.all()), {"pointId": "p1", "sender": "app", "sdp": "v=1"})
+
+        def test_delete(self):
+            self.message.delete("sdp")
+            self.assertFalse(self.message.has("sdp"))
+            self.assertEqual(self.message.get("sdp", "none"), "none")
+            self.assertTrue(self.parent.has("sdp"))
+            self.assertEqual(sorted(self.message.keys()), ["pointId", "sender"])
+            self.assertEqual(dict(self.message.all()), {"pointId": "p1", "sender": "app"})
+            # set after delete shows the field again, delete of own field drops it
+            self.message.set("sdp", "v=1")
+            self.assertEqual(self.message.get("sdp"), "v=1")
+            self.message.set("own", 1)
+            self.message.delete("own")
+            self.assertFalse("own" in self.message.keys())
+
+        def test_strip_inherited(self):
+            self.message.set("sdp", "v=1")
+            self.message.strip_inherited(["sdp", "sender", "missing"])
+            self.assertEqual(self.message.get("sdp"), "v=1")
+            self.assertFalse(self.message.has("sender"))
+            self.assertFalse(self.message.has("missing"))
+            self.assertEqual(sorted(self.message.keys()), ["pointId", "sdp"])
+
+        def test_raw_field(self):
+            # plain messages have no received frame
+            self.assertEqual(self.message.raw_field("pointId"), None)
+            self.assertEqual(self.parent.raw_field("pointId"), None)
+
+    class LazyMessageTest(unittest.TestCase):
+        FIELDS = {"pointId": "p1", "sender": "app", "sdp": "v=0\r\n", "vv": [True, False], "port": 5004}
+
+        def setUp(self):
+            from serdes import BinarySerDes
+            self.serdes = BinarySerDes(Factory())
+            message = Message("CREATE_MEDIA_POINT", dict(self.FIELDS))
+            self.frame = self.serdes.serialize(message)
+            self.message = self.serdes.deserialize(self.frame)
+
+        def decoded(self):
+            return sorted(self.message._LazyMessage__decoded.keys())
+
+        def test_decode_on_access(self):
+            self.assertTrue(isinstance(self.message, LazyMessage))
+            self.assertEqual(sorted(self.message.keys()), sorted(self.FIELDS.keys()))
+            self.assertTrue(self.message.has("sdp"))
+            self.assertEqual(self.decoded(), [])
+            names = []
+            for name in sorted(self.FIELDS.keys()):
+                self.assertEqual(self.message.get(name), self.FIELDS[name])
+                names.append(name)
+                self.assertEqual(self.decoded(), names)
+            self.assertEqual(dict(self.message.all()), self.FIELDS)
+
+        def test_reply_reuses_raw_fields(self):
+            reply = Message("SDP_OFFER", parent=self.message)
+            reply.set("sdp", "v=1\r\n")
+            reply.delete("vv")
+            frame = self.serdes.serialize(reply)
+            # unchanged fields are copied from the received frame without decoding
+            self.assertEqual(self.decoded(), [])
+            from serdes.binary_serdes import MAGIC, encode_field
+            expected = [MAGIC, encode_field("type", "SDP_OFFER"), encode_field("sdp", "v=1\r\n")]
+            expected.extend(self.message.raw_field(name) for name in self.message.keys() if name not in ("sdp", "vv"))
+            self.assertEqual(frame, "".join(expected))
+            self.assertTrue(self.message.raw_field("sender") in self.frame)
+            self.assertEqual(reply.raw_field("sdp"), None)
+            expected = dict(self.FIELDS, sdp="v=1\r\n")
+            del expected["vv"]
+            self.assertEqual(dict(self.serdes.deserialize(frame).all()), expected)
+
+    unittest.main()
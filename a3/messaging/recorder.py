@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""
+Bus traffic recorder
+
+SerDesTransport writes each received and sent message as one JSON line:
+    {"t": <unix time>, "dir": "in" | "out", "channel": <channel>, "message": {"type": ..., <fields>}}
+
+"channel" is the destination of sent messages and own channel for received ones.
+Recordings are replayed with replay.py.
+"""
+
+
+import json
+import threading
+import time
+
+
+class Recorder(object):
+    def __init__(self, path):
+        assert type(path) is str
+        self.__file = open(path, "a")
+        self.__lock = threading.Lock()
+
+    def record(self, direction, channel, message):
+        fields = dict(message.all())
+        fields["type"] = message.type
+        line = json.dumps({"t": time.time(), "dir": direction, "channel": channel, "message": fields},
+                          default=str)
+        with self.__lock:
+            self.__file.write(line + "\n")
+            self.__file.flush()
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
+
+
+def read_records(path):
+    """
+    yield recorded dicts in file order
+    """
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
@@ -1,2 +1,3 @@
 from base import IMessage, ISerDes, ParseException
-from json_serdes import JsonSerDes
\ No newline at end of file
+from json_serdes import JsonSerDes
+from binary_serdes import BinarySerDes
\ No newline at end of file
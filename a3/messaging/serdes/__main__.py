@@ -0,0 +1,68 @@
+#! /usr/bin/env python
+"""
+a3.messaging.serdes micro-benchmark: JSON vs binary
+execute:
+    # python -m a3.messaging.serdes [iterations]
+
+Payloads are a Chrome CREATE_MEDIA_POINT and SDP_ANSWER messages
+with SDP taken from a3/sdp/sdp-test
+"""
+
+__author__ = 'RCSLabs'
+
+
+from ..message import Factory
+from ..serdes import JsonSerDes, BinarySerDes
+
+import os
+import sys
+import timeit
+
+
+SDP_TEST_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "sdp", "sdp-test")
+
+
+def read_sdp(name):
+    with open(os.path.join(SDP_TEST_DIR, name)) as f:
+        lines = [line.rstrip("\r\n") for line in f if not line.startswith("#") and line.strip()]
+    return "\r\n".join(lines) + "\r\n"
+
+
+def create_messages(factory):
+    create = factory.create_message("CREATE_MEDIA_POINT")
+    create.set("pointId", "4e6f1b2a-0d6b-4c1e-9b0e-4f9c0a8d1e77")
+    create.set("sender", "app-server:7f3c")
+    create.set("profile", "external")
+    create.set("cc", {"userAgent": "Chrome",
+                      "profile": "RTP/SAVPF",
+                      "ice": True,
+                      "rtcpMux": True,
+                      "ssrcRequired": True,
+                      "audio": ["opus/48000/2", "ISAC/16000", "ISAC/32000", "PCMU/8000", "PCMA/8000",
+                                "telephone-event/8000"],
+                      "video": ["VP8/90000", "red/90000", "ulpfec/90000"]})
+    create.set("vv", [True, True])
+
+    answer = factory.create_message("SDP_ANSWER")
+    answer.set("pointId", "4e6f1b2a-0d6b-4c1e-9b0e-4f9c0a8d1e77")
+    answer.set("sender", "app-server:7f3c")
+    answer.set("sdp", read_sdp("0017.sdp.txt"))
+
+    return [create, answer]
+
+
+def bench(name, serdes, message, iterations):
+    data = serdes.serialize(message)
+    serialize = timeit.timeit(lambda: serdes.serialize(message), number=iterations)
+    deserialize = timeit.timeit(lambda: serdes.deserialize(data), number=iterations)
+    print "%-20s %-8s %6d bytes  serialize %7.2f us  deserialize %7.2f us" % (
+        message.type, name, len(data), serialize * 1e6 / iterations, deserialize * 1e6 / iterations)
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    factory = Factory()
+    formats = [("json", JsonSerDes(factory)), ("binary", BinarySerDes(factory))]
+    for message in create_messages(factory):
+        for (name, serdes) in formats:
+            bench(name, serdes, message, iterations)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+Compact binary message format
+
+    frame := MAGIC field*
+    field := key-length (1 byte) key tag (1 byte) value-length (4 bytes, big-endian) value
+
+Strings (SDP included) are copied as they are, without escaping.
+Nested lists and dicts (cc, vv) are small and kept as JSON.
+"type" is always the first field.
+
+Frames that do not start with MAGIC are passed to the fallback serdes (JSON),
+so peers that have not upgraded keep working; replies to them use JSON too.
+
+deserialize() only indexes the fields and decodes "type", values are decoded
+on first access (see message.LazyMessage). serialize() copies fields that were
+received and not changed from the original frame as they are.
+"""
+
+
+from base import ISerDes, ParseException, IMessage
+import json
+import logging
+import struct
+
+
+LOGGER = logging.getLogger("MC")
+
+
+MAGIC = "\xa3\x01"
+
+_VALUE = struct.Struct(">cI")
+_INT = struct.Struct(">q")
+_FLOAT = struct.Struct(">d")
+
+TAG_STR = "s"
+TAG_UNICODE = "u"
+TAG_INT = "i"
+TAG_FLOAT = "f"
+TAG_TRUE = "t"
+TAG_FALSE = "F"
+TAG_NONE = "n"
+TAG_JSON = "j"
+
+_TAGS = frozenset((TAG_STR, TAG_UNICODE, TAG_INT, TAG_FLOAT, TAG_TRUE, TAG_FALSE, TAG_NONE, TAG_JSON))
+
+
+def encode_value(value):
+    """
+    return (tag, bytes)
+    """
+    t = type(value)
+    if t is str:
+        return TAG_STR, value
+    if t is unicode:
+        return TAG_UNICODE, value.encode("utf-8")
+    if t is bool:
+        return (TAG_TRUE if value else TAG_FALSE), ""
+    if t is int or t is long:
+        return TAG_INT, _INT.pack(value)
+    if t is float:
+        return TAG_FLOAT, _FLOAT.pack(value)
+    if value is None:
+        return TAG_NONE, ""
+    return TAG_JSON, json.dumps(value)
+
+
+def decode_value(tag, data):
+    if tag == TAG_STR:
+        return data
+    if tag == TAG_UNICODE:
+        return data.decode("utf-8")
+    if tag == TAG_INT:
+        return _INT.unpack(data)[0]
+    if tag == TAG_FLOAT:
+        return _FLOAT.unpack(data)[0]
+    if tag == TAG_TRUE:
+        return True
+    if tag == TAG_FALSE:
+        return False
+    if tag == TAG_NONE:
+        return None
+    if tag == TAG_JSON:
+        return json.loads(data)
+    raise ParseException("Unknown value tag %r" % tag)
+
+
+def encode_field(key, value):
+    assert type(key) is str and len(key) < 256
+    if type(value) is str:
+        tag, data = TAG_STR, value
+    else:
+        tag, data = encode_value(value)
+    return chr(len(key)) + key + _VALUE.pack(tag, len(data)) + data
+
+
+def iter_fields(string, offset=len(MAGIC)):
+    """
+    yield (key, tag, value offset, value length, field offset, field end) without decoding values,
+    non-ascii keys are unicode (as they are after JSON)
+    """
+    length = len(string)
+    unpack_value = _VALUE.unpack_from
+    try:
+        while offset < length:
+            key_end = offset + 1 + ord(string[offset])
+            tag, value_length = unpack_value(string, key_end)
+            if tag not in _TAGS:
+                raise ParseException("Unknown value tag %r" % tag)
+            value_offset = key_end + _VALUE.size
+            value_end = value_offset + value_length
+            if value_end > length:
+                raise ParseException("Truncated field")
+            key = string[offset + 1:key_end]
+            try:
+                key.decode("ascii")
+            except UnicodeDecodeError:
+                key = key.decode("utf-8")
+            yield key, tag, value_offset, value_length, offset, value_end
+            offset = value_end
+    except (struct.error, IndexError, UnicodeDecodeError):
+        raise ParseException("Corrupted binary message")
+
+
+class BinarySerDes(ISerDes):
+    """
+    Accepts messages in binary format, falls back to another serdes for other formats
+    """
+    def __init__(self, message_factory, fallback=None):
+        assert fallback is None or isinstance(fallback, ISerDes)
+        self.__message_factory = message_factory
+        self.__fallback = fallback
+
+    def serialize(self, message):
+        assert isinstance(message, IMessage)
+        chunks = [MAGIC, encode_field("type", message.type)]
+        for name in message.keys():
+            raw = message.raw_field(name)
+            if raw is None:
+                raw = encode_field(name.encode("utf-8") if type(name) is unicode else name, message.get(name))
+            chunks.append(raw)
+        return "".join(chunks)
+
+    def deserialize(self, string):
+        assert type(string) is str
+        if not string.startswith(MAGIC):
+            if self.__fallback is None:
+                raise ParseException("Not a binary message")
+            return self.__fallback.deserialize(string)
+
+        index = list(iter_fields(string))
+        if not index or index[0][0] != "type":
+            raise ParseException("No message type")
+        (_, tag, offset, length, _, _) = index[0]
+        message_type = str(decode_value(tag, string[offset:offset + length]))
+
+        message = self.__message_factory.create_lazy_message(message_type, string, index[1:], decode_value)
+        message.serdes = self
+        return message
+
+
+if __name__ == "__main__":
+    import unittest
+    from json_serdes import JsonSerDes
+    from ..message import Factory
+
+    class BinarySerDesTest(unittest.TestCase):
+        def setUp(self):
+            factory = Factory()
+            self.serdes = BinarySerDes(factory, JsonSerDes(factory))
+
+        def round_trip(self, fields):
+            message = Factory().create_message("TEST")
+            message.extend(fields)
+            return self.serdes.deserialize(self.serdes.serialize(message))
+
+        def test_round_trip(self):
+            fields = {"s": "v=0\r\n", "u": u"\u0442\u0435\u0441\u0442", "i": -7, "l": 2 ** 40, "f": 0.5,
+                      "t": True, "F": False, "n": None, "j": {"audio": ["PCMA/8000"], "ice": True}, "e": ""}
+            message = self.round_trip(fields)
+            self.assertEqual(message.type, "TEST")
+            self.assertEqual(sorted(message.keys()), sorted(fields.keys()))
+            for (name, value) in fields.items():
+                self.assertEqual(message.get(name), value)
+                self.assertEqual(type(message.get(name)), type(value))
+            frame = self.serdes.serialize(message)
+            self.assertEqual(set(tag for (_, tag, _, _, _, _) in iter_fields(frame)), _TAGS)
+
+        def test_unicode_keys(self):
+            message = self.round_trip({u"pointId": u"p1", u"n\xe4me": u"\xe9t\xe9"})
+            self.assertEqual(message.get("pointId"), u"p1")
+            self.assertEqual(message.get(u"n\xe4me"), u"\xe9t\xe9")
+            self.assertEqual(sorted(message.keys()), [u"n\xe4me", "pointId"])
+
+        def test_json_fallback(self):
+            message = self.serdes.deserialize('{"type": "TEST", "pointId": "p1"}')
+            self.assertEqual((message.type, message.point_id), ("TEST", "p1"))
+            self.assertRaises(ParseException, BinarySerDes(Factory()).deserialize, '{"type": "TEST"}')
+
+        def test_corrupted(self):
+            frame = self.serdes.serialize(self.round_trip({"sdp": "v=0", "i": 1}))
+            for bad in (frame[:-1],                                         # truncated value
+                        frame[:-10],                                        # truncated header
+                        frame.replace("sdp" + _VALUE.pack(TAG_STR, 3), "sdp" + _VALUE.pack(TAG_STR, 300)),
+                        frame.replace("sdp" + TAG_STR, "sdp" + "?"),        # unknown tag
+                        MAGIC,                                              # no type
+                        MAGIC + encode_field("sdp", "v=0")):                # type is not first
+                self.assertRaises(ParseException, self.serdes.deserialize, bad)
+
+    unittest.main()
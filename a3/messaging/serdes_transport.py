@@ -12,29 +12,61 @@ import logging
 LOGGER = logging.getLogger("MC")
 
 
+class _MessageDump(object):
+    """
+    renders message for the log only if the record is emitted,
+    so lazily decoded fields are not decoded just to be logged
+    """
+    def __init__(self, message):
+        self.__message = message
+
+    def __str__(self):
+        return self.__message.to_str(20)
+
+
 class SerDesTransport(MessagingTransport, IMessageListener):
     """
     Decorates transport with serializer/deserializer
+
+    replies do not echo back inherited fields listed in strip (e.g. sdp, cc, vv):
+    the peer sent them and already has them, fields set on the reply are always sent
+
+    if recorder (a3.messaging.recorder.Recorder) is given, all messages are recorded
     """
-    def __init__(self, transport, serdes):
+    def __init__(self, transport, serdes, strip=(), recorder=None):
         assert isinstance(transport, MessagingTransport)
         assert isinstance(serdes, ISerDes)
         MessagingTransport.__init__(self)
         self.__transport = transport
         self.__serdes = serdes
+        self.__strip = tuple(strip)
+        self.__recorder = recorder
         transport.listener = self
 
     def send_message(self, message, channel=None):
-        assert type(message) is Message
+        assert isinstance(message, Message)
         if channel is None:
             channel = message.channel
         assert type(channel) is str
 
-        LOGGER.info("<- sending <" + repr(channel) + ">:\n" + message.to_str(20))
+        parent = message.parent
+        if self.__strip and parent is not None and parent.has("sender") and channel == parent.sender:
+            message.strip_inherited(self.__strip)
+        LOGGER.info("<- sending <%r>:\n%s", channel, _MessageDump(message))
         message.set("sender", self.__transport.channel_name)
-        str_message = self.__serdes.serialize(message)
+        if self.__recorder is not None:
+            self.__recorder.record("out", channel, message)
+        # reply in the format the peer used
+        serdes = message.serdes if message.serdes is not None else self.__serdes
+        str_message = serdes.serialize(message)
         self.__transport.send_message(str_message, channel)
 
+    def flush(self):
+        self.__transport.flush()
+
+    def unsubscribe(self):
+        self.__transport.unsubscribe()
+
     def listen(self):
         self.__transport.listen()
 
@@ -43,10 +75,14 @@ class SerDesTransport(MessagingTransport, IMessageListener):
         try:
             message = self.__serdes.deserialize(str_message)
             message.transport = self
-            LOGGER.info("-> received :\n" + message.to_str(20))
+            LOGGER.info("-> received :\n%s", _MessageDump(message))
+            if self.__recorder is not None:
+                self.__recorder.record("in", self.channel_name, message)
             self.message_received(message)
         except ParseException:
             LOGGER.exception("Corrupted message %s", str_message)
+        # replies produced while handling the message go out in one batch
+        self.__transport.flush()
 
     @property
     def channel_name(self):
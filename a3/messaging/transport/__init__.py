@@ -1,3 +1,5 @@
-from _base import MessagingTransport, ThreadedMessagingTransport, IMessageListener
+from _base import MessagingTransport, ThreadedMessagingTransport, EventLoopMessagingTransport, IMessageListener
 from rabbitmq_transport import RabbitmqTransport
-from redis_transport import RedisTransport
\ No newline at end of file
+from redis_transport import RedisTransport
+from redis_streams_transport import RedisStreamsTransport
+from loopback_transport import LoopbackTransport, LoopbackBus
\ No newline at end of file
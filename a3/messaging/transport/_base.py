@@ -4,9 +4,13 @@
 """
 
 from abc import ABCMeta, abstractmethod, abstractproperty
+import logging
 import threading
 
 
+LOGGER = logging.getLogger("MC")
+
+
 class IMessageListener(object):
     __metaclass__ = ABCMeta
 
@@ -46,12 +50,31 @@ class MessagingTransport(object):
         :param channel: str channel name
         """
 
+    def flush(self):
+        """
+        send queued outgoing messages now (for transports that batch them)
+        """
+
+    def unsubscribe(self):
+        """
+        stop receiving messages of queues shared with other controllers (e.g. on drain),
+        messages addressed to this controller are still received;
+        transports without shared queues to leave keep receiving everything and log it
+        """
+        LOGGER.warning("%s: cannot leave shared queues, messages are still received", type(self).__name__)
+
     @abstractmethod
     def listen(self):
         """
         start listening queue
         """
 
+    def attach(self, loop):
+        """
+        start listening queue on event loop (a3.eventloop.EventLoop) without blocking
+        """
+        raise NotImplementedError("%s does not support event loop" % type(self).__name__)
+
     @abstractproperty
     def channel_name(self):
         """
@@ -79,6 +102,12 @@ class ThreadedMessagingTransport(MessagingTransport, threading.Thread, IMessageL
     def send_message(self, message, channel=None):
         self.__transport.send_message(message, channel)
 
+    def flush(self):
+        self.__transport.flush()
+
+    def unsubscribe(self):
+        self.__transport.unsubscribe()
+
     def listen(self):
         self.daemon = True
         self.start()
@@ -89,3 +118,34 @@ class ThreadedMessagingTransport(MessagingTransport, threading.Thread, IMessageL
     @property
     def channel_name(self):
         return self.__transport.channel_name
+
+
+class EventLoopMessagingTransport(MessagingTransport, IMessageListener):
+    """
+    Decorates transport to run on event loop
+    """
+    def __init__(self, transport, loop):
+        assert isinstance(transport, MessagingTransport)
+        MessagingTransport.__init__(self)
+        self.__transport = transport
+        self.__loop = loop
+        transport.listener = self
+
+    def send_message(self, message, channel=None):
+        self.__transport.send_message(message, channel)
+
+    def flush(self):
+        self.__transport.flush()
+
+    def unsubscribe(self):
+        self.__transport.unsubscribe()
+
+    def listen(self):
+        self.__transport.attach(self.__loop)
+
+    def on_message(self, message, transport):
+        self.message_received(message)
+
+    @property
+    def channel_name(self):
+        return self.__transport.channel_name
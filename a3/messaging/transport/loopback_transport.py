@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+In-process message transport
+
+Transports on one LoopbackBus deliver messages to each other by channel name
+synchronously in the sender thread, no message queue server is needed.
+Messages to channels nobody listens to go to bus.sink (if set).
+
+Example:
+    bus = LoopbackBus()
+    mc = LoopbackTransport("media-controller", bus)
+    app = LoopbackTransport("app", bus)
+    app.send_message(data, "media-controller")
+
+MQ url loopback://local/<channel> uses DEFAULT_BUS.
+"""
+
+
+from _base import MessagingTransport
+
+import threading
+
+
+class LoopbackBus(object):
+    def __init__(self):
+        self.__transports = {}
+        self.__lock = threading.Lock()
+        self.sink = None
+
+    def subscribe(self, channel, transport):
+        assert type(channel) is str
+        with self.__lock:
+            self.__transports[channel] = transport
+
+    def unsubscribe(self, channel):
+        with self.__lock:
+            self.__transports.pop(channel, None)
+
+    def publish(self, channel, message):
+        transport = self.__transports.get(channel)
+        if transport is not None:
+            transport.message_received(message)
+        elif self.sink is not None:
+            self.sink(channel, message)
+
+
+DEFAULT_BUS = LoopbackBus()
+
+
+class LoopbackTransport(MessagingTransport):
+    def __init__(self, channel_name, bus=DEFAULT_BUS):
+        assert type(channel_name) is str
+        assert isinstance(bus, LoopbackBus)
+        MessagingTransport.__init__(self)
+        self.__channel_name = channel_name
+        self.__bus = bus
+        bus.subscribe(channel_name, self)
+
+    def send_message(self, message, channel=None):
+        assert type(channel) is str
+        self.__bus.publish(channel, message)
+
+    def listen(self):
+        """
+        messages are delivered as soon as they are sent, nothing to wait for
+        """
+
+    def attach(self, loop):
+        pass
+
+    @property
+    def channel_name(self):
+        return self.__channel_name
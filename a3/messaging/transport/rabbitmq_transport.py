@@ -1,34 +1,311 @@
 #!/usr/bin/env python
 """
 RabbitMQ message transport
+
+Consuming and publishing use separate connections.
+
+Consumer: basic_qos prefetch limits unacknowledged deliveries,
+messages are acknowledged in batches (basic_ack multiple=True on every ack_batch messages
+and every ACK_INTERVAL) once they are passed to the listener - with inbound queue
+that is when they are queued, not handled.
+Messages delivered but not acknowledged before a restart are redelivered,
+messages acknowledged but still in inbound queue or executor are lost (at-most-once for those).
+
+unsubscribe() cancels the consumer (controller is drained), deliveries not yet handed
+to the listener are returned to the queue. Controllers have no own queue, so messages
+for points of the drained controller go to other controllers too.
+
+Publisher: outgoing messages are queued and published in batches
+(see redis_transport._PipelinedPublisher), each batch is one AMQP transaction:
+tx_commit returns when the broker has taken every message of the batch.
+Publisher connection is idle between batches: frames received meanwhile (heartbeats,
+close by broker) are processed before each batch, closed connection is closed and reopened.
+
+Test against local broker:
+    # python -m a3.messaging.transport.rabbitmq_transport
 """
 
 
 from _base import MessagingTransport
+from redis_transport import _PipelinedPublisher, DEFAULT_BATCH_SIZE, DEFAULT_FLUSH_INTERVAL
+from ...metrics import METRICS, SIZE_BOUNDS
+import logging
+import threading
+import time
+
+
+LOGGER = logging.getLogger("MC")
+
+
+ACK_INTERVAL = 0.05
+
+DEFAULT_PREFETCH = 64
+DEFAULT_ACK_BATCH = 16
+
+
+class _TransactionalPublisher(_PipelinedPublisher):
+    """
+    publishes batches in AMQP transactions on own connection, reconnects on error
+    """
+    def __init__(self, connect, batch_size, flush_interval):
+        _PipelinedPublisher.__init__(self, None, batch_size, flush_interval, name="amqp")
+        self.__connect = connect
+        self.__connection = None
+        self.__channel = None
+
+    def _send(self, batch):
+        if self.__connection is not None:
+            try:
+                # heartbeats and close by broker received while idle
+                self.__connection.process_data_events(0)
+            except self._connection_errors():
+                self.__close()
+        if self.__connection is None:
+            self.__connection = self.__connect()
+            self.__channel = self.__connection.channel()
+            self.__channel.tx_select()
+        try:
+            for (channel, message, _) in batch:
+                self.__channel.basic_publish(exchange='',
+                                             routing_key=channel,
+                                             body=str(message))
+            self.__channel.tx_commit()
+        except self._connection_errors():
+            self.__close()
+            raise
+
+    def __close(self):
+        (connection, self.__connection, self.__channel) = (self.__connection, None, None)
+        try:
+            connection.close()
+        except self._connection_errors():
+            pass
+
+    def _connection_errors(self):
+        import pika
+        return pika.exceptions.AMQPError
 
 
 class RabbitmqTransport(MessagingTransport):
-    def __init__(self, server, port, channel_name):
+    def __init__(self, server, port, channel_name,
+                 prefetch=DEFAULT_PREFETCH, ack_batch=DEFAULT_ACK_BATCH,
+                 batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        assert type(prefetch) is int and prefetch >= 0
+        assert type(ack_batch) is int and ack_batch >= 1
         MessagingTransport.__init__(self)
+        self.__server = server
+        self.__port = port
         self.__channel_name = channel_name
+        self.__prefetch = prefetch
+        # broker sends no more than prefetch unacknowledged messages, do not wait for more
+        self.__ack_batch = min(ack_batch, prefetch) if prefetch else ack_batch
 
         import pika
-        self.__connection = pika.BlockingConnection(pika.ConnectionParameters(server, port))
+        self.__pika = pika
+        self.__connection = self.__connect()
         self.__channel = self.__connection.channel()
         self.__channel.queue_declare(queue=channel_name)
+        self.__last_delivery_tag = None
+        self.__unacked = 0
+        self.__consumer_tag = None
+        self.__subscribed = True
+
+        self.__publisher = _TransactionalPublisher(self.__connect, batch_size, flush_interval)
+        self.__ack_size_histogram = METRICS.histogram("mq.amqp.ack_size", SIZE_BOUNDS)
+
+    def __connect(self):
+        return self.__pika.BlockingConnection(self.__pika.ConnectionParameters(self.__server, self.__port))
 
     def send_message(self, message, channel=None):
         assert type(channel) is str
-        self.__channel.basic_publish(exchange='',
-                                     routing_key=channel,
-                                     body=str(message))
+        self.__publisher.publish(channel, message)
+
+    def flush(self):
+        self.__publisher.flush()
+
+    def unsubscribe(self):
+        LOGGER.info("RabbitMQ: leaving shared queue %s", self.__channel_name)
+        # connection belongs to the reader thread
+        self.__connection.add_callback_threadsafe(self.__cancel)
 
     def listen(self):
-        self.__channel.basic_consume(lambda ch, method, properties, body: self.message_received(body),
-                                     queue=self.__channel_name,
-                                     no_ack=True)
+        self.__publisher.start()
+        self.__read()
+
+    def attach(self, loop):
+        """
+        BlockingConnection exposes no socket to watch on the loop,
+        so batches are published from the loop and deliveries are consumed in own thread
+        """
+        self.__publisher.attach(loop)
+        thread = threading.Thread(target=self.__read, name="amqp-reader")
+        thread.daemon = True
+        thread.start()
+
+    def __read(self):
+        self.__consume()
+        self.__connection.add_timeout(ACK_INTERVAL, self.__on_ack_timer)
         self.__channel.start_consuming()
+        # consumer cancelled, acks and heartbeats are still due
+        while True:
+            self.__connection.process_data_events(None)
+
+    def __consume(self):
+        if not self.__subscribed:
+            return
+        if self.__prefetch:
+            self.__channel.basic_qos(prefetch_count=self.__prefetch)
+        self.__consumer_tag = self.__channel.basic_consume(self.__on_delivery,
+                                                           queue=self.__channel_name,
+                                                           no_ack=False)
+
+    def __cancel(self):
+        self.__subscribed = False
+        if self.__consumer_tag is None:
+            return
+        self.__ack()
+        self.__channel.basic_cancel(self.__consumer_tag)
+        self.__consumer_tag = None
+
+    def __on_delivery(self, channel, method, properties, body):
+        try:
+            self.message_received(body)
+        finally:
+            self.__last_delivery_tag = method.delivery_tag
+            self.__unacked += 1
+            if self.__unacked >= self.__ack_batch:
+                self.__ack()
+
+    def __ack(self):
+        if not self.__unacked:
+            return
+        self.__channel.basic_ack(delivery_tag=self.__last_delivery_tag, multiple=True)
+        self.__ack_size_histogram.observe(self.__unacked)
+        self.__unacked = 0
+
+    def __on_ack_timer(self):
+        self.__ack()
+        self.__connection.add_timeout(ACK_INTERVAL, self.__on_ack_timer)
 
     @property
     def channel_name(self):
         return self.__channel_name
+
+
+if __name__ == "__main__":
+    import unittest
+    import uuid
+    from _base import IMessageListener
+
+    class _Listener(IMessageListener):
+        def __init__(self):
+            self.messages = []
+
+        def on_message(self, message, transport):
+            self.messages.append(message)
+
+    class _Connection(object):
+        def __init__(self, published):
+            self.published = published
+            self.dropped = False
+            self.closed = False
+
+        def process_data_events(self, time_limit=0):
+            if self.dropped:
+                import pika
+                raise pika.exceptions.ConnectionClosed(320, "CONNECTION_FORCED")
+
+        def channel(self):
+            return self
+
+        def tx_select(self):
+            pass
+
+        def basic_publish(self, exchange, routing_key, body):
+            self.published.append((self, body))
+
+        def tx_commit(self):
+            pass
+
+        def close(self):
+            self.closed = True
+
+    class TransactionalPublisherTest(unittest.TestCase):
+        def test_reconnect_after_broker_closed_idle_connection(self):
+            published = []
+            connections = []
+
+            def connect():
+                connections.append(_Connection(published))
+                return connections[-1]
+
+            publisher = _TransactionalPublisher(connect, 16, 0.01)
+            publisher.publish("q", "m-1")
+            publisher.flush()
+            connections[0].dropped = True                # missed heartbeats while idle
+            publisher.publish("q", "m-2")
+            publisher.flush()
+            self.assertEqual(len(connections), 2)
+            self.assertTrue(connections[0].closed)
+            self.assertEqual(published, [(connections[0], "m-1"), (connections[1], "m-2")])
+
+    class RabbitmqTransportTest(unittest.TestCase):
+        """
+        needs RabbitMQ on 127.0.0.1:5672, skipped without it
+        """
+        @classmethod
+        def setUpClass(cls):
+            import pika
+            try:
+                pika.BlockingConnection(pika.ConnectionParameters("127.0.0.1", 5672)).close()
+            except pika.exceptions.AMQPConnectionError:
+                raise unittest.SkipTest("no RabbitMQ on 127.0.0.1:5672")
+
+        def setUp(self):
+            self.queue = "test-%s" % uuid.uuid4().hex
+
+        def create(self):
+            t = RabbitmqTransport("127.0.0.1", 5672, self.queue, prefetch=8, ack_batch=4, batch_size=16)
+            t.listener = _Listener()
+            t._RabbitmqTransport__consume()
+            return t
+
+        def poll(self, t):
+            deadline = time.time() + 0.5
+            while time.time() < deadline:
+                t._RabbitmqTransport__connection.process_data_events(0.05)
+
+        def test_batched_publish_and_ack(self):
+            t = self.create()
+            for i in range(20):
+                t.send_message("m-%d" % i, self.queue)
+            t.flush()
+            self.poll(t)
+            t._RabbitmqTransport__ack()
+            self.assertEqual(t.listener.messages, ["m-%d" % i for i in range(20)])
+
+        def test_unacked_redelivered(self):
+            t = self.create()
+            for i in range(3):
+                t.send_message("m-%d" % i, self.queue)
+            t.flush()
+            self.poll(t)                                # 3 < ack_batch: not acknowledged yet
+            t._RabbitmqTransport__connection.close()
+
+            restarted = self.create()
+            self.poll(restarted)
+            self.assertEqual(restarted.listener.messages, ["m-0", "m-1", "m-2"])
+
+        def test_unsubscribe(self):
+            drained, other = self.create(), self.create()
+            drained.unsubscribe()
+            self.poll(drained)                          # runs the cancel in the reader thread
+            for i in range(4):
+                drained.send_message("m-%d" % i, self.queue)
+            drained.flush()
+            self.poll(drained)
+            self.poll(other)
+            self.assertEqual(drained.listener.messages, [])
+            self.assertEqual(other.listener.messages, ["m-%d" % i for i in range(4)])
+
+    unittest.main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+"""
+Redis Streams message transport
+
+Controllers of a fleet share stream <channel> in consumer group <group>,
+each message of the shared stream (e.g. CREATE_MEDIA_POINT) is delivered to one controller.
+Each controller also reads own stream <channel>:<consumer> and announces it as channel_name,
+so replies carry it as sender and follow-up messages of a point come to its owner.
+
+unsubscribe() stops reading the shared stream (controller is drained),
+own stream is read until the process exits.
+
+Received messages are acknowledged in batches (ack_batch ids, or before the next blocking read)
+once they are passed to the listener - with inbound queue that is when they are queued, not handled.
+Messages read but not acknowledged before a restart are read again on start
+(consumer name must be stable across restarts for that), messages acknowledged but still
+in inbound queue or executor are lost: delivery is at-most-once for those.
+
+Outgoing messages are added to the stream named by channel with XADD
+through the same pipelined publisher as RedisTransport.
+All peers must use streams transport.
+
+Test against local redis-server:
+    # python -m a3.messaging.transport.redis_streams_transport
+"""
+
+
+from _base import MessagingTransport, IMessageListener
+from redis_transport import _PipelinedPublisher, DEFAULT_BATCH_SIZE, DEFAULT_FLUSH_INTERVAL
+from ...metrics import METRICS, SIZE_BOUNDS
+import logging
+import os
+import socket
+import threading
+import time
+
+
+LOGGER = logging.getLogger("MC")
+
+
+DEFAULT_ACK_BATCH = 32
+DEFAULT_BLOCK_MS = 1000
+DEFAULT_MAXLEN = 100000
+READ_COUNT = 64
+
+FIELD = "m"
+
+
+def default_consumer_name():
+    return "%s-%d" % (socket.gethostname(), os.getpid())
+
+
+class _StreamPublisher(_PipelinedPublisher):
+    def __init__(self, connection, batch_size, flush_interval, maxlen):
+        _PipelinedPublisher.__init__(self, connection, batch_size, flush_interval, name="redis.streams")
+        self.__maxlen = maxlen
+
+    def _add_command(self, pipe, channel, message):
+        pipe.xadd(channel, {FIELD: message}, maxlen=self.__maxlen, approximate=True)
+
+
+class RedisStreamsTransport(MessagingTransport):
+    def __init__(self, host, port, channel_name, group=None, consumer=None,
+                 batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 ack_batch=DEFAULT_ACK_BATCH, block_ms=DEFAULT_BLOCK_MS, maxlen=DEFAULT_MAXLEN):
+        import redis
+        self.__redis = redis
+
+        assert type(host) is str
+        assert port is None or type(port) is int
+        assert type(channel_name) is str
+        assert group is None or type(group) is str
+        assert consumer is None or type(consumer) is str
+        assert type(ack_batch) is int and ack_batch >= 1
+        assert type(block_ms) is int and block_ms >= 0
+        MessagingTransport.__init__(self)
+        self.__host = host
+        self.__port = port
+        self.__shared_stream = channel_name
+        self.__group = group if group is not None else channel_name
+        self.__consumer = consumer if consumer is not None else default_consumer_name()
+        self.__own_stream = "%s:%s" % (channel_name, self.__consumer)
+        self.__ack_batch = ack_batch
+        self.__block_ms = block_ms
+        self.__maxlen = maxlen
+        self.__subscribed = True
+
+        self.__connection = None
+        self.__unacked = {}
+        self.__unacked_count = 0
+        self.__publisher = _StreamPublisher(self.__create_connection(), batch_size, flush_interval, maxlen)
+
+        self.__read_size_histogram = METRICS.histogram("mq.redis.streams.read_size", SIZE_BOUNDS)
+        self.__ack_size_histogram = METRICS.histogram("mq.redis.streams.ack_size", SIZE_BOUNDS)
+        self.__redelivered_counter = METRICS.counter("mq.redis.streams.redelivered")
+
+    def __create_connection(self):
+        if self.__port is None:
+            return self.__redis.StrictRedis(host=self.__host, db=0)
+        else:
+            return self.__redis.StrictRedis(host=self.__host, port=self.__port, db=0)
+
+    def __connect(self):
+        self.__connection = self.__create_connection()
+        for stream in (self.__shared_stream, self.__own_stream):
+            try:
+                self.__connection.xgroup_create(stream, self.__group, id="$", mkstream=True)
+            except self.__redis.exceptions.ResponseError as err:
+                if "BUSYGROUP" not in str(err):
+                    raise
+        self.__unacked = {}
+        self.__unacked_count = 0
+        LOGGER.debug("Redis streams: connected as %s in group %s", self.__consumer, self.__group)
+
+    def send_message(self, message, channel=None):
+        assert type(channel) is str
+        self.__publisher.publish(channel, message)
+
+    def flush(self):
+        self.__publisher.flush()
+
+    def unsubscribe(self):
+        LOGGER.info("Redis streams: leaving shared stream %s", self.__shared_stream)
+        self.__subscribed = False
+
+    def listen(self):
+        self.__publisher.start()
+        self.__read_loop()
+
+    def attach(self, loop):
+        """
+        batches are published from the loop, streams are read in own thread
+        """
+        self.__publisher.attach(loop)
+        thread = threading.Thread(target=self.__read_loop, name="redis-streams-reader")
+        thread.daemon = True
+        thread.start()
+
+    def __read_loop(self):
+        interval = 1
+        while True:
+            try:
+                LOGGER.debug("Redis streams: connecting...")
+                self.__connect()
+                interval = 1
+                self.__read_pending()
+                while True:
+                    self.__ack()
+                    self.__read(">", self.__block_ms)
+            except self.__redis.exceptions.ConnectionError:
+                LOGGER.warning("Redis streams: connection error. Trying to reconnect in %d sec...", interval)
+                time.sleep(interval)
+                interval = min(interval * 2, 16)
+
+    def __read_pending(self):
+        """
+        handle messages delivered to this consumer but not acknowledged (e.g. before restart)
+        """
+        while self.__read("0", None, redelivered=True):
+            self.__ack()
+        self.__ack()
+
+    def __read(self, last_id, block, redelivered=False):
+        """
+        :return: number of messages read
+        """
+        streams = {self.__own_stream: last_id}
+        if self.__subscribed:
+            streams[self.__shared_stream] = last_id
+        response = self.__connection.xreadgroup(self.__group, self.__consumer, streams,
+                                                count=READ_COUNT, block=block)
+        count = 0
+        for (stream, entries) in response or []:
+            for (entry_id, fields) in entries:
+                count += 1
+                if fields and FIELD in fields:
+                    if redelivered:
+                        self.__redelivered_counter.inc()
+                    self.message_received(fields[FIELD])
+                self.__unacked.setdefault(stream, []).append(entry_id)
+                self.__unacked_count += 1
+                if self.__unacked_count >= self.__ack_batch:
+                    self.__ack()
+        if count:
+            self.__read_size_histogram.observe(count)
+        return count
+
+    def __ack(self):
+        if not self.__unacked_count:
+            return
+        pipe = self.__connection.pipeline(transaction=False)
+        for (stream, ids) in self.__unacked.iteritems():
+            pipe.xack(stream, self.__group, *ids)
+        pipe.execute()
+        self.__ack_size_histogram.observe(self.__unacked_count)
+        self.__unacked = {}
+        self.__unacked_count = 0
+
+    @property
+    def channel_name(self):
+        return self.__own_stream
+
+    @property
+    def shared_channel_name(self):
+        return self.__shared_stream
+
+
+if __name__ == "__main__":
+    import unittest
+    import uuid
+
+    class _Listener(IMessageListener):
+        def __init__(self):
+            self.messages = []
+
+        def on_message(self, message, transport):
+            self.messages.append(message)
+
+    class RedisStreamsTransportTest(unittest.TestCase):
+        """
+        needs redis-server >= 5 on 127.0.0.1:6379, skipped without it
+        """
+        @classmethod
+        def setUpClass(cls):
+            import redis
+            try:
+                redis.StrictRedis(host="127.0.0.1").ping()
+            except redis.exceptions.ConnectionError:
+                raise unittest.SkipTest("no redis-server on 127.0.0.1:6379")
+
+        def setUp(self):
+            self.channel = "test-%s" % uuid.uuid4().hex
+
+        def create(self, consumer):
+            t = RedisStreamsTransport("127.0.0.1", None, self.channel, consumer=consumer,
+                                      batch_size=1, block_ms=100)
+            t._RedisStreamsTransport__connect()
+            t.listener = _Listener()
+            return t, t.listener
+
+        def read(self, t):
+            t._RedisStreamsTransport__read(">", 100)
+            t._RedisStreamsTransport__ack()
+
+        def test_group_spreads_and_pins(self):
+            a, a_listener = self.create("a")
+            b, b_listener = self.create("b")
+            for i in range(10):
+                a.send_message("create-%d" % i, self.channel)
+            a.flush()
+            self.read(a)
+            self.read(b)
+            self.assertEqual(len(a_listener.messages) + len(b_listener.messages), 10)
+
+            b.send_message("follow-up", a.channel_name)
+            b.flush()
+            self.read(b)
+            self.read(a)
+            self.assertEqual(a_listener.messages[-1], "follow-up")
+
+        def test_pending_redelivered(self):
+            a, _ = self.create("a")
+            a.send_message("lost", self.channel)
+            a.flush()
+            a._RedisStreamsTransport__read(">", 100)     # read, not acknowledged
+
+            restarted, listener = self.create("a")
+            restarted._RedisStreamsTransport__read_pending()
+            self.assertEqual(listener.messages, ["lost"])
+
+    unittest.main()
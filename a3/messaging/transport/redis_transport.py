@@ -1,44 +1,228 @@
 #!/usr/bin/env python
 """
 Redis message transport
+
+Outgoing messages are queued and published through a redis pipeline.
+The queue is flushed when it reaches batch_size messages, when the oldest
+message has waited flush_interval seconds, or explicitly with flush().
+All messages go through one FIFO queue, so per-channel order is kept.
+Each batch is one MULTI/EXEC transaction, so a failed batch was not published in part.
+Failed batch goes back to the head of the queue and is retried after RETRY_INTERVAL by the
+publisher thread (or loop), flush() meanwhile returns at once; after MAX_ATTEMPTS it is dropped
+and counted in mq.<name>.dropped.
+
+listen() blocks in its thread, attach(loop) schedules flushes on an a3.eventloop.EventLoop
+and reads the subscription in own thread (redis-py exposes no socket to watch on the loop).
 """
 
 
 from _base import MessagingTransport
+from ...metrics import METRICS, SIZE_BOUNDS
 import logging
+import threading
 import time
 
 
 LOGGER = logging.getLogger("MC")
 
 
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_FLUSH_INTERVAL = 0.001
+
+
+class _PipelinedPublisher(object):
+    """
+    Outbound queue flushed with a redis pipeline
+    deadline flushes run either in own thread (start) or on event loop (attach)
+    """
+    RETRY_INTERVAL = 1
+    MAX_ATTEMPTS = 5
+
+    def __init__(self, connection, batch_size, flush_interval, name="redis"):
+        assert type(batch_size) is int and batch_size >= 1
+        assert type(flush_interval) is float and flush_interval >= 0
+        self.__connection = connection
+        self.__name = name
+        self.__loop = None
+        self.__batch_size = batch_size
+        self.__flush_interval = flush_interval
+
+        self.__queue = []
+        self.__queue_changed = threading.Condition()
+        self.__flush_lock = threading.Lock()
+        self.__retry_at = 0                 # no flush before, batch at queue head has failed
+        self.__attempts = 0                 # failed attempts of batch at queue head
+
+        self.__batch_size_histogram = METRICS.histogram("mq.%s.batch_size" % name, SIZE_BOUNDS)
+        self.__flush_latency_histogram = METRICS.histogram("mq.%s.flush_latency" % name)
+        self.__queue_wait_histogram = METRICS.histogram("mq.%s.queue_wait" % name)
+        self.__published_counter = METRICS.counter("mq.%s.published" % name)
+        self.__errors_counter = METRICS.counter("mq.%s.publish_errors" % name)
+        self.__dropped_counter = METRICS.counter("mq.%s.dropped" % name)
+
+    def start(self):
+        thread = threading.Thread(target=self.__run)
+        thread.daemon = True
+        thread.start()
+
+    def attach(self, loop):
+        self.__loop = loop
+
+    def publish(self, channel, message):
+        with self.__queue_changed:
+            self.__queue.append((channel, message, time.time()))
+            queue_length = len(self.__queue)
+            if self.__loop is None and (queue_length == 1 or queue_length >= self.__batch_size):
+                self.__queue_changed.notify()
+
+        if self.__loop is not None:
+            if queue_length == self.__batch_size:
+                self.__loop.call_soon_threadsafe(self.flush)
+            elif queue_length == 1:
+                self.__loop.call_later(self.__flush_interval, self.flush)
+
+    def flush(self):
+        """
+        publish everything queued so far, returns at once while failed batch waits for retry
+        the flush lock keeps batches in queue order when several threads flush
+        """
+        with self.__flush_lock:
+            while True:
+                with self.__queue_changed:
+                    if time.time() < self.__retry_at:
+                        break
+                    batch = self.__queue[:self.__batch_size]
+                    del self.__queue[:self.__batch_size]
+                if not batch:
+                    break
+                if not self.__execute(batch):
+                    break
+
+    def __run(self):
+        while True:
+            with self.__queue_changed:
+                while not self.__queue:
+                    self.__queue_changed.wait()
+                deadline = self.__queue[0][2] + self.__flush_interval
+                while self.__queue:
+                    now = time.time()
+                    if now < self.__retry_at:
+                        timeout = self.__retry_at - now
+                    elif len(self.__queue) < self.__batch_size and now < deadline:
+                        timeout = deadline - now
+                    else:
+                        break
+                    self.__queue_changed.wait(timeout)
+            self.flush()
+
+    def __execute(self, batch):
+        """
+        :return: False if batch failed and is put back for retry
+        """
+        start = time.time()
+        try:
+            self._send(batch)
+        except self._connection_errors():
+            self.__errors_counter.inc()
+            self.__attempts += 1
+            if self.__attempts >= self.MAX_ATTEMPTS:
+                LOGGER.error("Publisher %s: publish failed %d times, %d messages dropped",
+                             self.__name, self.__attempts, len(batch))
+                self.__dropped_counter.inc(len(batch))
+                self.__attempts = 0
+                return True
+            LOGGER.warning("Publisher %s: publish failed (%d messages). Retrying in %d sec...",
+                           self.__name, len(batch), self.RETRY_INTERVAL)
+            with self.__queue_changed:
+                self.__queue[:0] = batch
+                self.__retry_at = time.time() + self.RETRY_INTERVAL
+            if self.__loop is not None:
+                self.__loop.call_later(self.RETRY_INTERVAL, self.flush)
+            return False
+        self.__attempts = 0
+
+        now = time.time()
+        self.__flush_latency_histogram.observe(now - start)
+        self.__batch_size_histogram.observe(len(batch))
+        self.__queue_wait_histogram.observe(start - batch[0][2])
+        self.__published_counter.inc(len(batch))
+        return True
+
+    def _send(self, batch):
+        """
+        send list of (channel, message, queued time) at once, all or nothing
+        """
+        pipe = self.__connection.pipeline(transaction=True)
+        for (channel, message, _) in batch:
+            self._add_command(pipe, channel, message)
+        pipe.execute()
+
+    def _add_command(self, pipe, channel, message):
+        pipe.publish(channel, message)
+
+    def _connection_errors(self):
+        import redis
+        return redis.exceptions.ConnectionError
+
+
 class RedisTransport(MessagingTransport):
-    def __init__(self, host, port, channel_name):
+    def __init__(self, host, port, channel_name,
+                 batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
         import redis
         self.__redis = redis
 
         assert type(host) is str
         assert port is None or type(port) is int
         assert type(channel_name) is str
+        assert type(batch_size) is int
+        assert type(flush_interval) is float
         MessagingTransport.__init__(self)
         self.__host = host
         self.__port = port
         self.__channel_name = channel_name
 
-    def __connect(self):
+        self.__connection = None
+        self.__sub = None
+        self.__publisher = None
+        if batch_size > 1:
+            self.__publisher = _PipelinedPublisher(self.__create_connection(), batch_size, flush_interval)
+
+    def __create_connection(self):
         if self.__port is None:
-            self.__connection = self.__redis.StrictRedis(host=self.__host, db=0)
+            return self.__redis.StrictRedis(host=self.__host, db=0)
         else:
-            self.__connection = self.__redis.StrictRedis(host=self.__host, port=self.__port, db=0)
+            return self.__redis.StrictRedis(host=self.__host, port=self.__port, db=0)
+
+    def __connect(self):
+        self.__connection = self.__create_connection()
         self.__sub = self.__connection.pubsub()
         self.__sub.subscribe(self.__channel_name)
         LOGGER.debug("Redis: connected")
 
     def send_message(self, message, channel=None):
         assert type(channel) is str
-        self.__connection.publish(channel, message)
+        if self.__publisher is not None:
+            self.__publisher.publish(channel, message)
+        else:
+            self.__connection.publish(channel, message)
+
+    def flush(self):
+        if self.__publisher is not None:
+            self.__publisher.flush()
 
     def listen(self):
+        if self.__publisher is not None:
+            self.__publisher.start()
+        self.__read()
+
+    def attach(self, loop):
+        if self.__publisher is not None:
+            self.__publisher.attach(loop)
+        thread = threading.Thread(target=self.__read, name="redis-reader")
+        thread.daemon = True
+        thread.start()
+
+    def __read(self):
         interval = 1
         while True:
             try:
@@ -58,3 +242,72 @@ class RedisTransport(MessagingTransport):
     @property
     def channel_name(self):
         return self.__channel_name
+
+
+if __name__ == "__main__":
+    import unittest
+
+    class _Error(Exception):
+        pass
+
+    class _Pipeline(object):
+        def __init__(self, connection):
+            self.__connection = connection
+            self.__messages = []
+
+        def publish(self, channel, message):
+            self.__messages.append(message)
+
+        def execute(self):
+            if self.__connection.failures:
+                self.__connection.failures -= 1
+                raise _Error()
+            self.__connection.published.extend(self.__messages)
+
+    class _Connection(object):
+        def __init__(self):
+            self.failures = 0
+            self.published = []
+
+        def pipeline(self, transaction):
+            assert transaction
+            return _Pipeline(self)
+
+    class _Publisher(_PipelinedPublisher):
+        RETRY_INTERVAL = 0.05
+        MAX_ATTEMPTS = 3
+
+        def _connection_errors(self):
+            return _Error
+
+    class PipelinedPublisherTest(unittest.TestCase):
+        def wait(self, condition):
+            deadline = time.time() + 1
+            while not condition() and time.time() < deadline:
+                time.sleep(0.01)
+
+        def test_retry_keeps_order(self):
+            connection = _Connection()
+            publisher = _Publisher(connection, 2, 0.001, name="test.retry")
+            publisher.start()
+            connection.failures = 2
+            for i in range(5):
+                publisher.publish("c", i)
+            start = time.time()
+            publisher.flush()
+            self.assertTrue(time.time() - start < _Publisher.RETRY_INTERVAL)      # not blocked by retries
+            self.wait(lambda: len(connection.published) == 5)
+            self.assertEqual(connection.published, range(5))
+
+        def test_drop_after_max_attempts(self):
+            connection = _Connection()
+            publisher = _Publisher(connection, 2, 0.001, name="test.drop")
+            publisher.start()
+            connection.failures = _Publisher.MAX_ATTEMPTS
+            publisher.publish("c", 0)
+            self.wait(lambda: publisher._PipelinedPublisher__dropped_counter.value == 1)
+            publisher.publish("c", 1)
+            self.wait(lambda: connection.published)
+            self.assertEqual(connection.published, [1])
+
+    unittest.main()
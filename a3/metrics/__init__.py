@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""
+metrics
+
+process-wide counters, gauges and histograms
+export METRICS object
+
+Example:
+    METRICS.counter("mq.redis.published").inc()
+    METRICS.gauge("mq.redis.queue").set(12)
+    METRICS.histogram("mq.redis.flush_latency").observe(0.0012)
+
+    with METRICS.histogram("point.create").time():
+        ...
+
+    LOG.info("Metrics:\n%s", METRICS)
+"""
+
+__author__ = 'RCSLabs'
+
+
+import bisect
+import threading
+import time
+
+
+# seconds, 100us .. 10s
+LATENCY_BOUNDS = (0.0001, 0.0002, 0.0005,
+                  0.001, 0.002, 0.005,
+                  0.01, 0.02, 0.05,
+                  0.1, 0.2, 0.5,
+                  1.0, 2.0, 5.0, 10.0)
+
+# items, 1 .. 1024
+SIZE_BOUNDS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+class Counter(object):
+    def __init__(self, name):
+        assert type(name) is str
+        self.__name = name
+        self.__value = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def value(self):
+        return self.__value
+
+    def inc(self, n=1):
+        with self.__lock:
+            self.__value += n
+
+    def snapshot(self):
+        return self.__value
+
+    def __str__(self):
+        return "%s=%d" % (self.__name, self.__value)
+
+
+class Gauge(object):
+    def __init__(self, name):
+        assert type(name) is str
+        self.__name = name
+        self.__value = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def value(self):
+        return self.__value
+
+    def set(self, value):
+        self.__value = value
+
+    def inc(self, n=1):
+        with self.__lock:
+            self.__value += n
+
+    def dec(self, n=1):
+        with self.__lock:
+            self.__value -= n
+
+    def snapshot(self):
+        return self.__value
+
+    def __str__(self):
+        return "%s=%s" % (self.__name, self.__value)
+
+
+class _HistogramTimer(object):
+    def __init__(self, histogram):
+        self.__histogram = histogram
+        self.__start = None
+
+    def __enter__(self):
+        self.__start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.__histogram.observe(time.time() - self.__start)
+        return False
+
+
+class Histogram(object):
+    """
+    Fixed-bucket histogram
+    bucket i counts values <= bounds[i], the last bucket counts everything above
+    """
+    def __init__(self, name, bounds=LATENCY_BOUNDS):
+        assert type(name) is str
+        assert len(bounds) > 0
+        self.__name = name
+        self.__bounds = tuple(bounds)
+        self.__buckets = [0] * (len(self.__bounds) + 1)
+        self.__count = 0
+        self.__sum = 0
+        self.__min = None
+        self.__max = None
+        self.__lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def count(self):
+        return self.__count
+
+    @property
+    def sum(self):
+        return self.__sum
+
+    def observe(self, value):
+        with self.__lock:
+            self.__buckets[bisect.bisect_left(self.__bounds, value)] += 1
+            self.__count += 1
+            self.__sum += value
+            if self.__min is None or value < self.__min:
+                self.__min = value
+            if self.__max is None or value > self.__max:
+                self.__max = value
+
+    def time(self):
+        """
+        context manager observing elapsed wall time in seconds
+        """
+        return _HistogramTimer(self)
+
+    def percentile(self, p):
+        """
+        upper bound of the bucket holding p-th percentile
+        """
+        assert 0 <= p <= 100
+        with self.__lock:
+            if self.__count == 0:
+                return None
+            rank = self.__count * p / 100.0
+            seen = 0
+            for (i, n) in enumerate(self.__buckets):
+                seen += n
+                if seen >= rank and n:
+                    return self.__bounds[i] if i < len(self.__bounds) else self.__max
+            return self.__max
+
+    def snapshot(self):
+        with self.__lock:
+            result = dict(count=self.__count,
+                          sum=self.__sum,
+                          min=self.__min,
+                          max=self.__max,
+                          buckets=zip(list(self.__bounds) + ["+inf"], self.__buckets))
+        result["p50"] = self.percentile(50)
+        result["p99"] = self.percentile(99)
+        return result
+
+    def __str__(self):
+        if self.__count == 0:
+            return "%s: count=0" % self.__name
+        return "%s: count=%d avg=%g min=%g max=%g p50=%g p99=%g" % (
+            self.__name, self.__count, float(self.__sum) / self.__count, self.__min, self.__max,
+            self.percentile(50), self.percentile(99))
+
+
+class Registry(object):
+    def __init__(self):
+        self.__metrics = {}
+        self.__lock = threading.Lock()
+
+    def __get(self, cls, name, *args):
+        with self.__lock:
+            metric = self.__metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args)
+                self.__metrics[name] = metric
+            assert type(metric) is cls, "Metric %s is already registered as %s" % (name, type(metric).__name__)
+            return metric
+
+    def counter(self, name):
+        return self.__get(Counter, name)
+
+    def gauge(self, name):
+        return self.__get(Gauge, name)
+
+    def histogram(self, name, bounds=LATENCY_BOUNDS):
+        return self.__get(Histogram, name, bounds)
+
+    def snapshot(self, prefix=""):
+        """
+        return dict name -> value (counters, gauges) or dict (histograms)
+        """
+        with self.__lock:
+            metrics = [m for (name, m) in self.__metrics.iteritems() if name.startswith(prefix)]
+        return dict((m.name, m.snapshot()) for m in metrics)
+
+    def __str__(self):
+        with self.__lock:
+            metrics = sorted(self.__metrics.items())
+        return "\n".join(str(m) for (_, m) in metrics)
+
+
+METRICS = Registry()
+
+
+if __name__ == "__main__":
+    import unittest
+
+    class HistogramTest(unittest.TestCase):
+        def test_observe(self):
+            h = Histogram("h", (1, 2, 4))
+            for v in (0.5, 1, 1.5, 3, 10):
+                h.observe(v)
+            self.failUnlessEqual(h.count, 5)
+            self.failUnlessEqual(h.snapshot()["buckets"], [(1, 2), (2, 1), (4, 1), ("+inf", 1)])
+            self.failUnlessEqual(h.percentile(40), 1)
+            self.failUnlessEqual(h.percentile(100), 10)
+
+        def test_empty(self):
+            self.failUnlessEqual(Histogram("h").percentile(50), None)
+
+    class RegistryTest(unittest.TestCase):
+        def test_same_metric(self):
+            r = Registry()
+            r.counter("a").inc()
+            r.counter("a").inc(2)
+            self.failUnlessEqual(r.snapshot(), {"a": 3})
+            self.failUnlessRaises(AssertionError, r.gauge, "a")
+
+    unittest.main()
@@ -94,6 +94,13 @@ class IMediaPoint(IMediaSourceProvider, IMediaDestinationProvider):
         set remote sdp media object
         """
 
+    @abstractmethod
+    def update_remote_media_description(self, remote_media_description):
+        """
+        apply re-negotiated remote sdp media object to running media point
+        :return: True if media source or destination is replaced, i.e. the point has to be relinked
+        """
+
     @abstractmethod
     def set_context(self, context):
         pass
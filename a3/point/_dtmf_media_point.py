@@ -54,14 +54,24 @@ class DtmfMediaPoint(MediaPointDecorator):
                                      +---------------------+                        +------------------
         """
         assert self.__context is not None
-        inner_media_destination = self._media_point.get_media_destination()
-        dtmf_media_destination = self.__dtmf_sender.get_media_destination()
-        dtmf_media_source = self.__dtmf_sender.get_media_source()
-        self.__inner_link = self.__transcoding_factory.create_link(self.__context, dtmf_media_source, inner_media_destination)
-        return dtmf_media_destination
+        if self.__inner_link is None:
+            inner_media_destination = self._media_point.get_media_destination()
+            dtmf_media_source = self.__dtmf_sender.get_media_source()
+            self.__inner_link = self.__transcoding_factory.create_link(self.__context, dtmf_media_source,
+                                                                       inner_media_destination)
+        return self.__dtmf_sender.get_media_destination()
+
+    def update_remote_media_description(self, remote_media_description):
+        replaced = super(DtmfMediaPoint, self).update_remote_media_description(remote_media_description)
+        if replaced:
+            # inner media destination is replaced, link is made again on next get_media_destination
+            self.__dispose_inner_link()
+        return replaced
 
     def set_context(self, context):
         assert context is None or isinstance(context, ITranscodingContext)
+        if context is not self.__context:
+            self.__dispose_inner_link()
         self.__context = context
         super(DtmfMediaPoint, self).set_context(context)
         self.__dtmf_sender.set_context(context)
@@ -80,3 +90,8 @@ class DtmfMediaPoint(MediaPointDecorator):
     def dispose(self):
         self.__dtmf_sender.stop()
         super(DtmfMediaPoint, self).dispose()
+
+    def __dispose_inner_link(self):
+        if self.__inner_link is not None:
+            self.__inner_link.dispose()
+            self.__inner_link = None
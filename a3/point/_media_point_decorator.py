@@ -16,6 +16,18 @@ class MediaPointDecorator(IMediaPoint, IMediaPointListener):
         self._media_point.set_listener(self)
         self._listener = None
 
+    @property
+    def rtp_port(self):
+        return self._media_point.rtp_port
+
+    @property
+    def rtcp_port(self):
+        return self._media_point.rtcp_port
+
+    @property
+    def packets_received(self):
+        return self._media_point.packets_received
+
     #
     # IMediaPoint
     #
@@ -48,6 +60,9 @@ class MediaPointDecorator(IMediaPoint, IMediaPointListener):
     def set_remote_media_description(self, remote_media_description):
         self._media_point.set_remote_media_description(remote_media_description)
 
+    def update_remote_media_description(self, remote_media_description):
+        return self._media_point.update_remote_media_description(remote_media_description)
+
     def set_context(self, context):
         self._media_point.set_context(context)
 
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+Admission control
+
+CostModel estimates CPU units of points and of room joins:
+    point       relay of every media type (socket pair, depay/pay, rtcp), RELAY_COSTS
+    join        links made by joining a room, costs of codec conversions from transcoding planner
+                (decode/encode per codec, video scaled to encoder resolution, see a3.transcoding.gst1._endec):
+                    two points room - both directions between offered codecs of the points
+                    audio mixing    - decoding own audio and encoding own mix
+                    video forwarding - nothing, media is not decoded
+
+Admission keeps units charged per key against node budget (option "cpu-budget"),
+charge exceeding it raises AdmissionError with redirect hint (option "admission-redirect")
+
+Metrics:
+    admission.used          charged units (gauge)
+    admission.budget        budget units, 0 - unlimited (gauge)
+    admission.rejected      rejected charges (counter)
+"""
+
+__author__ = 'RCSLabs'
+
+
+from ..logging import LOG
+from ..media import CODEC, MediaType
+from ..metrics import METRICS
+from ..transcoding.planner import PlanError
+
+import threading
+
+
+RELAY_COSTS = {
+    MediaType.AUDIO: 1,
+    MediaType.VIDEO: 4,
+}
+
+
+class AdmissionError(Exception):
+    def __init__(self, value, redirect=""):
+        self.value = value
+        self.redirect = redirect
+
+    def __str__(self):
+        return str(self.value)
+
+
+def _codecs(point, media_type):
+    """
+    :return: codecs offered to point, preferred first
+    """
+    media = point.local_sdp.get_media(media_type)
+    return [rtp_codec.base_codec for rtp_codec in media.rtp_codecs] if media is not None else []
+
+
+class CostModel(object):
+    def __init__(self, planner):
+        self.__planner = planner
+
+    def point_cost(self, media_types):
+        return sum(RELAY_COSTS[media_type] for media_type in media_types)
+
+    def link_cost(self, source_codecs, destination_codecs):
+        """
+        :return: cost of cheapest conversion from the first convertible source codec, 0 if none
+        """
+        if not destination_codecs:
+            return 0
+        for codec in source_codecs:
+            try:
+                return self.__planner.plan(codec, destination_codecs).cost
+            except PlanError:
+                continue
+        return 0
+
+    def join_cost(self, point, room):
+        """
+        :param point: a3.point.point.Point joining room
+        :param room: a3.point.room.Room
+        """
+        others = [p for p in room.points if p is not point]
+        units = 0
+        for media_type in (MediaType.AUDIO, MediaType.VIDEO):
+            codecs = _codecs(point, media_type)
+            if not codecs:
+                continue
+            if media_type is MediaType.AUDIO and room.audio_mixing:
+                raw = [CODEC.RAW(media_type)]
+                units += self.link_cost(codecs, raw) + self.link_cost(raw, codecs)
+            elif media_type is MediaType.VIDEO and room.video_forwarding:
+                pass
+            elif len(others) == 1:
+                other_codecs = _codecs(others[0], media_type)
+                units += self.link_cost(codecs, other_codecs) + self.link_cost(other_codecs, codecs)
+        return units
+
+
+class Admission(object):
+    def __init__(self, budget, redirect=""):
+        """
+        :param budget: units node can carry, 0 - unlimited
+        :param redirect: hint sent with rejection (e.g. channel of another media controller)
+        """
+        assert budget >= 0
+        self.__budget = budget
+        self.__redirect = redirect
+        self.__charges = {}                 # key -> units
+        self.__used = 0
+        self.__lock = threading.Lock()
+
+        self.__used_gauge = METRICS.gauge("admission.used")
+        self.__rejected_counter = METRICS.counter("admission.rejected")
+        METRICS.gauge("admission.budget").set(budget)
+
+    @property
+    def budget(self):
+        return self.__budget
+
+    @property
+    def used(self):
+        return self.__used
+
+    def charge(self, key, units):
+        """
+        charge units for key (replacing units charged for it before)
+        raises: AdmissionError if budget would be exceeded
+        """
+        with self.__lock:
+            used = self.__used - self.__charges.get(key, 0) + units
+            if self.__budget and used > self.__budget and units > self.__charges.get(key, 0):
+                self.__rejected_counter.inc()
+                LOG.warning("Admission: %s needs %d units, %d of %d used", key, units, self.__used, self.__budget)
+                raise AdmissionError("CPU budget exceeded", self.__redirect)
+            self.__charges[key] = units
+            self.__used = used
+            self.__used_gauge.set(used)
+
+    def release(self, key):
+        with self.__lock:
+            self.__used -= self.__charges.pop(key, 0)
+            self.__used_gauge.set(self.__used)
+
+    def load(self):
+        """
+        :return: accounting for dispatcher
+        """
+        with self.__lock:
+            return {"budget": self.__budget,
+                    "used": self.__used,
+                    "free": max(self.__budget - self.__used, 0) if self.__budget else None}
+
+
+if __name__ == "__main__":
+    import unittest
+    from ..transcoding.planner import Planner
+
+    class AdmissionTest(unittest.TestCase):
+        def test_budget(self):
+            admission = Admission(10, redirect="mc-2")
+            admission.charge("a", 6)
+            self.assertRaises(AdmissionError, admission.charge, "b", 5)
+            try:
+                admission.charge("b", 5)
+            except AdmissionError as e:
+                self.assertEqual(e.redirect, "mc-2")
+            admission.charge("a", 2)                # replacing charge
+            admission.charge("b", 5)
+            self.assertEqual(admission.used, 7)
+            admission.release("a")
+            admission.release("unknown")
+            self.assertEqual(admission.load(), {"budget": 10, "used": 5, "free": 5})
+
+        def test_unlimited(self):
+            admission = Admission(0)
+            admission.charge("a", 1000)
+            self.assertEqual(admission.load()["free"], None)
+
+    class CostModelTest(unittest.TestCase):
+        def test_link_cost(self):
+            model = CostModel(Planner(decode_costs={CODEC.PCMA: 1, CODEC.H264: 20, CODEC.VP8: 20},
+                                      encode_costs={CODEC.PCMA: 1, CODEC.H264: 100, CODEC.VP8: 120}))
+            self.assertEqual(model.link_cost([CODEC.VP8], [CODEC.VP8, CODEC.H264]), 0)
+            self.assertEqual(model.link_cost([CODEC.VP8], [CODEC.H264]), 120)
+            self.assertEqual(model.link_cost([CODEC.OPUS, CODEC.PCMA], [CODEC.RAW_AUDIO]), 1)
+            self.assertEqual(model.link_cost([CODEC.PCMA], []), 0)
+            self.assertEqual(model.point_cost([MediaType.AUDIO, MediaType.VIDEO]), 5)
+
+    unittest.main()
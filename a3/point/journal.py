@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Point journal for hot restart
+
+PointController writes own state to the journal after every transition and room change,
+one JSON object per line, the latest line of a point wins:
+    {"id": <point id>, "state": <state>, "message": {fields of CREATE_MEDIA_POINT},
+     "local_sdp": <sdp>, "remote_sdp": <sdp>, "ports": {"audio": [rtp, rtcp], ...},
+     "conns": [<stun-agent conn id>, ...], "room": <room id or null>}
+    {"id": <point id>, "removed": true}
+
+The file is rewritten with live points only when it holds COMPACT_RATIO lines per live point
+(and on open). Restarted controller takes points() of the journal it opened and rebuilds them
+(see MediaController.restore).
+
+Metrics:
+    journal.write           time of writing one change (histogram)
+    journal.points          live points in journal (gauge)
+    journal.compactions     journal rewrites (counter)
+"""
+
+__author__ = 'RCSLabs'
+
+
+from ..logging import LOG
+from ..metrics import METRICS
+
+import json
+import os
+import threading
+
+
+COMPACT_RATIO = 8
+COMPACT_MIN_LINES = 1024
+
+
+class Journal(object):
+    def __init__(self, path):
+        assert type(path) is str
+        self.__path = path
+        self.__lock = threading.Lock()
+        self.__records = self.__read(path)
+        self.__restored = self.__records.values()
+        self.__lines = 0
+        self.__file = None
+
+        self.__write_histogram = METRICS.histogram("journal.write")
+        self.__points_gauge = METRICS.gauge("journal.points")
+        self.__compactions_counter = METRICS.counter("journal.compactions")
+
+        with self.__lock:
+            self.__compact()
+
+    def points(self):
+        """
+        :return: records of points found in journal when it was opened
+        """
+        return list(self.__restored)
+
+    def write(self, record):
+        """
+        record current state of point, record with "removed" drops it
+        """
+        assert "id" in record
+        line = json.dumps(record, default=str)
+        with self.__write_histogram.time():
+            with self.__lock:
+                if record.get("removed"):
+                    if self.__records.pop(record["id"], None) is None:
+                        return
+                else:
+                    self.__records[record["id"]] = record
+                self.__file.write(line + "\n")
+                self.__file.flush()
+                self.__lines += 1
+                self.__points_gauge.set(len(self.__records))
+                if self.__lines > max(COMPACT_MIN_LINES, COMPACT_RATIO * len(self.__records)):
+                    self.__compact()
+
+    def remove(self, point_id):
+        self.write({"id": point_id, "removed": True})
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
+
+    #
+    # private
+    #
+    @staticmethod
+    def __read(path):
+        records = {}
+        if not os.path.exists(path):
+            return records
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line may be cut by crash
+                    LOG.warning("Journal: skipping corrupted line in %s", path)
+                    continue
+                if record.get("removed"):
+                    records.pop(record["id"], None)
+                else:
+                    records[record["id"]] = record
+        return records
+
+    def __compact(self):
+        """
+        rewrite journal with live points, rename makes it atomic
+        """
+        if self.__file is not None:
+            self.__file.close()
+        tmp_path = self.__path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for record in self.__records.values():
+                f.write(json.dumps(record, default=str) + "\n")
+        os.rename(tmp_path, self.__path)
+        self.__file = open(self.__path, "a")
+        self.__lines = len(self.__records)
+        self.__points_gauge.set(self.__lines)
+        self.__compactions_counter.inc()
+
+
+if __name__ == "__main__":
+    import tempfile
+    import unittest
+
+    class JournalTest(unittest.TestCase):
+        def setUp(self):
+            self.path = tempfile.mktemp(suffix=".journal")
+
+        def tearDown(self):
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+        def test_reopen(self):
+            journal = Journal(self.path)
+            self.assertEqual(journal.points(), [])
+            journal.write({"id": "a", "state": "CREATING_OFFER"})
+            journal.write({"id": "a", "state": "CONNECTED", "room": "r"})
+            journal.write({"id": "b", "state": "CONNECTED"})
+            journal.remove("b")
+            journal.remove("unknown")
+            journal.close()
+            with open(self.path, "a") as f:
+                f.write('{"id": "c", "sta')                  # cut by crash
+
+            journal = Journal(self.path)
+            self.assertEqual(journal.points(), [{"id": "a", "state": "CONNECTED", "room": "r"}])
+            journal.close()
+            with open(self.path) as f:
+                self.assertEqual(len(f.readlines()), 1)
+
+        def test_compact(self):
+            journal = Journal(self.path)
+            for i in range(COMPACT_MIN_LINES + 1):
+                journal.write({"id": "a", "n": i})
+            journal.close()
+            with open(self.path) as f:
+                self.assertEqual(len(f.readlines()), 1)
+
+    unittest.main()
@@ -1,6 +1,23 @@
 #!/usr/bin/env python
 """
 Manager
+
+thread-safe: points and rooms maps are guarded by manager lock,
+room membership changes are serialized per room with room locks
+
+lock order: room locks -> manager lock -> PointController lock
+
+points and joins are charged to admission control (see a3.point.admission),
+those exceeding "cpu-budget" raise AdmissionError
+
+points are reaped when they outlive TTL of their state (see PointController.expired),
+reap(point_id, state) given to manager runs reap_point in background (e.g. on point's worker)
+
+resources of points and rooms are recorded in the ledger (see a3.ledger): point events and room joins
+are scoped with their owner, removed point or room is verified to hold nothing
+
+remove_points/join_rooms handle bulk requests grouped by room: one room lock per room,
+and one pipeline state change per room (stopped once before all points leave, started once after joins)
 """
 
 __author__ = 'RCSLabs'
@@ -9,8 +26,15 @@ __author__ = 'RCSLabs'
 from ..logging import LOG
 from ..config import IConfig
 from ..transcoding._base import ITranscodingFactory
+from ..executor import KeyedLocks
+from ..ledger import LEDGER, ROOM_OWNER
+from ..timer import TimerWheel
 from .room import Room
-from .point_controller import PointController, Event as PointEvent
+from .point_controller import PointController, Event as PointEvent, EXPIRED_REASON
+from .admission import Admission, AdmissionError, CostModel
+
+import collections
+import threading
 
 
 class ManagerError(Exception):
@@ -21,15 +45,31 @@ class ManagerError(Exception):
         return str(self.value)
 
 
+# admission key of point room join
+JOIN_KEY = "%s@room"
+
+
 class Manager(object):
-    def __init__(self, config, transcoding_factory):
+    def __init__(self, config, transcoding_factory, journal=None, reap=None):
+        """
+        :param journal: a3.point.journal.Journal points write their state to, None - no journal
+        :param reap: reap(point_id, state) is called on timer thread for expired point and is to call
+                     reap_point, None - reap_point is called on timer thread
+        """
         assert isinstance(config, IConfig)
         assert isinstance(transcoding_factory, ITranscodingFactory)
         self.__config = config
         self.__transcoding_factory = transcoding_factory
+        self.__journal = journal
+        self.__reap = reap or self.reap_point
 
         self.__points = dict()
         self.__rooms = dict()
+        self.__lock = threading.RLock()
+        self.__room_locks = KeyedLocks()
+        self.__timer_wheel = TimerWheel()
+        self.__cost_model = CostModel(transcoding_factory.get_planner())
+        self.__admission = Admission(config.int_option("cpu-budget"), config.option("admission-redirect") or "")
 
     #
     # public
@@ -37,55 +77,173 @@ class Manager(object):
     def get_point(self, point_id):
         return self.__get_point(point_id)
 
-    def create_point(self, **kwargs):
+    def create_point(self, media_types=(), **kwargs):
+        """
+        :param media_types: media types of point, charged to admission control
+        raises: AdmissionError if point does not fit into cpu budget
+        """
         point_id = str(kwargs["point_id"])
         LOG.info("Creating point " + repr(point_id))
-        point = self.get_point(point_id)
-        if point is not None:
-            raise ManagerError("Attempt to add existing media point")
+        with self.__lock:
+            point = self.get_point(point_id)
+            if point is not None:
+                raise ManagerError("Attempt to add existing media point")
 
-        point = PointController(**kwargs)
-        self.__points[point_id] = point
+            self.__admission.charge(point_id, self.__cost_model.point_cost(media_types))
+            try:
+                point = PointController(timer_wheel=self.__timer_wheel, journal=self.__journal,
+                                        on_expired=self.__reap, **kwargs)
+            except Exception:
+                self.__admission.release(point_id)
+                raise
+            self.__points[point_id] = point
         return point
 
+    def get_point_ids(self):
+        with self.__lock:
+            return self.__points.keys()
+
+    def load(self):
+        """
+        :return: admission accounting with number of points and rooms, resources held and leaked
+        """
+        load = self.__admission.load()
+        with self.__lock:
+            load.update(points=len(self.__points), rooms=len(self.__rooms))
+        load.update(resources=LEDGER.counts(), leaked=LEDGER.leaked())
+        return load
+
     def remove_room(self, room_id):
         assert type(room_id) is str
-        room = self.__get_room(room_id)
-        if room:
-            self.__remove_room(room)
+        with self.__room_locks.hold(room_id):
+            room = self.__get_room(room_id)
+            if room:
+                self.__remove_room(room)
 
-    def remove_point(self, point_id):
+    def remove_point(self, point_id, message=None, reason=None):
+        """
+        :param message: message REMOVE_MEDIA_POINT_OK is replied to, None - initiator message of point
+        :param reason: "reason" of the reply, None - no field
+        """
         point = self.get_point(point_id)
         if point is None:
             raise ManagerError("Attempt to remove nonexisting point")
 
         room = self.get_room_for_point(point)
         if room is not None:
-            room.unjoin(point)
-            self.unjoin_point(point)
-            if room.points_count == 0:
-                self.remove_room(room)
+            with self.__room_locks.hold(room.room_id):
+                self.__unjoin(point)
+
+        if not self.__remove_point(point, message, reason):
+            raise ManagerError("Attempt to remove nonexisting point")
+
+    def reap_point(self, point_id, state):
+        """
+        remove point whose TTL of state is over, unless it has left the state (or got rtp) meanwhile
+        """
+        point = self.get_point(point_id)
+        if point is None or not point.expired(state):
+            return
+        try:
+            self.remove_point(point_id, reason=EXPIRED_REASON)
+        except ManagerError as e:
+            # removed meanwhile
+            LOG.debug(str(e))
+
+    def remove_points(self, point_ids, messages=None):
+        """
+        remove many points, points of one room are unjoined under one room lock,
+        room left by all its points stops its pipeline once before they are unjoined
+        :param messages: {point id: message REMOVE_MEDIA_POINT_OK is replied to}, others reply to initiator
+        :return: {point id: ManagerError} of points not removed
+        """
+        messages = messages or {}
+        errors = {}
+        points = []
+        rooms = collections.OrderedDict()          # room id -> (room, [point])
+        for point_id in collections.OrderedDict.fromkeys(point_ids):
+            point = self.get_point(point_id)
+            if point is None:
+                errors[point_id] = ManagerError("Attempt to remove nonexisting point")
+                continue
+            points.append(point)
+            room = self.get_room_for_point(point)
+            if room is not None:
+                rooms.setdefault(room.room_id, (room, []))[1].append(point)
 
-        point.event(PointEvent.REMOVE)
-        del self.__points[point.point_id]
+        for (room, room_points) in rooms.values():
+            with self.__room_locks.hold(room.room_id):
+                if len(room_points) == room.points_count:
+                    room.halt()
+                for point in room_points:
+                    self.__unjoin(point)
+
+        for point in points:
+            if not self.__remove_point(point, messages.get(point.point_id)):
+                errors[point.point_id] = ManagerError("Attempt to remove nonexisting point")
+        return errors
 
     def join_room(self, point_id, room_id):
         point = self.__get_point(point_id)
         if point is None:
             raise ManagerError("Attempt to join_room with unexisting point")
 
-        room = self.get_room(room_id)
         current_room = self.get_room_for_point(point)
-        if current_room is not None and current_room is not room:
-            current_room.unjoin(point)
-            self.unjoin(point_id)
-            current_room = None
-
-        if current_room != room:
-            point.room = room
-            room.join(point)
-        else:
-            raise ManagerError("Attempt to join point to room where point is already")
+        room_ids = [room_id] if current_room is None else [room_id, current_room.room_id]
+        with self.__room_locks.hold(*room_ids):
+            room = self.get_room(room_id)
+            try:
+                self.__join(point, room)
+            finally:
+                if room.points_count == 0:
+                    self.__remove_room(room)
+
+    def join_rooms(self, joins):
+        """
+        join many points, joins to one room are made under one room lock
+        and the room pipeline is started once after all of them
+        :param joins: [(point id, room id)]
+        :return: {point id: ManagerError or AdmissionError} of points not joined
+        """
+        errors = {}
+        rooms = collections.OrderedDict()          # room id -> [point]
+        for (point_id, room_id) in joins:
+            point = self.__get_point(point_id)
+            if point is None:
+                errors[point_id] = ManagerError("Attempt to join_room with unexisting point")
+                continue
+            rooms.setdefault(room_id, []).append(point)
+
+        for (room_id, points) in rooms.items():
+            current_rooms = [self.get_room_for_point(point) for point in points]
+            room_ids = [room_id] + [current.room_id for current in current_rooms if current is not None]
+            with self.__room_locks.hold(*room_ids):
+                room = self.get_room(room_id)
+                for point in points:
+                    try:
+                        self.__join(point, room, play=False)
+                    except (ManagerError, AdmissionError) as e:
+                        errors[point.point_id] = e
+                if room.points_count == 0:
+                    self.__remove_room(room)
+                else:
+                    room.play()
+        return errors
+
+    def set_remote_sdp(self, point_id, sdp):
+        """
+        SDP_ANSWER, re-negotiation may relink the point in its room
+        """
+        point = self.__get_point(point_id)
+        if point is None:
+            raise ManagerError("Attempt to set remote sdp of unexisting point")
+
+        room = self.get_room_for_point(point)
+        if room is None:
+            point.event(PointEvent.SDP_ANSWER, sdp=sdp)
+            return
+        with self.__room_locks.hold(room.room_id):
+            point.event(PointEvent.SDP_ANSWER, sdp=sdp)
 
     def unjoin(self, point_id):
         point = self.__get_point(point_id)
@@ -96,7 +254,8 @@ class Manager(object):
         if room is None:
             raise ManagerError("Attempt to unjoin point which is without room")
 
-        self.__unjoin(point)
+        with self.__room_locks.hold(room.room_id):
+            self.__unjoin(point)
 
     #
     # private
@@ -107,43 +266,92 @@ class Manager(object):
 
     def get_room(self, room_id):
         assert type(room_id) is str
-        if room_id in self.__rooms:
-            return self.__rooms[room_id]
-        room = Room(room_id, self.__transcoding_factory)
-        self.__rooms[room_id] = room
-        return room
+        with self.__lock:
+            if room_id in self.__rooms:
+                return self.__rooms[room_id]
+            room = Room(room_id, self.__transcoding_factory,
+                        audio_mixing=self.__config.option("audio-mixing") == "1",
+                        video_forwarding=self.__config.option("video-forwarding") == "1")
+            self.__rooms[room_id] = room
+            return room
+
+    def __join(self, point, room, play=True):
+        """
+        called with room locks of room and current room of point held
+        """
+        current_room = self.get_room_for_point(point)
+        if current_room is room:
+            raise ManagerError("Attempt to join point to room where point is already")
+        # replaces charge of current room, rejected point stays where it is
+        self.__admission.charge(JOIN_KEY % point.point_id, self.__cost_model.join_cost(point.point, room))
+        if current_room is not None:
+            self.__leave(point, current_room)
+        point.room = room
+        with LEDGER.owner(ROOM_OWNER % room.room_id):
+            room.join(point, play)
+
+    def __remove_point(self, point, message, reason=None):
+        """
+        point may be removed by two threads at once (reap runs on timer thread with workers=0),
+        the one taking it out of points removes it, point failing to be removed is put back
+        :return: False if point is removed by another thread
+        """
+        with self.__lock:
+            if self.__points.get(point.point_id) is not point:
+                return False
+            del self.__points[point.point_id]
+        try:
+            point.event(PointEvent.REMOVE, message=message, reason=reason)
+        except Exception:
+            with self.__lock:
+                self.__points.setdefault(point.point_id, point)
+            raise
+        self.__admission.release(point.point_id)
+        LEDGER.verify(point.point_id)
+        return True
 
     def __unjoin(self, point):
         assert type(point) is PointController
         room = self.get_room_for_point(point)
         if room:
-            LOG.debug("Manager. Room[%s] unjoin point [%s]", room.room_id, point.point_id)
-            room.unjoin(point)
-            point.room = None
-            if room.points_count == 0:
-                self.__remove_room(room)
+            self.__leave(point, room)
+            self.__admission.release(JOIN_KEY % point.point_id)
+
+    def __leave(self, point, room):
+        LOG.debug("Manager. Room[%s] unjoin point [%s]", room.room_id, point.point_id)
+        room.unjoin(point)
+        point.room = None
+        if room.points_count == 0:
+            self.__remove_room(room)
 
     def __remove_room(self, room):
         assert type(room) is Room and room.points_count == 0
         LOG.debug("Manager. remove room[%s]", room.room_id)
         room.stop()
         room.dispose()
-        del self.__rooms[room.room_id]
+        with self.__lock:
+            del self.__rooms[room.room_id]
+        LEDGER.verify(ROOM_OWNER % room.room_id)
+
+    @property
+    def timer_wheel(self):
+        return self.__timer_wheel
 
-    #
-    # TODO: remove
-    #
     def on_timer(self):
-        for point in self.__points.values():
-            point.event(PointEvent.TIMER)
+        """
+        fire due timers, points register own timers (see a3.timer), nothing is scanned here
+        """
+        self.__timer_wheel.advance()
 
     def __get_point(self, point_id):
         assert type(point_id) is str
-        return self.__points[point_id] if point_id in self.__points else None
+        with self.__lock:
+            return self.__points.get(point_id)
 
     def __get_room(self, room_id):
         assert type(room_id) is str
-        return self.__rooms[room_id] if room_id in self.__rooms else None
+        with self.__lock:
+            return self.__rooms.get(room_id)
 
     def bind_point_to_room(self, point_controller, room):
         assert type(point_controller) is PointController
@@ -1,49 +1,147 @@
 #!/usr/bin/env python
 """
+MediaRoom: points of one media type linked in one transcoding context
 
+by default room links two points to each other,
+audio room with mixing links any number of points through IAudioMixer (each point hears all others),
+video room with forwarding links any number of points through IVideoForwarder (no transcoding)
 """
 
 from a3.logging import LOG
+from a3.ledger import LEDGER, KIND
 from a3.media import MediaType
 from _base import IMediaPoint
 from a3.transcoding._base import ITranscodingFactory, IMediaDestination, IMediaSource
 
 
 class MediaRoom(object):
-    def __init__(self, media_type, transcoding_factory):
+    def __init__(self, media_type, transcoding_factory, mixing=False, forwarding=False):
         assert type(media_type) is MediaType
         assert isinstance(transcoding_factory, ITranscodingFactory)
+        assert not mixing or media_type is MediaType.AUDIO
+        assert not forwarding or media_type is MediaType.VIDEO
         self.__media_type = media_type
         self.__transcoding_factory = transcoding_factory
 
         self.__points = []
+        self.__links = []
         self.__context = self.__transcoding_factory.create_transcoding_context()
+        LEDGER.acquire(KIND.GST_PIPELINE, self.__context)
         #self.__context.pause()
+        # mixer or forwarder, links any number of points
+        self.__router = None
+        if mixing:
+            self.__router = self.__transcoding_factory.create_audio_mixer(self.__context)
+        elif forwarding:
+            self.__router = self.__transcoding_factory.create_video_forwarder(self.__context)
 
-    def join(self, media_point):
+    @property
+    def points_count(self):
+        return len(self.__points)
+
+    def join(self, media_point, play=True):
+        """
+        :param play: start pipeline when room is ready, False - play() is called after a group of joins
+        """
         assert isinstance(media_point, IMediaPoint)
         if media_point in self.__points:
             return
+        if self.__router is not None:
+            self.__join_router(media_point, play)
+            return
         assert len(self.__points) <= 1            # currently no more than 2 points in room
         self.__points.append(media_point)
         self.__add_point_to_pipeline(media_point)
         if len(self.__points) == 2:
             self.__link_points(self.__points[0], self.__points[1])
             self.__link_points(self.__points[1], self.__points[0])
+            if play:
+                self.play()
+
+    def play(self):
+        """
+        start pipeline if room has points to play
+        """
+        if self.__router is not None and self.__points or len(self.__points) == 2:
             LOG.debug("MediaRoom.starting pipeline")
             self.__context.play()
-            for p in self.__points:
-                p.force_key_unit()
+            if self.__router is None:
+                for p in self.__points:
+                    p.force_key_unit()
+
+    def halt(self):
+        """
+        stop pipeline, e.g. before all points are unjoined
+        """
+        LOG.debug("MediaRoom.stopping pipeline")
+        self.__context.stop()
 
     def unjoin(self, media_point):
         assert isinstance(media_point, IMediaPoint)
+        if media_point in self.__points and self.__router is not None:
+            self.__unjoin_router(media_point)
+            return
         if media_point in self.__points:
             if len(self.__points) == 2:
                 LOG.debug("MediaRoom.stopping pipeline")
                 self.__context.stop()
+                for link in self.__links:
+                    link.dispose()
+                self.__links = []
             self.__points.remove(media_point)
             self.__remove_point_from_pipeline(media_point)
 
+    def dispose(self):
+        """
+        unjoin points left, release links, router and transcoding context
+        """
+        LOG.debug("MediaRoom.dispose")
+        for media_point in list(self.__points):
+            self.unjoin(media_point)
+        for link in self.__links:
+            link.dispose()
+        self.__links = []
+        if self.__router is not None:
+            self.__router.dispose()
+            self.__router = None
+        self.__context.dispose()
+        LEDGER.release(KIND.GST_PIPELINE, self.__context)
+        self.__context = None
+
+    def relink(self, media_point):
+        """
+        media source or destination of joined point is replaced, links are made again
+        """
+        assert isinstance(media_point, IMediaPoint)
+        if media_point not in self.__points:
+            return
+        LOG.debug("MediaRoom.relink %s", media_point.point_id)
+        if self.__router is not None:
+            self.__router.remove(media_point.point_id)
+            self.__router.add(media_point.point_id, media_point.get_media_source(),
+                              media_point.get_media_destination())
+        elif len(self.__points) == 2:
+            for link in self.__links:
+                link.dispose()
+            self.__links = []
+            self.__link_points(self.__points[0], self.__points[1])
+            self.__link_points(self.__points[1], self.__points[0])
+
+    def __join_router(self, media_point, play):
+        self.__points.append(media_point)
+        self.__add_point_to_pipeline(media_point)
+        self.__router.add(media_point.point_id, media_point.get_media_source(), media_point.get_media_destination())
+        if len(self.__points) == 1 and play:
+            self.play()
+
+    def __unjoin_router(self, media_point):
+        self.__router.remove(media_point.point_id)
+        self.__points.remove(media_point)
+        self.__remove_point_from_pipeline(media_point)
+        if not self.__points:
+            LOG.debug("MediaRoom.stopping pipeline")
+            self.__context.stop()
+
     def __add_point_to_pipeline(self, media_point):
         LOG.debug("MediaRoom.add_point %s", media_point.point_id)
         assert isinstance(media_point, IMediaPoint)
@@ -64,5 +162,6 @@ class MediaRoom(object):
         assert isinstance(media_destination, IMediaDestination)
 
         transcoded_link = self.__transcoding_factory.create_link(self.__context, media_source, media_destination)
+        self.__links.append(transcoded_link)
         #media_source.link(media_destination)
         a.force_key_unit()
@@ -10,6 +10,7 @@ from a3.sdp.session_description import SessionDescription
 from a3.transcoding._base import ITranscodingFactory
 from a3.config import IConfig
 from a3.config.profile import Profile
+from a3.media import MediaType
 from ._base import MediaPointError, IMediaPointListener
 from .rtp_media_point import RtpMediaPoint
 from .rtmp_media_point import RtmpMediaPoint
@@ -37,7 +38,11 @@ class IPointListener(object):
 
 
 class Point(IMediaPointListener):
-    def __init__(self, point_id, listener, local_sdp, balancer, config, transcoding_factory, profile):
+    def __init__(self, point_id, listener, local_sdp, balancer, config, transcoding_factory, profile,
+                 ports=None):
+        """
+        :param ports: {media type: (rtp, rtcp)} to open (point restored after restart), None - any
+        """
         assert type(point_id) is str
         assert isinstance(listener, IPointListener)
         assert type(local_sdp) is SessionDescription
@@ -57,12 +62,15 @@ class Point(IMediaPointListener):
         self.__remote_sdp = None
         self.__audio_point = None
         self.__video_point = None
+        self.__srtp_points = []
+        ports = ports or {}
         self.__audio_point_ready = not bool(self.__local_sdp.audio)
         self.__video_point_ready = not bool(self.__local_sdp.video)
         if self.__local_sdp.audio:
             audio_point_id = self.__point_id + ".audio"
             if "RTP" in self.__local_sdp.audio.proto:
-                self.__audio_point = RtpMediaPoint(audio_point_id, self.__transcoding_factory)
+                self.__audio_point = RtpMediaPoint(audio_point_id, self.__transcoding_factory,
+                                                   ports=ports.get(MediaType.AUDIO))
             elif "RTMP" in self.__local_sdp.audio.proto:
                 self.__audio_point = RtmpMediaPoint(audio_point_id, self.__transcoding_factory)
             else:
@@ -73,6 +81,7 @@ class Point(IMediaPointListener):
                                                     balancer=balancer,
                                                     config=config,
                                                     transcoding_factory=self.__transcoding_factory)
+                self.__srtp_points.append(self.__audio_point)
 
             # add saving capability
             #self.__add_filesave_capability()
@@ -87,7 +96,8 @@ class Point(IMediaPointListener):
         if self.__local_sdp.video:
             video_point_id = self.__point_id + ".video"
             if "RTP" in self.__local_sdp.video.proto:
-                self.__video_point = RtpMediaPoint(video_point_id, self.__transcoding_factory)
+                self.__video_point = RtpMediaPoint(video_point_id, self.__transcoding_factory,
+                                                   ports=ports.get(MediaType.VIDEO))
             elif "RTMP" in self.__local_sdp.video.proto:
                 self.__video_point = RtmpMediaPoint(video_point_id, self.__transcoding_factory)
             else:
@@ -98,6 +108,7 @@ class Point(IMediaPointListener):
                                                     balancer=balancer,
                                                     config=config,
                                                     transcoding_factory=self.__transcoding_factory)
+                self.__srtp_points.append(self.__video_point)
 
             self.__video_point.set_listener(self)
             self.__video_point.set_profile(self.__profile)
@@ -116,6 +127,36 @@ class Point(IMediaPointListener):
     def video_point(self):
         return self.__video_point
 
+    @property
+    def ports(self):
+        """
+        :return: {media type: (rtp, rtcp)} of rtp media points
+        """
+        result = {}
+        for (media_type, media_point, media) in ((MediaType.AUDIO, self.__audio_point, self.__local_sdp.audio),
+                                                 (MediaType.VIDEO, self.__video_point, self.__local_sdp.video)):
+            if media_point is not None and "RTP" in media.proto:
+                result[media_type] = (media_point.rtp_port, media_point.rtcp_port)
+        return result
+
+    @property
+    def packets_received(self):
+        """
+        :return: rtp packets received by rtp media points, None - point has no rtp media
+        """
+        counts = [media_point.packets_received
+                  for (media_point, media) in ((self.__audio_point, self.__local_sdp.audio),
+                                               (self.__video_point, self.__local_sdp.video))
+                  if media_point is not None and "RTP" in media.proto]
+        return sum(counts) if counts else None
+
+    @property
+    def conn_ids(self):
+        """
+        :return: ids of stun-agent conns of srtp media points
+        """
+        return [conn_id for srtp_point in self.__srtp_points for conn_id in srtp_point.conn_ids]
+
     def start(self):
         LOG.debug("Point.start [%s]", self.__point_id)
         if self.__audio_point:
@@ -155,16 +196,43 @@ class Point(IMediaPointListener):
 
     @property
     def remote_sdp(self):
-        return None
+        return self.__remote_sdp
 
     @remote_sdp.setter
     def remote_sdp(self, remote_sdp):
         assert type(remote_sdp) is SessionDescription
         if self.__remote_sdp:
-            self.__update_remote_sdp(remote_sdp)
+            self.renegotiate(remote_sdp)
         else:
             self.__set_remote_sdp(remote_sdp)
 
+    def renegotiate(self, remote_sdp):
+        """
+        apply new remote sdp (re-offer, hold/resume) to running media points,
+        each changes only what differs, ports and pipeline are kept;
+        remote_sdp becomes the new sdp only if no media point rejected it
+        :return: (media points with replaced media source or destination - room has to relink them,
+                  True if the sdp is applied by all media points)
+        """
+        assert type(remote_sdp) is SessionDescription
+        assert self.__remote_sdp is not None
+        LOG.debug("Point.renegotiate [%s]\n%s", self.__point_id, remote_sdp)
+        replaced = []
+        applied = True
+        for (media_point, remote_media) in ((self.__audio_point, remote_sdp.audio),
+                                            (self.__video_point, remote_sdp.video)):
+            if media_point is None or remote_media is None:
+                continue
+            try:
+                if media_point.update_remote_media_description(remote_media):
+                    replaced.append(media_point)
+            except MediaPointError as e:
+                LOG.warning("Point: renegotiate %s: %s, previous media is kept", media_point.point_id, e)
+                applied = False
+        if applied:
+            self.__remote_sdp = remote_sdp
+        return replaced, applied
+
     def media_point_frontend_ready(self, media_point):
         if media_point is self.__audio_point:
             self.__audio_point_ready = True
@@ -208,12 +276,6 @@ class Point(IMediaPointListener):
     #
     # Private
     #
-    def __update_remote_sdp(self, remote_sdp):
-        """
-        TODO: not implemented
-        """
-        LOG.warning("Trying to update remote SDP for point: NOT IMPLEMENTED")
-
     def __set_remote_sdp(self, remote_sdp):
         assert type(remote_sdp) is SessionDescription
         LOG.debug("Point.remote_sdp [%s]\n%s", self.__point_id, remote_sdp)
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 
 
+from a3.ledger import LEDGER, ROOM_OWNER
 from a3.logging import LOG
+from a3.metrics import METRICS
 from a3.sdp.capabilities import Cc, Vv
 from a3.sdp.factory import Factory as SdpFactory
 from a3.sdp.error import SemanticError
@@ -9,6 +11,9 @@ from a3.sdp.raw.attributes.error import ParseError
 from a3.transcoding._base import ITranscodingFactory
 from .point import Point, IPointListener
 
+import threading
+import time
+
 
 class MessageType:
     CREATE_POINT = "CREATE_MEDIA_POINT"
@@ -34,6 +39,8 @@ class Event:
     CONN_READY = "e:CONN_READY"
     REMOVE = "e:REMOVE"
     TIMER = "e:TIMER"
+    SEND_DTMF = "e:SEND_DTMF"
+    RESTORE = "e:RESTORE"
 
 
 class State:
@@ -41,6 +48,7 @@ class State:
     ERROR = "ERROR"
     CREATING_OFFER = "CREATING_OFFER"
     CREATING_ANSWER = "CREATING_ANSWER"
+    RESTORING = "RESTORING"
     WAITING_REMOTE_SDP = "WAITING_REMOTE_SDP"
     CONNECTED = "CONNECTED"
     CLOSED = "CLOSED"
@@ -60,18 +68,85 @@ class PointControllerError(Exception):
         return str(self.value)
 
 
+# fields of initiator message not needed to reply, left out of journal
+JOURNAL_SKIPPED_FIELDS = ("sdp", "cc", "vv")
+
+# options with seconds point may stay in state, in CONNECTED renewed while rtp is received,
+# restored point waits for its conns as long as a new one
+TTL_OPTIONS = {
+    State.CREATING_OFFER: "ttl-creating-offer",
+    State.RESTORING: "ttl-creating-offer",
+    State.WAITING_REMOTE_SDP: "ttl-waiting-remote-sdp",
+    State.CONNECTED: "ttl-connected",
+}
+
+# "reason" of replies to points removed by TTL
+EXPIRED_REASON = "expired"
+
+# seconds between Event.TIMER of connected point (srtp points force video key units on it)
+TIMER_INTERVAL = 10
+
+_HISTOGRAMS = {}
+
+
+def _histogram(name):
+    histogram = _HISTOGRAMS.get(name)
+    if histogram is None:
+        histogram = _HISTOGRAMS[name] = METRICS.histogram(name)
+    return histogram
+
+
 class PointController(IPointListener):
-    def __init__(self, point_id, initiator_message, config, balancer, transcoding_factory):
+    """
+    Point state machine
+
+    transitions are declared in TRANSITIONS: (state, event) -> handler,
+    events missing there are logged as unhandled
+
+    with journal (a3.point.journal) state is written after every transition and room change,
+    RESTORE event rebuilds point of the journal on the same ports without replying
+
+    SDP_ANSWER in CONNECTED is re-negotiation: running point applies the changes (see Point.renegotiate),
+    media points with replaced codec are relinked in the room
+
+    entering state with TTL (TTL_OPTIONS) schedules on_expired(point_id, state) on timer wheel,
+    the owner checks expired(state) and removes the point; in CONNECTED TTL is renewed while
+    rtp packets keep coming (Point.packets_received)
+
+    connected point gets Event.TIMER every TIMER_INTERVAL from timer wheel,
+    so Point.on_timer runs under the point lock like any other event
+
+    Metrics:
+        point.handle.<state>.<event>    handler run time
+        point.state.<from>-><to>        time spent in <from> before moving to <to>
+        point.expired.<state>           points expired in state (counter)
+    """
+    def __init__(self, point_id, initiator_message, config, balancer, transcoding_factory, timer_wheel=None,
+                 journal=None, on_expired=None):
+        """
+        :param on_expired: called on timer thread as on_expired(point_id, state) when TTL of state is over,
+                           None - TTLs are not watched
+        """
         assert isinstance(transcoding_factory, ITranscodingFactory)
         self.__point_id = point_id
         self.__initiator_message = initiator_message
         self.__config = config
         self.__balancer = balancer
         self.__transcoding_factory=transcoding_factory
+        self.__timer_wheel = timer_wheel
+        self.__journal = journal
+        self.__remote_sdp = None
         self.__state = State.START
+        self.__state_entered = time.time()
         self.__room = None
         self.__point = None
         self.__room = None
+        self.__lock = threading.RLock()
+        self.__on_expired = on_expired
+        self.__ttls = dict((state, config.float_option(name)) for (state, name) in TTL_OPTIONS.items())
+        self.__ttl_timer = None
+        self.__timer = None
+        self.__packets_received = 0
 
     @property
     def point_id(self):
@@ -87,7 +162,9 @@ class PointController(IPointListener):
 
     @room.setter
     def room(self, room):
-        self.__room = room
+        with self.__lock:
+            self.__room = room
+            self.__write_journal()
 
     def reply(self, message_type, message_attributes=None):
         self.__initiator_message.reply(message_type, message_attributes)
@@ -99,64 +176,184 @@ class PointController(IPointListener):
     @state.setter
     def state(self, new_state):
         LOG.debug("PointController[%s]: transition %s -> %s", self.__point_id, self.__state, new_state)
+        now = time.time()
+        _histogram("point.state.%s->%s" % (self.__state, new_state)).observe(now - self.__state_entered)
         self.__state = new_state
+        self.__state_entered = now
+        self.__packets_received = 0
+        self.__arm_ttl()
+        self.__arm_timer()
 
     def event(self, event_type, **kwargs):
-        if event_type != Event.TIMER:
-            LOG.debug("PointController[%s]: Got event %s in state %s",
-                      self.__point_id, repr(event_type), repr(self.__state))
-
-        if self.state == State.START:
-            if event_type == Event.CREATE_OFFER:
-                self.__create_offer(**kwargs)
-            else:
+        """
+        events come from message workers, timer and stun-agent threads, one at a time per point,
+        resources acquired by handlers are recorded against the point in the ledger
+        """
+        with self.__lock:
+            state = self.__state
+            handler = self.TRANSITIONS.get((state, event_type))
+            if handler is None:
                 self.__unhandled_event(event_type)
+                return
+            if event_type == Event.TIMER:
+                handler(self, **kwargs)
+                return
+            LOG.debug("PointController[%s]: Got event %r in state %r", self.__point_id, event_type, state)
+            with _histogram("point.handle.%s.%s" % (state, event_type[2:])).time(), LEDGER.owner(self.__point_id):
+                handler(self, **kwargs)
+            if self.__state != state:
+                self.__write_journal()
+
+    def expired(self, state):
+        """
+        check TTL reported by on_expired, connected point which received rtp meanwhile gets new TTL
+        :return: True if point is still in state and is to be removed
+        """
+        with self.__lock:
+            if self.__state != state:
+                return False
+            if state == State.CONNECTED:
+                packets = self.__point.packets_received
+                if packets is None:
+                    return False
+                if packets != self.__packets_received:
+                    self.__packets_received = packets
+                    self.__arm_ttl()
+                    return False
+            LOG.warning("PointController[%s]: expired in %s after %d sec", self.__point_id, state,
+                        time.time() - self.__state_entered)
+            METRICS.counter("point.expired.%s" % state).inc()
+            return True
+
+    def snapshot(self):
+        """
+        :return: journal record of point
+        """
+        message = self.__initiator_message
+        fields = dict((name, value) for (name, value) in message.all() if name not in JOURNAL_SKIPPED_FIELDS)
+        fields["type"] = message.type
+        record = {"id": self.__point_id,
+                  "state": self.__state,
+                  "message": fields,
+                  "room": self.__room.room_id if self.__room is not None else None}
+        if self.__point is not None and self.__point.local_sdp is not None:
+            record["local_sdp"] = str(self.__point.local_sdp)
+            record["ports"] = dict((str(media_type), list(ports))
+                                   for (media_type, ports) in self.__point.ports.items())
+            record["conns"] = self.__point.conn_ids
+        if self.__remote_sdp is not None:
+            record["remote_sdp"] = self.__remote_sdp
+        return record
 
-        elif self.state == State.CREATING_OFFER:
-            if event_type == Event.CONN_READY:
-                LOG.debug("PointController.LOCAL-SDP=%s", self.__point.local_sdp)
-                self.state = State.WAITING_REMOTE_SDP
-                self.reply(MessageType.SDP_OFFER, {"sdp": str(self.__point.local_sdp)})
-            elif event_type == Event.REMOVE:
-                self.__remove()
-                self.reply(MessageType.REMOVE_POINT_OK)
-            elif event_type == Event.TIMER:
-                pass
-            else:
-                self.__unhandled_event(event_type)
+    #
+    # transition handlers
+    #
+    def __on_create_offer(self, cc, vv, profile):
+        self.__create_offer(cc, vv, profile)
 
-        elif self.state == State.WAITING_REMOTE_SDP:
-            if event_type == Event.SDP_ANSWER:
-                try:
-                    self.state = State.CONNECTED
-                    self.__on_remote_sdp(**kwargs)
-                    self.reply(MessageType.CREATE_POINT_OK)
-                except (ParseError, AssertionError) as err:
-                    LOG.exception("Exception while parsing SDP-ANSWER: %s", str(err))
-                    self.state = State.ERROR
-                    self.reply(MessageType.CREATE_POINT_FAILED)
-
-            elif event_type == Event.REMOVE:
-                self.__remove()
-                self.reply(MessageType.REMOVE_POINT_OK)
-            elif event_type == Event.TIMER:
-                pass
-            else:
-                self.__unhandled_event(event_type)
+    def __on_conn_ready(self):
+        LOG.debug("PointController.LOCAL-SDP=%s", self.__point.local_sdp)
+        self.state = State.WAITING_REMOTE_SDP
+        self.reply(MessageType.SDP_OFFER, {"sdp": str(self.__point.local_sdp)})
 
-        elif self.state == State.CONNECTED:
-            if event_type == Event.REMOVE:
-                self.__remove()
-                self.reply(MessageType.REMOVE_POINT_OK)
-            elif event_type == Event.TIMER:
-                self.__point.on_timer()
-            elif event_type == "SEND_DTMF":
-                self.__point.send_dtmf(kwargs["dtmf"])
-            else:
-                self.__unhandled_event(event_type)
+    def __on_sdp_answer(self, sdp):
+        try:
+            self.state = State.CONNECTED
+            self.__on_remote_sdp(sdp)
+            self.reply(MessageType.CREATE_POINT_OK)
+        except (ParseError, AssertionError) as err:
+            LOG.exception("Exception while parsing SDP-ANSWER: %s", str(err))
+            self.state = State.ERROR
+            self.reply(MessageType.CREATE_POINT_FAILED)
+
+    def __on_sdp_update(self, sdp):
+        try:
+            (replaced, applied) = self.__point.renegotiate(SdpFactory.create_from_string(sdp))
+        except (ParseError, SemanticError, AssertionError) as err:
+            LOG.warning("PointController[%s]: re-negotiation SDP is rejected: %s", self.__point_id, err)
+            return
+        if applied:
+            # journal keeps SDP the point runs with
+            self.__remote_sdp = sdp
+        if replaced and self.__room is not None:
+            # links belong to the room
+            with LEDGER.owner(ROOM_OWNER % self.__room.room_id):
+                self.__room.relink(self, replaced)
+        self.__write_journal()
+
+    def __on_remove(self, message=None, reason=None):
+        """
+        :param message: REMOVE_MEDIA_POINT_OK is replied to it (item of bulk remove), None - to initiator
+        :param reason: "reason" of the reply (point removed by controller itself), None - no field
+        """
+        offered = self.__state not in (State.START, State.CREATING_OFFER)
+        self.__remove()
+        data = {"reason": reason} if reason is not None else None
+        if message is not None:
+            message.reply(MessageType.REMOVE_POINT_OK, data)
+        elif offered or reason is None:
+            self.reply(MessageType.REMOVE_POINT_OK, data)
+        else:
+            # initiator has not got SDP_OFFER yet
+            self.reply(MessageType.CREATE_POINT_FAILED, data)
 
+    def __on_restore(self, local_sdp, remote_sdp, profile, ports):
+        assert self.__point is None
+        self.state = State.RESTORING
+        self.__remote_sdp = remote_sdp
+        self.__point = Point(self.__point_id,
+                             listener=self,
+                             local_sdp=SdpFactory.create_from_string(local_sdp),
+                             balancer=self.__balancer,
+                             config=self.__config,
+                             transcoding_factory=self.__transcoding_factory,
+                             profile=profile,
+                             ports=ports)
+        self.__point.start()
+
+    def __on_restored_conn_ready(self):
+        if self.__remote_sdp is None:
+            self.state = State.WAITING_REMOTE_SDP
         else:
-            self.__unhandled_event(event_type)
+            self.state = State.CONNECTED
+            self.__point.remote_sdp = SdpFactory.create_from_string(self.__remote_sdp)
+
+    def __on_timer(self):
+        self.__point.on_timer()
+
+    def __on_send_dtmf(self, dtmf):
+        self.__point.send_dtmf(dtmf)
+
+    def __ignore(self, **kwargs):
+        pass
+
+    TRANSITIONS = {
+        (State.START, Event.CREATE_OFFER): __on_create_offer,
+        (State.START, Event.RESTORE): __on_restore,
+
+        (State.RESTORING, Event.CONN_READY): __on_restored_conn_ready,
+        (State.RESTORING, Event.REMOVE): __on_remove,
+        (State.RESTORING, Event.TIMER): __ignore,
+
+        (State.CREATING_OFFER, Event.CONN_READY): __on_conn_ready,
+        (State.CREATING_OFFER, Event.REMOVE): __on_remove,
+        (State.CREATING_OFFER, Event.TIMER): __ignore,
+
+        (State.WAITING_REMOTE_SDP, Event.SDP_ANSWER): __on_sdp_answer,
+        (State.WAITING_REMOTE_SDP, Event.REMOVE): __on_remove,
+        (State.WAITING_REMOTE_SDP, Event.TIMER): __ignore,
+
+        (State.CONNECTED, Event.SDP_ANSWER): __on_sdp_update,
+        (State.CONNECTED, Event.REMOVE): __on_remove,
+        (State.CONNECTED, Event.TIMER): __on_timer,
+        (State.CONNECTED, Event.SEND_DTMF): __on_send_dtmf,
+
+        # point may hold resources of failed negotiation
+        (State.ERROR, Event.REMOVE): __on_remove,
+
+        # timer fired while the point was being removed
+        (State.CLOSED, Event.TIMER): __ignore,
+    }
 
     def __unhandled_event(self, event_type):
         LOG.warning("PointController: Unhandled event " + repr(event_type) + " in state " + repr(self.state))
@@ -172,6 +369,8 @@ class PointController(IPointListener):
             self.__point.dispose()
             self.__point = None
         self.state = State.CLOSED
+        if self.__journal is not None:
+            self.__journal.remove(self.__point_id)
 
     def __create_offer(self, cc, vv, profile):
         assert self.__point is None
@@ -201,6 +400,26 @@ class PointController(IPointListener):
         assert type(sdp) is str
         LOG.debug("PointController: remote SDP: %s", sdp)
         self.__point.remote_sdp = SdpFactory.create_from_string(sdp)
+        self.__remote_sdp = sdp
+
+    def __arm_ttl(self):
+        if self.__ttl_timer is not None:
+            self.__ttl_timer.cancel()
+            self.__ttl_timer = None
+        ttl = self.__ttls.get(self.__state)
+        if ttl and self.__on_expired is not None and self.__timer_wheel is not None:
+            self.__ttl_timer = self.__timer_wheel.call_later(ttl, self.__on_expired, self.__point_id, self.__state)
+
+    def __arm_timer(self):
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+        if self.__state == State.CONNECTED and self.__timer_wheel is not None:
+            self.__timer = self.__timer_wheel.call_periodic(TIMER_INTERVAL, self.event, Event.TIMER)
+
+    def __write_journal(self):
+        if self.__journal is not None and self.__state != State.CLOSED:
+            self.__journal.write(self.snapshot())
 
     #
     # IPointListener
@@ -208,3 +427,285 @@ class PointController(IPointListener):
     def point_conn_ready(self):
         LOG.debug("PointController.point_conn_ready")
         self.event(Event.CONN_READY)
+
+
+if __name__ == "__main__":
+    import logging
+    import unittest
+
+    class _Timer(object):
+        def __init__(self, delay, callback, args):
+            self.delay = delay
+            self.callback = callback
+            self.args = args
+            self.cancelled = False
+
+        def cancel(self):
+            self.cancelled = True
+
+    class _TimerWheel(object):
+        def __init__(self):
+            self.timers = []
+
+        def call_later(self, delay, callback, *args):
+            self.timers.append(_Timer(delay, callback, args))
+            return self.timers[-1]
+
+        call_periodic = call_later
+
+        def armed(self):
+            return [(timer.delay, timer.args) for timer in self.timers if not timer.cancelled]
+
+    class _Point(object):
+        def __init__(self, point_id, listener, local_sdp, **kwargs):
+            self.listener = listener
+            self.local_sdp = local_sdp
+            self.remote_sdp = None
+            self.packets_received = 0
+            self.stopped = False
+            self.calls = []
+
+        def start(self):
+            pass
+
+        def stop(self):
+            self.stopped = True
+
+        def dispose(self):
+            pass
+
+        def renegotiate(self, sdp):
+            self.calls.append(("renegotiate", sdp))
+            return (None, True)
+
+        def on_timer(self):
+            self.calls.append(("on_timer",))
+
+        def send_dtmf(self, dtmf):
+            self.calls.append(("send_dtmf", dtmf))
+
+    class _SdpFactory(object):
+        @staticmethod
+        def create_offer(cc, vv, codecs):
+            return "offer"
+
+        @staticmethod
+        def create_from_string(sdp):
+            if sdp == "bad":
+                raise ParseError("bad sdp")
+            return sdp
+
+    class _TranscodingFactory(object):
+        def get_supported_codecs(self):
+            return []
+
+    ITranscodingFactory.register(_TranscodingFactory)
+
+    class _Config(object):
+        OPTIONS = {"ttl-creating-offer": 30.0, "ttl-waiting-remote-sdp": 120.0, "ttl-connected": 5.0}
+
+        def float_option(self, name):
+            return self.OPTIONS[name]
+
+    class _Message(object):
+        type = MessageType.CREATE_POINT
+
+        def __init__(self):
+            self.replies = []
+
+        def reply(self, message_type, message_attributes=None):
+            self.replies.append((message_type, message_attributes))
+
+    class _PointControllerTest(unittest.TestCase):
+        """
+        point controller over fake Point, SDP factory and timer wheel
+        """
+        def setUp(self):
+            self.patched = dict((name, globals()[name]) for name in ("Point", "SdpFactory", "Cc", "Vv"))
+            globals().update(Point=_Point, SdpFactory=_SdpFactory, Cc=lambda cc: cc, Vv=lambda vv: vv)
+            self.wheel = _TimerWheel()
+            self.message = _Message()
+            self.controller = PointController("p1", self.message, _Config(), None, _TranscodingFactory(),
+                                              timer_wheel=self.wheel, on_expired=self.on_expired)
+
+        def tearDown(self):
+            globals().update(self.patched)
+
+        def on_expired(self, point_id, state):
+            pass
+
+    class PointControllerTtlTest(_PointControllerTest):
+        def create(self):
+            self.controller.event(Event.CREATE_OFFER, cc={}, vv={}, profile=None)
+
+        def connect(self):
+            self.create()
+            self.controller.point.listener.point_conn_ready()
+            self.controller.event(Event.SDP_ANSWER, sdp="answer")
+
+        def remove_expired(self, state):
+            self.assertTrue(self.controller.expired(state))
+            self.controller.event(Event.REMOVE, reason=EXPIRED_REASON)
+
+        def test_ttl_follows_state(self):
+            self.create()
+            self.assertEqual(self.wheel.armed(), [(30.0, ("p1", State.CREATING_OFFER))])
+            self.controller.point.listener.point_conn_ready()
+            self.assertEqual(self.wheel.armed(), [(120.0, ("p1", State.WAITING_REMOTE_SDP))])
+            self.controller.event(Event.SDP_ANSWER, sdp="answer")
+            self.assertEqual(self.wheel.armed(), [(5.0, ("p1", State.CONNECTED)), (TIMER_INTERVAL, (Event.TIMER,))])
+            self.assertTrue(self.wheel.timers[0].callback == self.on_expired)
+            self.controller.event(Event.REMOVE)
+            self.assertEqual(self.wheel.armed(), [])
+
+        def test_restoring_ttl(self):
+            self.controller.event(Event.RESTORE, local_sdp="offer", remote_sdp=None, profile=None, ports={})
+            self.assertEqual(self.wheel.armed(), [(30.0, ("p1", State.RESTORING))])
+            self.remove_expired(State.RESTORING)
+            self.assertEqual(self.message.replies, [(MessageType.REMOVE_POINT_OK, {"reason": EXPIRED_REASON})])
+
+        def test_connected_ttl_renewed_by_rtp(self):
+            self.connect()
+            point = self.controller.point
+            self.assertFalse(self.controller.expired(State.WAITING_REMOTE_SDP))
+            point.packets_received = 10
+            self.assertFalse(self.controller.expired(State.CONNECTED))
+            self.assertEqual(len(self.wheel.armed()), 2)
+            self.assertEqual([timer.cancelled for timer in self.wheel.timers[-3:]], [True, False, False])
+            point.packets_received = None
+            self.assertFalse(self.controller.expired(State.CONNECTED))
+            point.packets_received = 10
+            self.remove_expired(State.CONNECTED)
+            self.assertTrue(point.stopped)
+            self.assertEqual(self.message.replies[-1], (MessageType.REMOVE_POINT_OK, {"reason": EXPIRED_REASON}))
+
+        def test_expired_before_offer(self):
+            self.create()
+            self.remove_expired(State.CREATING_OFFER)
+            self.assertEqual(self.message.replies, [(MessageType.CREATE_POINT_FAILED, {"reason": EXPIRED_REASON})])
+            self.assertFalse(self.controller.expired(State.CREATING_OFFER))
+
+        def test_expired_after_offer(self):
+            self.create()
+            self.controller.point.listener.point_conn_ready()
+            self.remove_expired(State.WAITING_REMOTE_SDP)
+            self.assertEqual(self.message.replies, [(MessageType.SDP_OFFER, {"sdp": "offer"}),
+                                                    (MessageType.REMOVE_POINT_OK, {"reason": EXPIRED_REASON})])
+
+    EVENT_ARGS = {
+        Event.CREATE_OFFER: dict(cc={}, vv={}, profile=None),
+        Event.RESTORE: dict(local_sdp="offer", remote_sdp=None, profile=None, ports={}),
+        Event.SDP_ANSWER: dict(sdp="answer"),
+        Event.SEND_DTMF: dict(dtmf="5"),
+    }
+
+    # events leading from START to state
+    PATHS = {
+        State.START: [],
+        State.RESTORING: [Event.RESTORE],
+        State.CREATING_OFFER: [Event.CREATE_OFFER],
+        State.WAITING_REMOTE_SDP: [Event.CREATE_OFFER, Event.CONN_READY],
+        State.CONNECTED: [Event.CREATE_OFFER, Event.CONN_READY, Event.SDP_ANSWER],
+        State.ERROR: [Event.CREATE_OFFER, Event.CONN_READY, (Event.SDP_ANSWER, dict(sdp="bad"))],
+        State.CLOSED: [Event.CREATE_OFFER, Event.REMOVE],
+    }
+
+    # (state, event) -> (state after the event, last reply or None, last call of point or None)
+    EXPECTED = {
+        (State.START, Event.CREATE_OFFER): (State.CREATING_OFFER, None, None),
+        (State.START, Event.RESTORE): (State.RESTORING, None, None),
+
+        (State.RESTORING, Event.CONN_READY): (State.WAITING_REMOTE_SDP, None, None),
+        (State.RESTORING, Event.REMOVE): (State.CLOSED, MessageType.REMOVE_POINT_OK, None),
+        (State.RESTORING, Event.TIMER): (State.RESTORING, None, None),
+
+        (State.CREATING_OFFER, Event.CONN_READY): (State.WAITING_REMOTE_SDP, MessageType.SDP_OFFER, None),
+        (State.CREATING_OFFER, Event.REMOVE): (State.CLOSED, MessageType.REMOVE_POINT_OK, None),
+        (State.CREATING_OFFER, Event.TIMER): (State.CREATING_OFFER, None, None),
+
+        (State.WAITING_REMOTE_SDP, Event.SDP_ANSWER): (State.CONNECTED, MessageType.CREATE_POINT_OK, None),
+        (State.WAITING_REMOTE_SDP, Event.REMOVE): (State.CLOSED, MessageType.REMOVE_POINT_OK, None),
+        (State.WAITING_REMOTE_SDP, Event.TIMER): (State.WAITING_REMOTE_SDP, None, None),
+
+        (State.CONNECTED, Event.SDP_ANSWER): (State.CONNECTED, None, ("renegotiate", "answer")),
+        (State.CONNECTED, Event.REMOVE): (State.CLOSED, MessageType.REMOVE_POINT_OK, None),
+        (State.CONNECTED, Event.TIMER): (State.CONNECTED, None, ("on_timer",)),
+        (State.CONNECTED, Event.SEND_DTMF): (State.CONNECTED, None, ("send_dtmf", "5")),
+
+        (State.ERROR, Event.REMOVE): (State.CLOSED, MessageType.REMOVE_POINT_OK, None),
+
+        (State.CLOSED, Event.TIMER): (State.CLOSED, None, None),
+    }
+
+    class _Handler(logging.Handler):
+        def __init__(self):
+            logging.Handler.__init__(self, logging.WARNING)
+            self.messages = []
+
+        def emit(self, record):
+            self.messages.append(record.getMessage())
+
+    class PointControllerTransitionsTest(_PointControllerTest):
+        def setUp(self):
+            _PointControllerTest.setUp(self)
+            self.handler = _Handler()
+            LOG.addHandler(self.handler)
+
+        def tearDown(self):
+            LOG.removeHandler(self.handler)
+            _PointControllerTest.tearDown(self)
+
+        def controller_in(self, state):
+            """
+            new controller driven to state
+            """
+            self.message = _Message()
+            controller = PointController("p1", self.message, _Config(), None, _TranscodingFactory(),
+                                         timer_wheel=self.wheel, on_expired=self.on_expired)
+            for step in PATHS[state]:
+                (event, kwargs) = step if type(step) is tuple else (step, EVENT_ARGS.get(step, {}))
+                controller.event(event, **kwargs)
+            self.assertEqual(controller.state, state)
+            return controller
+
+        def last_reply(self, replies):
+            return self.message.replies[-1][0] if len(self.message.replies) > replies else None
+
+        def test_every_transition(self):
+            self.assertEqual(set(EXPECTED.keys()), set(PointController.TRANSITIONS.keys()))
+            for ((state, event), (new_state, reply, call)) in sorted(EXPECTED.items()):
+                controller = self.controller_in(state)
+                point = controller.point
+                replies = len(self.message.replies)
+                controller.event(event, **EVENT_ARGS.get(event, {}))
+                self.assertEqual(controller.state, new_state, (state, event))
+                self.assertEqual(self.last_reply(replies), reply, (state, event))
+                calls = point.calls if point is not None else []
+                self.assertEqual(calls[-1] if calls else None, call, (state, event))
+
+        def test_unknown_events_ignored(self):
+            events = [value for (name, value) in vars(Event).items() if not name.startswith("_")]
+            for state in PATHS:
+                for event in events:
+                    if (state, event) in PointController.TRANSITIONS:
+                        continue
+                    controller = self.controller_in(state)
+                    replies = len(self.message.replies)
+                    del self.handler.messages[:]
+                    controller.event(event, **EVENT_ARGS.get(event, {}))
+                    self.assertEqual(controller.state, state, (state, event))
+                    self.assertEqual(self.last_reply(replies), None, (state, event))
+                    self.assertEqual(len(self.handler.messages), 1, (state, event))
+                    self.assertTrue("Unhandled event" in self.handler.messages[0])
+
+        def test_histograms(self):
+            handle = METRICS.histogram("point.handle.WAITING_REMOTE_SDP.SDP_ANSWER")
+            transition = METRICS.histogram("point.state.WAITING_REMOTE_SDP->CONNECTED")
+            timer = METRICS.histogram("point.handle.CONNECTED.TIMER")
+            counts = (handle.count, transition.count, timer.count)
+            controller = self.controller_in(State.CONNECTED)
+            controller.event(Event.TIMER)
+            self.assertEqual((handle.count, transition.count, timer.count),
+                             (counts[0] + 1, counts[1] + 1, counts[2]))
+
+    unittest.main()
@@ -14,11 +14,13 @@ from a3.transcoding._base import ITranscodingFactory
 
 
 class Room(object):
-    def __init__(self, room_id, transcoding_factory):
+    def __init__(self, room_id, transcoding_factory, audio_mixing=False, video_forwarding=False):
         assert type(room_id) is str
         assert isinstance(transcoding_factory, ITranscodingFactory)
         self.__room_id = room_id
         self.__transcoding_factory = transcoding_factory
+        self.__audio_mixing = audio_mixing
+        self.__video_forwarding = video_forwarding
         self.__points = []
         self.__audio_room = None
         self.__video_room = None
@@ -27,7 +29,10 @@ class Room(object):
     def room_id(self):
         return self.__room_id
 
-    def join(self, point):
+    def join(self, point, play=True):
+        """
+        :param play: start pipelines, False - play() is called after a group of joins
+        """
         # we have PointController here
         # TODO: create RoomController
         point = point.point
@@ -39,15 +44,24 @@ class Room(object):
         self.__points.append(point)
 
         if point.audio_point:
-            self.__get_audio_room().join(point.audio_point)
+            self.__get_audio_room().join(point.audio_point, play)
 
         if point.video_point:
-            self.__get_video_room().join(point.video_point)
+            video_room = self.__get_video_room()
+            if not self.__video_forwarding and video_room.points_count >= 2:
+                LOG.warning("Room %s: video of more than two points is not linked", self.__room_id)
+            else:
+                video_room.join(point.video_point, play)
 
     def unjoin(self, point):
         # we have PointController here
         # TODO: create RoomController
-        point = point.point
+        self.__unjoin(point.point)
+
+        #for mp in self.__points:
+        #    mp.commit_local_sdp_change()
+
+    def __unjoin(self, point):
         assert isinstance(point, Point)
         if point.audio_point:
             self.__audio_room.unjoin(point.audio_point)
@@ -57,28 +71,72 @@ class Room(object):
 
         self.__points.remove(point)
 
-        #for mp in self.__points:
-        #    mp.commit_local_sdp_change()
+    def play(self):
+        """
+        start pipelines after joins made with play=False
+        """
+        for media_room in (self.__audio_room, self.__video_room):
+            if media_room is not None:
+                media_room.play()
+
+    def halt(self):
+        """
+        stop pipelines before all points leave, so they are unjoined from stopped pipelines
+        """
+        for media_room in (self.__audio_room, self.__video_room):
+            if media_room is not None:
+                media_room.halt()
+
+    def relink(self, point, media_points):
+        """
+        link again media points whose media source or destination was replaced by re-negotiation
+        """
+        # we have PointController here
+        point = point.point
+        assert isinstance(point, Point)
+        for media_point in media_points:
+            if media_point is point.audio_point and self.__audio_room is not None:
+                self.__audio_room.relink(media_point)
+            elif media_point is point.video_point and self.__video_room is not None:
+                self.__video_room.relink(media_point)
 
     @property
     def points_count(self):
         return len(self.__points)
 
+    @property
+    def points(self):
+        return list(self.__points)
+
+    @property
+    def audio_mixing(self):
+        return self.__audio_mixing
+
+    @property
+    def video_forwarding(self):
+        return self.__video_forwarding
+
     def stop(self):
         while len(self.__points):
-            self.unjoin(self.__points[0])
+            self.__unjoin(self.__points[0])
 
     def __get_audio_room(self):
         if self.__audio_room is None:
-            self.__audio_room = MediaRoom(MediaType.AUDIO, self.__transcoding_factory)
+            self.__audio_room = MediaRoom(MediaType.AUDIO, self.__transcoding_factory, self.__audio_mixing)
         return self.__audio_room
 
     def __get_video_room(self):
         if self.__video_room is None:
-            self.__video_room = MediaRoom(MediaType.VIDEO, self.__transcoding_factory)
+            self.__video_room = MediaRoom(MediaType.VIDEO, self.__transcoding_factory,
+                                          forwarding=self.__video_forwarding)
         return self.__video_room
 
     def dispose(self):
         """
-        TODO: implement clean-up
-        """
\ No newline at end of file
+        release transcoding contexts of media rooms, called after stop()
+        """
+        for media_room in (self.__audio_room, self.__video_room):
+            if media_room is not None:
+                media_room.dispose()
+        self.__audio_room = None
+        self.__video_room = None
\ No newline at end of file
@@ -87,6 +87,9 @@ class RtmpMediaPoint(IMediaPoint):
     def set_remote_media_description(self, remote_media_description):
         pass
 
+    def update_remote_media_description(self, remote_media_description):
+        return False
+
     def set_context(self, context):
         self.__rtmp_frontend.set_context(context)
 
@@ -10,6 +10,7 @@ from a3.logging import LOG
 from a3.config.profile import Profile
 from a3.transcoding import ITranscodingFactory, IRtpFrontend
 from a3.sdp.media_description import MediaDescription
+from a3.sdp.direction import SdpDirection
 from ._base import MediaPointError, IMediaPointListener, IMediaPoint
 
 
@@ -17,7 +18,10 @@ class RtpMediaPoint(IMediaPoint):
     #
     # public
     #
-    def __init__(self, point_id, transcoding_factory):
+    def __init__(self, point_id, transcoding_factory, ports=None):
+        """
+        :param ports: (rtp, rtcp) to open (point restored after restart), None - any free pair of profile
+        """
         assert type(point_id) is str
         assert isinstance(transcoding_factory, ITranscodingFactory)
         super(RtpMediaPoint, self).__init__()
@@ -25,8 +29,10 @@ class RtpMediaPoint(IMediaPoint):
         self.__listener = None
         self.__rtp_frontend = None
         self.__local_media_description = None
+        self.__remote_media_description = None
         self.__transcoding_factory = transcoding_factory
         self.__profile = None
+        self.__ports = tuple(ports) if ports is not None else None
 
     @property
     def rtp_port(self):
@@ -38,6 +44,11 @@ class RtpMediaPoint(IMediaPoint):
         assert self.__rtp_frontend
         return self.__rtp_frontend.rtcp_port
 
+    @property
+    def packets_received(self):
+        assert self.__rtp_frontend
+        return self.__rtp_frontend.packets_received
+
     #
     # IMediaPoint
     #
@@ -61,7 +72,7 @@ class RtpMediaPoint(IMediaPoint):
         #
         assert self.__local_media_description
         media_type = self.__local_media_description.media_type
-        self.__rtp_frontend = self.__transcoding_factory.create_rtp_frontend(media_type, self.__profile)
+        self.__rtp_frontend = self.__transcoding_factory.create_rtp_frontend(media_type, self.__profile, self.__ports)
         assert isinstance(self.__rtp_frontend, IRtpFrontend)
 
         # fill local sdp with opened ports
@@ -99,31 +110,13 @@ class RtpMediaPoint(IMediaPoint):
         if remote_media_description.rtp_port == 0:
             raise MediaPointError(MediaPointError.MEDIA_DECLINED)
 
-        local_rtp_codecs = self.__local_media_description.rtp_codecs
-        remote_rtp_codecs = self.__remote_media_description.rtp_codecs
-
-        local_codecs = [rtp_codec.base_codec for rtp_codec in local_rtp_codecs]
-        remote_codecs = [rtp_codec.base_codec for rtp_codec in remote_rtp_codecs]
-
-        common_codecs = list(set(local_codecs) & set(remote_codecs))
-        if len(common_codecs) == 0:
-            LOG.warning("MediaPoint: No common codecs: local={%s}, remote={%s}",
-                        ", ".join([str(c) for c in local_codecs]),
-                        ", ".join([str(c) for c in remote_codecs]))
-            raise MediaPointError(MediaPointError.CODEC_INCONSISTENCY)
-
-        LOG.info("MediaPoint: Common codecs: %s", ",".join([str(c) for c in common_codecs]))
-
-        local_rtp_codecs = [rtp_codec for rtp_codec in local_rtp_codecs if rtp_codec.base_codec in common_codecs]
-        remote_rtp_codecs = [rtp_codec for rtp_codec in remote_rtp_codecs if rtp_codec.base_codec in common_codecs]
-
-        LOG.info("Local codecs with payload types: %s", ",".join([str(c) for c in local_rtp_codecs]))
-        LOG.info("Remote codecs with payload types: %s", ",".join([str(c) for c in remote_rtp_codecs]))
+        (local_rtp_codecs, remote_rtp_codecs) = self.__negotiate(remote_media_description)
 
         self.__rtp_frontend.create_sender(local_rtp_codecs,
                                           self.__remote_media_description.host,
                                           self.__remote_media_description.rtp_port,
                                           self.__remote_media_description.rtcp_port)
+        self.__rtp_frontend.sending = self.__remote_receives(remote_media_description)
 
         self.__rtp_frontend.create_receiver(remote_rtp_codecs)
 
@@ -131,6 +124,40 @@ class RtpMediaPoint(IMediaPoint):
         #self.__fake_room.add_transcoder(self.__transcoder)
         #self.__fake_room.play()
 
+    def update_remote_media_description(self, remote_media_description):
+        """
+        only what differs from previous remote media is changed, sockets and pipeline are kept:
+        address of udpsinks, sending on/off (hold/resume), payload types, pay/depay on codec change
+        raises: MediaPointError
+        """
+        assert type(remote_media_description) is MediaDescription
+        assert self.__remote_media_description is not None
+        previous = self.__remote_media_description
+
+        if remote_media_description.rtp_port == 0:
+            # stream is declined, keep it on hold
+            LOG.info("MediaPoint %s: remote media declined, sending stopped", self.__point_id)
+            self.__remote_media_description = remote_media_description
+            self.__rtp_frontend.sending = False
+            return False
+
+        (local_rtp_codecs, remote_rtp_codecs) = self.__negotiate(remote_media_description)
+        self.__remote_media_description = remote_media_description
+
+        address = (remote_media_description.host, remote_media_description.rtp_port,
+                   remote_media_description.rtcp_port)
+        if address != (previous.host, previous.rtp_port, previous.rtcp_port):
+            self.__rtp_frontend.set_destination(*address)
+
+        sending = self.__remote_receives(remote_media_description)
+        if sending != self.__rtp_frontend.sending:
+            LOG.info("MediaPoint %s: %s", self.__point_id, "resumed" if sending else "on hold")
+            self.__rtp_frontend.sending = sending
+
+        replaced = self.__rtp_frontend.update_sender(local_rtp_codecs)
+        replaced = self.__rtp_frontend.update_receiver(remote_rtp_codecs) or replaced
+        return replaced
+
     def set_context(self, context):
         self.__rtp_frontend.set_context(context)
 
@@ -149,6 +176,37 @@ class RtpMediaPoint(IMediaPoint):
     #
     # private
     #
+    @staticmethod
+    def __remote_receives(remote_media_description):
+        return remote_media_description.direction in (SdpDirection.SEND_RECV, SdpDirection.RECV_ONLY)
+
+    def __negotiate(self, remote_media_description):
+        """
+        :return: (local rtp codecs, remote rtp codecs) of codecs common to both sides
+        raises: MediaPointError
+        """
+        local_rtp_codecs = self.__local_media_description.rtp_codecs
+        remote_rtp_codecs = remote_media_description.rtp_codecs
+
+        local_codecs = [rtp_codec.base_codec for rtp_codec in local_rtp_codecs]
+        remote_codecs = [rtp_codec.base_codec for rtp_codec in remote_rtp_codecs]
+
+        common_codecs = list(set(local_codecs) & set(remote_codecs))
+        if len(common_codecs) == 0:
+            LOG.warning("MediaPoint: No common codecs: local={%s}, remote={%s}",
+                        ", ".join([str(c) for c in local_codecs]),
+                        ", ".join([str(c) for c in remote_codecs]))
+            raise MediaPointError(MediaPointError.CODEC_INCONSISTENCY)
+
+        LOG.info("MediaPoint: Common codecs: %s", ",".join([str(c) for c in common_codecs]))
+
+        local_rtp_codecs = [rtp_codec for rtp_codec in local_rtp_codecs if rtp_codec.base_codec in common_codecs]
+        remote_rtp_codecs = [rtp_codec for rtp_codec in remote_rtp_codecs if rtp_codec.base_codec in common_codecs]
+
+        LOG.info("Local codecs with payload types: %s", ",".join([str(c) for c in local_rtp_codecs]))
+        LOG.info("Remote codecs with payload types: %s", ",".join([str(c) for c in remote_rtp_codecs]))
+        return local_rtp_codecs, remote_rtp_codecs
+
     def force_key_unit(self):
         if self.__rtp_frontend:
             self.__rtp_frontend.force_key_unit()
@@ -159,4 +217,113 @@ class RtpMediaPoint(IMediaPoint):
 
 
 if __name__ == "__main__":
-    pass
+    import unittest
+    from a3.sdp.factory import Factory as SdpFactory
+
+    SDP = """v=0
+o=- 1 1 IN IP4 %(host)s
+s=-
+c=IN IP4 %(host)s
+t=0 0
+m=audio %(port)d RTP/AVP %(pts)s
+%(rtpmaps)s
+a=%(direction)s
+"""
+
+    def _media(codecs, host="127.0.0.1", port=5000, direction="sendrecv"):
+        """
+        :param codecs: [(pt, "PCMA/8000")]
+        """
+        return SdpFactory.create_from_string(SDP % dict(
+            host=host, port=port, direction=direction,
+            pts=" ".join(str(pt) for (pt, _) in codecs),
+            rtpmaps="\n".join("a=rtpmap:%d %s" % codec for codec in codecs))).audio
+
+    class _Frontend(object):
+        """
+        records what media point asks of rtp frontend
+        """
+        rtp_port = 41000
+        rtcp_port = 41001
+        packets_received = 0
+
+        def __init__(self):
+            self.sending = None
+            self.destination = None
+            self.sender = None
+            self.receiver = None
+            self.calls = []
+
+        def create_sender(self, codecs, host, rtp_port, rtcp_port):
+            (self.sender, self.destination) = (codecs, (host, rtp_port, rtcp_port))
+
+        def create_receiver(self, codecs):
+            self.receiver = codecs
+
+        def set_destination(self, host, rtp_port, rtcp_port):
+            self.calls.append("set_destination")
+            self.destination = (host, rtp_port, rtcp_port)
+
+        def update_sender(self, codecs):
+            replaced = codecs[0].base_codec != self.sender[0].base_codec
+            self.sender = codecs
+            return replaced
+
+        def update_receiver(self, codecs):
+            replaced = codecs[0].base_codec != self.receiver[0].base_codec
+            self.receiver = codecs
+            return replaced
+
+    class _Factory(object):
+        def __init__(self):
+            self.frontend = _Frontend()
+
+        def create_rtp_frontend(self, media_type, profile, ports=None):
+            return self.frontend
+
+    IRtpFrontend.register(_Frontend)
+    ITranscodingFactory.register(_Factory)
+
+    class RtpMediaPointUpdateTest(unittest.TestCase):
+        def setUp(self):
+            factory = _Factory()
+            self.frontend = factory.frontend
+            self.point = RtpMediaPoint("p1.audio", factory)
+            self.point.set_profile(Profile("127.0.0.1:41000-41100"))
+            self.point.set_local_media_description(_media([(8, "PCMA/8000"), (0, "PCMU/8000")]))
+            self.point.start()
+            self.point.set_remote_media_description(_media([(8, "PCMA/8000")]))
+
+        def pts(self, codecs):
+            return [rtp_codec.payload_type for rtp_codec in codecs]
+
+        def test_address_change(self):
+            self.assertFalse(self.point.update_remote_media_description(_media([(8, "PCMA/8000")])))
+            self.assertEqual(self.frontend.calls, [])
+            self.assertFalse(self.point.update_remote_media_description(
+                _media([(8, "PCMA/8000")], host="10.0.0.2", port=6000)))
+            self.assertEqual(self.frontend.calls, ["set_destination"])
+            self.assertEqual(self.frontend.destination, ("10.0.0.2", 6000, 6001))
+
+        def test_hold_resume(self):
+            self.assertTrue(self.frontend.sending)
+            for (direction, sending) in (("sendonly", False), ("inactive", False),
+                                         ("recvonly", True), ("sendonly", False), ("sendrecv", True)):
+                self.point.update_remote_media_description(_media([(8, "PCMA/8000")], direction=direction))
+                self.assertEqual(self.frontend.sending, sending, direction)
+
+        def test_payload_type_change(self):
+            self.assertFalse(self.point.update_remote_media_description(_media([(96, "PCMA/8000")])))
+            self.assertEqual(self.pts(self.frontend.receiver), [96])
+
+        def test_codec_change(self):
+            self.assertTrue(self.point.update_remote_media_description(_media([(0, "PCMU/8000")])))
+            self.assertEqual(self.pts(self.frontend.sender), [0])
+            self.assertEqual(self.pts(self.frontend.receiver), [0])
+
+        def test_no_common_codec(self):
+            self.assertRaises(MediaPointError, self.point.update_remote_media_description,
+                              _media([(18, "G729/8000")]))
+            self.assertEqual(self.pts(self.frontend.receiver), [8])
+
+    unittest.main()
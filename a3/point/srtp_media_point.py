@@ -10,6 +10,7 @@ __author__ = 'RCSLabs'
 import binascii
 
 from a3.logging import LOG
+from a3.ledger import LEDGER, KIND
 from a3.config import IConfig, Profile
 from netpoint.balancer import Balancer
 from a3.sdp.direction import SdpDirection
@@ -40,7 +41,15 @@ class SrtpMediaPoint(MediaPointDecorator):
         self.__local_rtcp_conn = None
         self.__remote_conn = None
         self.__agent = balancer.get_rtp_agent()
-        self.__timer = 0
+        self.__stopped = False
+
+    @property
+    def conn_ids(self):
+        """
+        ids of stun-agent conns of the point
+        """
+        return [conn.id for conn in (self.__remote_conn, self.__local_rtp_conn, self.__local_rtcp_conn)
+                if conn is not None]
 
     #
     # IMediaPoint
@@ -50,6 +59,7 @@ class SrtpMediaPoint(MediaPointDecorator):
         self.__profile = profile
 
     def stop(self):
+        self.__stopped = True
         super(SrtpMediaPoint, self).stop()
         self.__agent.send_message({
             "type": "REMOVE_LOCAL_STREAM",
@@ -60,16 +70,18 @@ class SrtpMediaPoint(MediaPointDecorator):
         self.__agent.close_conn(self.__remote_conn)
         self.__agent.close_conn(self.__local_rtp_conn)
         self.__agent.close_conn(self.__local_rtcp_conn)
+        for conn in (self.__remote_conn, self.__local_rtp_conn, self.__local_rtcp_conn):
+            LEDGER.release(KIND.AGENT_CONN, conn)
         self.__remote_conn = None
         self.__local_rtp_conn = None
         self.__local_rtcp_conn = None
 
     def on_timer(self):
+        """
+        periodic key frames for the browser to (re)sync video after losses
+        """
         self._media_point.on_timer()
-        self.__timer += 1
-        #if self._media_point.media_type is MediaType.VIDEO:
-        if self.__timer % 10 == 0:
-            self.force_key_unit()
+        self.force_key_unit()
 
     def set_local_media_description(self, local_media_description):
         assert type(local_media_description) is MediaDescription
@@ -127,6 +139,17 @@ class SrtpMediaPoint(MediaPointDecorator):
                   self.__remote_conn.port,
                   self.__local_rtcp_conn.port, self._media_point.rtcp_port)
 
+    def update_remote_media_description(self, remote_media_description):
+        """
+        rtp of the point goes through stun-agent conns, so only direction and codecs are applied,
+        new ice credentials and crypto keys are not sent to the agent
+        """
+        assert type(remote_media_description) is MediaDescription
+        self._remote_media = remote_media_description
+        remote_media_description.set_addr(self.__local_rtp_conn.port, "127.0.0.1")
+        remote_media_description.rtcp.port = self.__local_rtcp_conn.port
+        return self._media_point.update_remote_media_description(remote_media_description)
+
     #
     # IMediaPointListener
     #
@@ -156,19 +179,37 @@ class SrtpMediaPoint(MediaPointDecorator):
 
     def __remote_conn_created(self, conn):
         LOG.debug("SrtpMediaPoint.remote_conn_created %s", str(conn))
+        if not self.__acquire_conn(conn):
+            return
         self.__remote_conn = conn
         self.__check_conn_ready()
 
     def __local_rtp_conn_created(self, conn):
         LOG.debug("SrtpMediaPoint.local_rtp_conn_created %s", str(conn))
+        if not self.__acquire_conn(conn):
+            return
         self.__local_rtp_conn = conn
         self.__check_conn_ready()
 
     def __local_rtcp_conn_created(self, conn):
         LOG.debug("SrtpMediaPoint.local_rtcp_conn_created %s", str(conn))
+        if not self.__acquire_conn(conn):
+            return
         self.__local_rtcp_conn = conn
         self.__check_conn_ready()
 
+    def __acquire_conn(self, conn):
+        """
+        conn requested before stop() may come after it, such conn is closed at once
+        :return: False if conn is closed
+        """
+        if self.__stopped:
+            self.__agent.close_conn(conn)
+            return False
+        # conns come from stun-agent thread, outside of point scope
+        LEDGER.acquire(KIND.AGENT_CONN, conn, owner=self.point_id)
+        return True
+
     def __check_conn_ready(self):
         if self.__remote_conn and self.__local_rtp_conn and self.__local_rtcp_conn:
             LOG.info("SrtpConn.check_conn_ready: %s -> %d, %d",
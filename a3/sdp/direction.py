@@ -31,7 +31,7 @@ class Direction(object):
             if self.__attribute.name == SdpDirection.SEND_RECV:
                 return SdpDirection.SEND_RECV
             elif self.__attribute.name == SdpDirection.RECV_ONLY:
-                return SdpDirection.SEND_ONLY
+                return SdpDirection.RECV_ONLY
             elif self.__attribute.name == SdpDirection.SEND_ONLY:
                 return SdpDirection.SEND_ONLY
             elif self.__attribute.name == SdpDirection.INACTIVE:
@@ -95,6 +95,11 @@ if __name__ == "__main__":
             self.failUnlessEqual(attributes[0], attr0)
             self.failUnlessEqual(attributes[2], attr2)
 
+        def test_recvonly(self):
+            a = get_attrs()
+            self.failUnlessEqual(Direction(AttributeCollection([a["recvonly"]])).value, SdpDirection.RECV_ONLY)
+            self.failUnlessEqual(Direction(AttributeCollection([a["sendonly"]])).value, SdpDirection.SEND_ONLY)
+
         def test_assign(self):
             attributes = AttributeCollection()
             direction = Direction(attributes)
@@ -9,7 +9,7 @@ import raw.sdp
 import group
 from raw.entity import NetType, AddrType
 from a3.media import MediaType
-from .media_description import MediaDescription
+import media_description
 
 
 import itertools
@@ -20,7 +20,7 @@ class SessionDescription(object):
         assert raw_sdp is None or type(raw_sdp) is raw.sdp.Sdp
         #self.__pt_reserver = PayloadTypeReserver()
         self.__raw_sdp = raw_sdp if raw_sdp is not None else raw.sdp.Sdp()
-        self.__media_descriptions = [MediaDescription(m, self) for m in self.__raw_sdp.medias]
+        self.__media_descriptions = [media_description.MediaDescription(m, self) for m in self.__raw_sdp.medias]
         self.__group = group.Group(self)
 
     def __str__(self):
@@ -61,7 +61,7 @@ class SessionDescription(object):
         return None
 
     def add_raw_media(self, raw_media):
-        media = MediaDescription(raw_media, self)
+        media = media_description.MediaDescription(raw_media, self)
         self.__media_descriptions.append(media)
         self.__raw_sdp.add_media(raw_media)
         self.__group.add_media(media)
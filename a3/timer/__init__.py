@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""
+timer
+
+Hierarchical timer wheel: timers are kept in slots by deadline,
+advance() touches only slots that became due (and cascades upper levels
+once per turn of the lower one), so its cost depends on due timers
+and not on the number of scheduled ones.
+
+Example:
+    wheel = TimerWheel()
+    timer = wheel.call_periodic(10, point.event, Event.TIMER)
+    ...
+    wheel.advance()         # called often (e.g. every TICK) from main loop
+    ...
+    timer.cancel()
+
+Callbacks run in the thread calling advance().
+
+Metrics:
+    timer.lag           how late timers fire (histogram)
+    timer.fired         fired timers (counter)
+    timer.pending       scheduled timers (gauge)
+"""
+
+__author__ = 'RCSLabs'
+
+
+from ..logging import LOG
+from ..metrics import METRICS
+
+import math
+import threading
+import time
+
+
+TICK = 0.1
+# slots per level: 25.6 sec, 27 min, 29 hours at TICK resolution
+LEVELS = (256, 64, 64)
+
+
+class Timer(object):
+    def __init__(self, wheel, deadline, interval, callback, args):
+        self.__wheel = wheel
+        self.deadline = deadline
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.slot = None
+        self.cancelled = False
+
+    def cancel(self):
+        self.__wheel.cancel(self)
+
+
+class TimerWheel(object):
+    def __init__(self, tick=TICK, levels=LEVELS, clock=time.time):
+        assert tick > 0
+        assert len(levels) > 0
+        self.__tick = float(tick)
+        self.__clock = clock
+        self.__start = clock()
+        self.__current = 0
+        self.__levels = [[set() for _ in range(size)] for size in levels]
+        self.__spans = []                       # ticks covered by one slot of each level
+        span = 1
+        for size in levels:
+            self.__spans.append(span)
+            span *= size
+        self.__overflow = set()
+        self.__count = 0
+        self.__lock = threading.Lock()
+
+        self.__lag_histogram = METRICS.histogram("timer.lag")
+        self.__fired_counter = METRICS.counter("timer.fired")
+        self.__pending_gauge = METRICS.gauge("timer.pending")
+
+    def __len__(self):
+        return self.__count
+
+    def call_later(self, delay, callback, *args):
+        """
+        call callback(*args) once after delay seconds
+        :return: Timer
+        """
+        return self.__add(self.__clock() + delay, None, callback, args)
+
+    def call_periodic(self, interval, callback, *args):
+        """
+        call callback(*args) every interval seconds
+        :return: Timer
+        """
+        assert interval > 0
+        return self.__add(self.__clock() + interval, interval, callback, args)
+
+    def cancel(self, timer):
+        with self.__lock:
+            timer.cancelled = True
+            if timer.slot is not None:
+                timer.slot.discard(timer)
+                timer.slot = None
+                self.__count -= 1
+                self.__pending_gauge.set(self.__count)
+
+    def advance(self, now=None):
+        """
+        fire timers due at now
+        """
+        if now is None:
+            now = self.__clock()
+        target = int((now - self.__start) / self.__tick)
+        due = []
+        with self.__lock:
+            while self.__current < target:
+                self.__current += 1
+                self.__cascade()
+                slot = self.__levels[0][self.__current % len(self.__levels[0])]
+                for timer in slot:
+                    timer.slot = None
+                    due.append(timer)
+                self.__count -= len(slot)
+                slot.clear()
+            self.__pending_gauge.set(self.__count)
+
+        for timer in due:
+            if timer.cancelled:
+                continue
+            self.__lag_histogram.observe(max(0.0, now - timer.deadline))
+            self.__fired_counter.inc()
+            if timer.interval is not None:
+                # next deadline keeps the period, unless we are more than a period late
+                self.__schedule(timer, max(timer.deadline + timer.interval, now))
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                LOG.exception("TimerWheel: timer callback failed")
+
+    #
+    # private
+    #
+    def __add(self, deadline, interval, callback, args):
+        timer = Timer(self, deadline, interval, callback, args)
+        self.__schedule(timer, deadline)
+        return timer
+
+    def __schedule(self, timer, deadline):
+        with self.__lock:
+            if timer.cancelled:
+                return
+            timer.deadline = deadline
+            self.__insert(timer)
+            self.__count += 1
+            self.__pending_gauge.set(self.__count)
+
+    def __insert(self, timer, earliest=1):
+        """
+        :param earliest: first tick (from current) timer may go to,
+                         cascading runs before the slot of current tick is fired, so 0 is allowed there
+        """
+        expiry = max(self.__current + earliest, int(math.ceil((timer.deadline - self.__start) / self.__tick)))
+        ticks = expiry - self.__current
+        for (level, span) in enumerate(self.__spans):
+            slots = self.__levels[level]
+            if ticks < span * len(slots):
+                timer.slot = slots[(expiry // span) % len(slots)]
+                timer.slot.add(timer)
+                return
+        timer.slot = self.__overflow
+        self.__overflow.add(timer)
+
+    def __cascade(self):
+        """
+        when a level completes a turn, move timers of the next slot of the level above down
+        """
+        for level in range(1, len(self.__levels)):
+            lower_span = self.__spans[level]
+            if self.__current % lower_span != 0:
+                return
+            slots = self.__levels[level]
+            self.__reinsert(slots[(self.__current // lower_span) % len(slots)])
+        if self.__current % (self.__spans[-1] * len(self.__levels[-1])) == 0:
+            self.__reinsert(self.__overflow)
+
+    def __reinsert(self, slot):
+        timers = list(slot)
+        slot.clear()
+        for timer in timers:
+            self.__insert(timer, earliest=0)
+
+
+if __name__ == "__main__":
+    import unittest
+
+    class _Clock(object):
+        def __init__(self):
+            self.now = 1000.0
+
+        def __call__(self):
+            return self.now
+
+    class TimerWheelTest(unittest.TestCase):
+        def setUp(self):
+            self.clock = _Clock()
+            self.wheel = TimerWheel(tick=0.1, levels=(8, 4, 2), clock=self.clock)
+            self.fired = []
+
+        def run_until(self, t, step=0.05):
+            while self.clock.now < t:
+                self.clock.now += step
+                self.wheel.advance()
+
+        def test_deadlines_across_levels(self):
+            for delay in (0.3, 1.0, 2.5, 5.0, 12.0):
+                self.wheel.call_later(delay, lambda d=delay: self.fired.append((d, self.clock.now)))
+            self.run_until(1020)
+            self.assertEqual([d for (d, _) in self.fired], [0.3, 1.0, 2.5, 5.0, 12.0])
+            for (delay, at) in self.fired:
+                self.assertTrue(delay <= at - 1000 < delay + 0.1, (delay, at))
+            self.assertEqual(len(self.wheel), 0)
+
+        def test_periodic_and_cancel(self):
+            timer = self.wheel.call_periodic(1, lambda: self.fired.append(self.clock.now))
+            self.run_until(1010.01)
+            self.assertEqual(len(self.fired), 10)
+            timer.cancel()
+            self.run_until(1020)
+            self.assertEqual(len(self.fired), 10)
+            self.assertEqual(len(self.wheel), 0)
+
+        def test_cancel_from_callback(self):
+            timers = []
+            timers.append(self.wheel.call_periodic(0.5, lambda: timers[0].cancel()))
+            self.run_until(1005)
+            self.assertEqual(len(self.wheel), 0)
+
+    unittest.main()
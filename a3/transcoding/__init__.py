@@ -8,3 +8,4 @@ from ._base import ITranscodingFactory, IDtmfSender, ITranscodingContext
 from ._base import IMediaSource, IMediaDestination
 from ._base import IMediaSourceProvider, IMediaDestinationProvider
 from ._base import IRtpFrontend, IRtmpFrontend
+from ._base import IAudioMixer, IVideoForwarder
@@ -85,6 +85,13 @@ class IRtpFrontend(IMediaSourceProvider, IMediaDestinationProvider):
         :rtype : int
         """
 
+    @abstractproperty
+    def packets_received(self):
+        """
+        :return: rtp packets received from remote side so far
+        :rtype : int
+        """
+
     @abstractmethod
     def dispose(self):
         """
@@ -138,6 +145,56 @@ class IDtmfSender(IMediaDestinationProvider, IMediaSourceProvider):
         """
 
 
+class IAudioMixer(object):
+    """
+    mixes audio of participants, each participant gets mix of all others (N-1 mix)
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def add(self, participant_id, media_source, media_destination):
+        """
+        add participant, its source is mixed to others, its destination gets mix of others
+        """
+
+    @abstractmethod
+    def remove(self, participant_id):
+        """
+        remove participant
+        """
+
+    @abstractmethod
+    def dispose(self):
+        """
+        destroy mixer
+        """
+
+
+class IVideoForwarder(object):
+    """
+    forwards video of senders to receivers with the same codec, without transcoding
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def add(self, participant_id, media_source, media_destination):
+        """
+        add participant, its source is forwarded to others, its destination gets one of other sources
+        """
+
+    @abstractmethod
+    def remove(self, participant_id):
+        """
+        remove participant
+        """
+
+    @abstractmethod
+    def dispose(self):
+        """
+        destroy forwarder
+        """
+
+
 class ITranscodingFactory(object):
     __metaclass__ = ABCMeta
 
@@ -149,9 +206,10 @@ class ITranscodingFactory(object):
         """
 
     @abstractmethod
-    def create_rtp_frontend(self, media_type, profile):
+    def create_rtp_frontend(self, media_type, profile, ports=None):
         """
         create new rtp frontend
+        :param ports: (rtp, rtcp) ports to open, None - any free pair of profile
         :rtype : IRtpFrontend
         """
 
@@ -181,6 +239,27 @@ class ITranscodingFactory(object):
         link source to destination with transcoding
         """
 
+    @abstractmethod
+    def create_audio_mixer(self, context):
+        """
+        :return: mixer working in transcoding context
+        :rtype : IAudioMixer
+        """
+
+    @abstractmethod
+    def create_video_forwarder(self, context):
+        """
+        :return: forwarder working in transcoding context
+        :rtype : IVideoForwarder
+        """
+
+    @abstractmethod
+    def get_planner(self):
+        """
+        :return: planner with conversion costs of this factory codecs
+        :rtype : a3.transcoding.planner.Planner
+        """
+
     @abstractmethod
     def get_supported_codecs(self):
         """
@@ -18,6 +18,12 @@ class SocketError(Exception):
         return str(self.value)
 
 
+class PortNotFound(SocketError):
+    """
+    no free pair of ports in profile range
+    """
+
+
 class ISocket(object):
     __metaclass__ = ABCMeta
 
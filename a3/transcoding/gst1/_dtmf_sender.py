@@ -15,6 +15,7 @@ __author__ = 'RCSLabs'
 
 
 from ...logging import LOG
+from ...ledger import LEDGER, KIND
 from ...media import CODEC
 from .._base import IDtmfSender
 from ._base import Gst, GObject
@@ -88,6 +89,9 @@ class DtmfSender(IDtmfSender, threading.Thread):
             self.__dtmfsrc.get_static_pad("src").link(self.__dtmf_destination_pad)
 
     def start(self):
+        # set before the thread runs, so stop() right after start() is not missed
+        self.__is_terminated = False
+        LEDGER.acquire(KIND.THREAD, self)
         return super(DtmfSender, self).start()
 
     def stop(self):
@@ -95,9 +99,10 @@ class DtmfSender(IDtmfSender, threading.Thread):
             self.__is_terminated = True
             self.__send_dtmf_event.set()
             self.join()
+        LEDGER.release(KIND.THREAD, self)
 
     def dispose(self):
-        LOG("DtmfSender.dispose")
+        LOG.debug("DtmfSender.dispose")
 
     #
     # IMediaSourceProvider
@@ -115,16 +120,14 @@ class DtmfSender(IDtmfSender, threading.Thread):
     # threading.Thread
     #
     def run(self):
-        self.__is_terminated = False
         self.__dtmf_thread_cycle()
         LOG.info("DTMF thread stopped")
-        self.__is_terminated = True
 
     #
     # private
     #
     def __dtmf_thread_cycle(self):
-        while True:
+        while not self.__is_terminated:
             if len(self.__dtmf_buffer):
                 c = self.__dtmf_buffer.pop(0)
                 LOG.info("DTMF: Playing %s", c)
@@ -299,6 +299,20 @@ class RtpBin(GstElement):
         assert (type(ssrc) is long) or (type(ssrc) is int)
         return long(ssrc)
 
+    @property
+    def packets_received(self):
+        """
+        rtp packets of remote sources, read from session stats (nothing is done per packet)
+        """
+        session = self._element.emit("get-internal-session", 0)
+        assert session
+        received = 0
+        for source in session.get_property("sources"):
+            stats = source.get_property("stats")
+            if not stats.get_value("internal"):
+                received += stats.get_value("packets-received")
+        return received
+
     @ssrc.setter
     def ssrc(self, ssrc):
         assert type(ssrc) is long
@@ -341,6 +355,42 @@ class TeeWrapper(GstElement):
         return None
 
 
+def make_element(factory_name, **properties):
+    element = Gst.ElementFactory.make(factory_name, None)
+    assert element, "No gstreamer element " + factory_name
+    for (name, value) in properties.items():
+        element.set_property(name.replace("_", "-"), value)
+    return GstElement(element)
+
+
+class TeeBranch(object):
+    """
+    tee -> queue -> sink pad (request pad of sink_element if given)
+    """
+    def __init__(self, context, tee, sink_pad=None, sink_element=None):
+        assert sink_pad is not None or sink_element is not None
+        self.__context = context
+        self.__tee = tee
+        self.__sink_element = sink_element
+        self.__sink_pad = sink_pad if sink_pad is not None else sink_element.element.get_request_pad("sink_%u")
+        assert self.__sink_pad
+
+        self.__queue = make_element("queue", leaky=2, max_size_time=200 * Gst.MSECOND)
+        context.add(self.__queue)
+        self.__queue.src_pad.link(self.__sink_pad)
+        self.__tee_pad = tee.element.get_request_pad("src_%u")
+        self.__tee_pad.link(self.__queue.sink_pad)
+
+    def dispose(self):
+        self.__tee_pad.unlink(self.__queue.sink_pad)
+        self.__tee.element.release_request_pad(self.__tee_pad)
+        self.__queue.src_pad.unlink(self.__sink_pad)
+        if self.__sink_element is not None:
+            self.__sink_element.element.release_request_pad(self.__sink_pad)
+        self.__queue.stop()
+        self.__context.remove(self.__queue)
+
+
 class FakeEncoder(GstElement):
     def __init__(self):
         super(FakeEncoder, self).__init__(Gst.ElementFactory.make("queue", None))
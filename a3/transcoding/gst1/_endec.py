@@ -6,7 +6,8 @@ Gstreamer-1 encoders/decoders
 __author__ = 'RCSLabs'
 
 
-from ...media import CODEC, RtpCodec, Codec
+from ...media import CODEC, RtpCodec, Codec, MediaType
+from ..planner import Planner
 from ._elements import *
 
 
@@ -21,6 +22,40 @@ RTP_CAPS = {
 }
 
 
+# relative CPU cost of decoding to RAW and encoding from RAW, used by Link to choose conversion
+# and by admission control (a3.point.admission) to estimate load,
+# video costs are given for REFERENCE_VIDEO and scaled to WIDTH x HEIGHT @ FRAMERATE
+REFERENCE_VIDEO = (640, 480, 15)
+
+DECODE_COSTS = {
+    CODEC.PCMA: 1,
+    CODEC.H264: 20,
+    CODEC.VP8: 20,
+    CODEC.H263_1998: 10,
+}
+
+ENCODE_COSTS = {
+    CODEC.PCMA: 1,
+    CODEC.H264: 100,
+    CODEC.VP8: 120,
+    CODEC.H263_1998: 60,
+}
+
+
+def scale_costs(costs, width, height, framerate):
+    """
+    :return: costs with video codecs scaled by pixel rate relative to REFERENCE_VIDEO
+    """
+    (ref_width, ref_height, ref_framerate) = REFERENCE_VIDEO
+    scale = float(width * height * framerate) / (ref_width * ref_height * ref_framerate)
+    return dict((codec, int(round(cost * scale)) if codec.media_type is MediaType.VIDEO else cost)
+                for (codec, cost) in costs.items())
+
+
+PLANNER = Planner(scale_costs(DECODE_COSTS, WIDTH, HEIGHT, FRAMERATE),
+                  scale_costs(ENCODE_COSTS, WIDTH, HEIGHT, FRAMERATE))
+
+
 def create_depay(rtp_codec):
     assert type(rtp_codec) is RtpCodec
     codec = rtp_codec.base_codec
@@ -64,6 +99,16 @@ def create_pay(rtp_codec):
     return pay
 
 
+def encoder_params(codec):
+    """
+    parameters encoder of codec is created with (part of encoder cache key)
+    """
+    assert type(codec) is Codec
+    if codec.media_type is MediaType.VIDEO:
+        return WIDTH, HEIGHT, FRAMERATE
+    return ()
+
+
 def create_decoder(codec):
     """
     creates decoder Gst element
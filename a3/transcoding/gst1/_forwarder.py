@@ -0,0 +1,215 @@
+#! /usr/bin/env python
+"""
+Video forwarder (SFU)
+
+media of every sender goes from its rtp frontend (depayloaded, never decoded) to a tee,
+every receiver is linked to one sender with the same codec:
+
+    frontend A (depay) -> tee --+--> queue -> frontend B (pay)
+                                +--> queue -> frontend C (pay)
+
+Payloader of receiver frontend writes own SSRC, payload type and sequence numbers,
+so forwarded stream looks like receiver's own. Keyframe requests (GstForceKeyUnit upstream events)
+of receivers go through the tee back to the sender frontend, which sends them as RTCP to the sender;
+a keyframe is also requested when a receiver is linked.
+
+Each point has one video stream, so receiver shows one sender:
+the earliest joined sender with acceptable codec, the next one when it leaves.
+"""
+
+__author__ = 'RCSLabs'
+
+
+from ...logging import LOG
+from .._base import IVideoForwarder
+from ._base import Gst
+from ._elements import TeeBranch, make_element
+from ._pads import MediaSource, MediaDestination
+
+import threading
+
+
+def _request_key_unit(tee):
+    s = Gst.Structure.new_empty("GstForceKeyUnit")
+    s.set_value("all-headers", True)
+    tee.sink_pad.push_event(Gst.Event.new_custom(Gst.EventType.CUSTOM_UPSTREAM, s))
+
+
+class _Participant(object):
+    def __init__(self, participant_id, order):
+        self.participant_id = participant_id
+        self.order = order
+        self.source = None
+        self.tee = None
+        self.destination = None
+        self.sender_id = None               # sender linked to destination
+        self.branch = None
+        self.removed = False
+
+
+class VideoForwarder(IVideoForwarder):
+    def __init__(self, context):
+        self.__context = context
+        self.__participants = {}
+        self.__order = 0
+        self.__lock = threading.RLock()     # sources are resolved in streaming threads
+
+    def add(self, participant_id, media_source, media_destination):
+        with self.__lock:
+            assert participant_id not in self.__participants
+            participant = _Participant(participant_id, self.__order)
+            self.__order += 1
+            self.__participants[participant_id] = participant
+        LOG.debug("VideoForwarder: add %s", participant_id)
+        media_source.subscribe(lambda source: self.__on_source(participant, source))
+        media_destination.subscribe(lambda destination: self.__on_destination(participant, destination))
+
+    def remove(self, participant_id):
+        LOG.debug("VideoForwarder: remove %s", participant_id)
+        with self.__lock:
+            participant = self.__participants.pop(participant_id, None)
+            if participant is None:
+                return
+            participant.removed = True
+            self.__unlink(participant)
+            if participant.tee is not None:
+                for receiver in self.__participants.values():
+                    if receiver.sender_id == participant_id:
+                        self.__unlink(receiver)
+                        self.__link(receiver)
+                participant.source.gst_pad.unlink(participant.tee.sink_pad)
+                participant.tee.stop()
+                self.__context.remove(participant.tee)
+
+    def dispose(self):
+        with self.__lock:
+            for participant_id in self.__participants.keys():
+                self.remove(participant_id)
+
+    #
+    # private
+    #
+    def __on_source(self, participant, media_source):
+        assert type(media_source) is MediaSource
+        with self.__lock:
+            if participant.removed:
+                return
+            LOG.debug("VideoForwarder: %s sends %s", participant.participant_id, media_source)
+            participant.source = media_source
+            participant.tee = make_element("tee", allow_not_linked=True)
+            self.__context.add(participant.tee)
+            media_source.gst_pad.link(participant.tee.sink_pad)
+            for receiver in self.__participants.values():
+                if receiver.sender_id is None:
+                    self.__link(receiver)
+
+    def __on_destination(self, participant, media_destination):
+        assert type(media_destination) is MediaDestination
+        with self.__lock:
+            if participant.removed:
+                return
+            participant.destination = media_destination
+            self.__link(participant)
+
+    def __choose_sender(self, receiver):
+        senders = [p for p in self.__participants.values()
+                   if p is not receiver and p.source is not None and receiver.destination.accepts(p.source.codec)]
+        return min(senders, key=lambda p: p.order) if senders else None
+
+    def __link(self, receiver):
+        if receiver.destination is None:
+            return
+        sender = self.__choose_sender(receiver)
+        if sender is None:
+            return
+        LOG.debug("VideoForwarder: %s -> %s", sender.participant_id, receiver.participant_id)
+        receiver.branch = TeeBranch(self.__context, sender.tee, sink_pad=receiver.destination.gst_pad)
+        receiver.sender_id = sender.participant_id
+        _request_key_unit(sender.tee)
+
+    def __unlink(self, receiver):
+        if receiver.branch is not None:
+            receiver.branch.dispose()
+            receiver.branch = None
+            receiver.sender_id = None
+
+
+if __name__ == "__main__":
+    import unittest
+    from ._base import GLib
+    from ._elements import GstPipeline
+    from ._rtp_frontend import RtpFrontend
+    from ...config.profile import Profile
+    from ...media import MediaType, RtpCodec, CODEC
+
+    VP8 = RtpCodec(CODEC.VP8, 96)
+
+    CLIENT = """videotestsrc is-live=true pattern=%(pattern)d ! video/x-raw,width=160,height=120,framerate=15/1 !
+                vp8enc deadline=1 ! rtpvp8pay pt=96 !
+                udpsink host=127.0.0.1 port=%(mc_port)d sync=false async=false
+                udpsrc port=%(port)d caps="application/x-rtp,media=video,encoding-name=VP8,clock-rate=90000,payload=96" !
+                rtpvp8depay ! fakesink name=sink signal-handoffs=true sync=false"""
+
+    class _Client(object):
+        """
+        rtp endpoint sending test pattern and counting received video frames
+        """
+        def __init__(self, pattern, port, mc_port):
+            self.received = 0
+            self.pipeline = Gst.parse_launch(CLIENT % dict(pattern=pattern, port=port, mc_port=mc_port))
+            self.pipeline.get_by_name("sink").connect("handoff", self.__on_handoff)
+            self.pipeline.set_state(Gst.State.PLAYING)
+
+        def __on_handoff(self, sink, buffer_, pad):
+            self.received += 1
+
+        def stop(self):
+            self.pipeline.set_state(Gst.State.NULL)
+
+    class VideoForwarderTest(unittest.TestCase):
+        def senders(self, forwarder):
+            participants = forwarder._VideoForwarder__participants
+            return dict((p.participant_id, p.sender_id) for p in participants.values())
+
+        def test_three_participants(self):
+            context = GstPipeline()
+            forwarder = VideoForwarder(context)
+            profile = Profile("127.0.0.1:43000-43100")
+            frontends, clients = [], []
+            for i in range(3):
+                frontend = RtpFrontend(MediaType.VIDEO, profile)
+                client_port = 44000 + 2 * i
+                frontend.create_sender([VP8], "127.0.0.1", client_port, client_port + 1)
+                frontend.create_receiver([VP8])
+                frontend.set_context(context)
+                forwarder.add("p%d" % i, frontend.get_media_source(), frontend.get_media_destination())
+                frontends.append(frontend)
+                clients.append(_Client(i, client_port, frontend.rtp_port))
+            context.play()
+
+            loop = GLib.MainLoop()
+            GLib.timeout_add(3000, loop.quit)
+            loop.run()
+
+            # each receiver gets one sender, the earliest joined one
+            self.assertEqual(self.senders(forwarder), {"p0": "p1", "p1": "p0", "p2": "p0"})
+            for client in clients:
+                self.assertTrue(client.received > 0)
+
+            forwarder.remove("p0")
+            self.assertEqual(self.senders(forwarder), {"p1": "p2", "p2": "p1"})
+            received = [client.received for client in clients]
+            GLib.timeout_add(1000, loop.quit)
+            loop.run()
+            self.assertTrue(clients[1].received > received[1])
+            self.assertTrue(clients[2].received > received[2])
+
+            for client in clients:
+                client.stop()
+            context.stop()
+            forwarder.dispose()
+            for frontend in frontends:
+                frontend.set_context(None)
+                frontend.dispose()
+
+    unittest.main()
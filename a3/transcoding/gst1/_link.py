@@ -22,6 +22,24 @@ In such configuration rtpbin DOES NOT change ssrc to its internal
 
 So in current implementation MediaPoint takes care of depay (pay) and provides (accepts) base Codec
 
+
+Links of one context share elements through _EncoderCache:
+
+    source -> tee --+--> queue -> destination                                   (direct)
+                    +--> queue -> decoder -> tee --+--> queue -> destination    (decoded)
+                                                   +--> queue -> encoder -> tee --+--> queue -> destination
+                                                                                  +--> queue -> destination
+
+a source is decoded once and encoded once per (codec, encoder params),
+nodes are refcounted and removed when the last Link using them is disposed.
+Sharing applies only to several links of one source in one context: two-point MediaRoom
+links each source once, mixer and forwarder do their own fan-out without Link.
+
+Metrics:
+    transcoding.encoders        encoders running (gauge)
+    transcoding.decoders        decoders running (gauge)
+    transcoding.shared          links served by existing decoder/encoder (counter)
+
 """
 
 
@@ -29,10 +47,138 @@ __author__ = 'RCSLabs'
 
 
 from ...logging import LOG
+from ...ledger import LEDGER, KIND
+from ...metrics import METRICS
 from ...media import MediaType, Codec, RtpCodec
 from ._pads import MediaSource, MediaDestination, VirtualMediaSource, VirtualMediaDestination
-from ._elements import GstPipeline
-from ._endec import create_decoder, create_encoder
+from ._elements import GstPipeline, TeeBranch, make_element
+from ._endec import create_decoder, create_encoder, encoder_params, PLANNER
+from ..planner import PlanError, ENCODE
+
+import threading
+import weakref
+
+
+class _Node(object):
+    """
+    element (optional) feeding a tee, fed by a branch from parent node tee (or source pad)
+    """
+    def __init__(self, key, element, tee, parent, branch, source_pad=None):
+        self.key = key
+        self.element = element
+        self.tee = tee
+        self.parent = parent
+        self.branch = branch
+        self.source_pad = source_pad
+        self.refs = 0
+
+
+class _EncoderCache(object):
+    """
+    decoders and encoders of one context, see module doc
+    """
+    def __init__(self, context):
+        self.__context = context
+        self.__nodes = {}
+        self.__lock = threading.RLock()
+        self.__encoders_gauge = METRICS.gauge("transcoding.encoders")
+        self.__decoders_gauge = METRICS.gauge("transcoding.decoders")
+        self.__shared_counter = METRICS.counter("transcoding.shared")
+
+    def source(self, media_source):
+        """
+        :return: node with tee of source
+        """
+        assert type(media_source) is MediaSource
+        with self.__lock:
+            key = ("source", media_source.gst_pad)
+            node = self.__nodes.get(key)
+            if node is None:
+                tee = self.__add(make_element("tee", allow_not_linked=True))
+                media_source.gst_pad.link(tee.sink_pad)
+                node = self.__nodes[key] = _Node(key, None, tee, None, None, media_source.gst_pad)
+            node.refs += 1
+            return node
+
+    def decoded(self, media_source):
+        """
+        :return: node with tee of decoded (raw) source
+        """
+        with self.__lock:
+            key = ("decoded", media_source.gst_pad)
+            node = self.__nodes.get(key)
+            if node is None:
+                LOG.debug("transcoding.Link: Decode %s -> RAW", media_source.codec)
+                parent = self.source(media_source)
+                node = self.__create(key, create_decoder(media_source.codec), parent)
+                self.__decoders_gauge.inc()
+            else:
+                self.__shared_counter.inc()
+            node.refs += 1
+            return node
+
+    def encoded(self, media_source, codec):
+        """
+        :return: node with tee of source encoded (transcoded) to codec
+        """
+        assert type(codec) is Codec
+        with self.__lock:
+            key = ("encoded", media_source.gst_pad, codec, encoder_params(codec))
+            node = self.__nodes.get(key)
+            if node is None:
+                LOG.debug("transcoding.Link: Encode %s -> %s", media_source.codec, codec)
+                parent = self.source(media_source) if media_source.is_raw() else self.decoded(media_source)
+                node = self.__create(key, create_encoder(codec), parent)
+                self.__encoders_gauge.inc()
+            else:
+                self.__shared_counter.inc()
+            node.refs += 1
+            return node
+
+    def release(self, node):
+        with self.__lock:
+            node.refs -= 1
+            if node.refs > 0:
+                return
+            del self.__nodes[node.key]
+            if node.branch is not None:
+                node.branch.dispose()
+            if node.source_pad is not None:
+                node.source_pad.unlink(node.tee.sink_pad)
+            for element in (node.element, node.tee):
+                if element is not None:
+                    element.stop()
+                    self.__context.remove(element)
+            if node.key[0] == "encoded":
+                self.__encoders_gauge.dec()
+            elif node.key[0] == "decoded":
+                self.__decoders_gauge.dec()
+            if node.parent is not None:
+                self.release(node.parent)
+
+    def __add(self, element):
+        self.__context.add(element)
+        return element
+
+    def __create(self, key, element, parent):
+        self.__add(element)
+        tee = self.__add(make_element("tee", allow_not_linked=True))
+        element.link(tee)
+        branch = TeeBranch(self.__context, parent.tee, sink_pad=element.sink_pad)
+        node = self.__nodes[key] = _Node(key, element, tee, parent, branch)
+        return node
+
+
+_CACHES = weakref.WeakKeyDictionary()
+_CACHES_LOCK = threading.Lock()
+
+
+def _get_cache(context):
+    with _CACHES_LOCK:
+        cache = _CACHES.get(context)
+        if cache is None:
+            cache = _CACHES[context] = _EncoderCache(context)
+        return cache
 
 
 class Link(object):
@@ -50,12 +196,14 @@ class Link(object):
         assert isinstance(media_destination, VirtualMediaDestination)
 
         self.__context = context
+        self.__cache = _get_cache(context)
 
         self.__media_source = None
         self.__media_destination = None
 
-        self.__decoder = None
-        self.__encoder = None
+        self.__node = None
+        self.__branch = None
+        LEDGER.acquire(KIND.LINK, self)
 
         media_source.subscribe(self.__media_source_resolved)
         media_destination.subscribe(self.__media_destination_resolved)
@@ -66,10 +214,7 @@ class Link(object):
             return
 
         if self.__context:
-            if self.__decoder:
-                self.__context.remove(self.__decoder)
-            if self.__encoder:
-                self.__context.remove(self.__encoder)
+            self.__release()
             self.__context = None
 
         # TODO:
@@ -98,75 +243,167 @@ class Link(object):
             self.__perform_link(self.__media_source, self.__media_destination)
 
     def __perform_link(self, media_source, media_destination):
+        """
+        conversion is chosen by planner (see a3.transcoding.planner and costs in _endec)
+        """
         assert type(media_source) is MediaSource
         assert type(media_destination) is MediaDestination
         assert len(media_destination.acceptable_codecs) > 0
         LOG.debug("transcoding.Link: Perform link %s -> %s", media_source, media_destination)
+        if self.__context is None:
+            return
 
-        source_pad = media_source.gst_pad
-        source_codec = media_source.codec
-        destination_pad = media_destination.gst_pad
-        destination_codecs = media_destination.acceptable_codecs
-
-        if media_source.is_raw() and media_destination.accepts_raw():
-            LOG.debug("transcoding.Link: Selected RAW")
-            source_pad.link(destination_pad)
-
-        elif media_destination.accepts(source_codec):
-            LOG.debug("transcoding.Link: Selected DIRECT %s", source_codec)
-            source_pad.link(destination_pad)
-
-        elif media_destination.accepts_raw():
-            LOG.debug("transcoding.Link: Decode %s -> RAW", source_codec)
-
-            # decoder (-> encoder)
-            self.__decoder = create_decoder(source_codec)
-            self.__context.add(self.__decoder)
-            self.__decoder.src_pad.link(self.__media_destination.gst_pad)
-
-            # source (-> decoder)
-            self.__media_source.gst_pad.link(self.__decoder.sink_pad)
-
-        elif self.__media_source.is_raw():
-            destination_codec = destination_codecs[0]
-            LOG.debug("transcoding.Link: Encode RAW -> %s", destination_codec)
-
-            # encoder (-> Destination)
-            self.__encoder = create_encoder(destination_codec)
-            self.__context.add(self.__encoder)
-            self.__encoder.element.sync_state_with_parent()
-            self.__encoder.src_pad.link(self.__media_destination.gst_pad)
-
-            # source (-> encoder)
-            self.__media_source.gst_pad.link(self.__encoder.sink_pad)
+        try:
+            plan = PLANNER.plan(media_source.codec, media_destination.acceptable_codecs)
+        except PlanError as err:
+            LOG.error("transcoding.Link: %s", err)
+            return
+        LOG.info("transcoding.Link: %s", plan)
 
+        if not plan.steps:
+            self.__node = self.__cache.source(media_source)
+        elif not plan.encodes:
+            self.__node = self.__cache.decoded(media_source)
         else:
-            destination_codec = destination_codecs[0]
-            assert type(source_codec) is Codec
-            assert type(destination_codec) is Codec
-            LOG.debug("transcoding.Link: Transcode %s -> %s", source_codec, destination_codec)
-
-            # encoder (-> Destination)
-            self.__encoder = create_encoder(destination_codec)
-            self.__context.add(self.__encoder)
-            self.__encoder.src_pad.link(self.__media_destination.gst_pad)
+            (step, codec) = plan.steps[-1]
+            assert step == ENCODE
+            self.__node = self.__cache.encoded(media_source, codec)
 
-            # decoder (-> encoder)
-            self.__decoder = create_decoder(source_codec)
-            self.__context.add(self.__decoder)
-            self.__decoder.src_pad.link(self.__encoder.sink_pad)
+        self.__branch = TeeBranch(self.__context, self.__node.tee, sink_pad=media_destination.gst_pad)
 
-            # source (-> decoder)
-            self.__media_source.gst_pad.link(self.__decoder.sink_pad)
+    def __release(self):
+        if self.__branch is not None:
+            self.__branch.dispose()
+            self.__branch = None
+        if self.__node is not None:
+            self.__cache.release(self.__node)
+            self.__node = None
 
     def dispose(self):
-        assert self.__context is None
         LOG.debug("Link.dispose")
-        if self.__decoder:
-            self.__decoder.dispose()
-            del self.__decoder
-
-        if self.__encoder:
-            self.__encoder.dispose()
-            del self.__encoder
-
+        self.__release()
+        # media source or destination may still resolve (e.g. replaced on re-negotiation)
+        self.__context = None
+        LEDGER.release(KIND.LINK, self)
+
+
+if __name__ == "__main__":
+    import unittest
+    from ...media import CODEC
+
+    class _Pad(object):
+        def __init__(self, name):
+            self.name = name
+            self.peers = []
+
+        def link(self, pad):
+            self.peers.append(pad)
+
+        def unlink(self, pad):
+            self.peers.remove(pad)
+
+    class _Element(object):
+        def __init__(self, name):
+            self.name = name
+            self.sink_pad = _Pad(name + ".sink")
+            self.stopped = False
+
+        def link(self, element):
+            pass
+
+        def stop(self):
+            self.stopped = True
+
+    class _Branch(object):
+        def __init__(self, context, tee, sink_pad):
+            self.tee = tee
+            self.sink_pad = sink_pad
+            self.disposed = False
+
+        def dispose(self):
+            self.disposed = True
+
+    class _Context(object):
+        def __init__(self):
+            self.elements = []
+            self.removed = []
+
+        def add(self, element):
+            self.elements.append(element)
+
+        def remove(self, element):
+            self.elements.remove(element)
+            self.removed.append(element.name)
+
+    def _media_source(codec):
+        source = MediaSource.__new__(MediaSource)
+        source._MediaSource__pad = _Pad("src")
+        source._MediaSource__codec = codec
+        return source
+
+    class EncoderCacheTest(unittest.TestCase):
+        def setUp(self):
+            names = {"tee": 0}
+
+            def make_tee(factory, **kwargs):
+                names["tee"] += 1
+                return _Element("tee%d" % names["tee"])
+
+            self.patched = dict((name, globals()[name])
+                                for name in ("make_element", "create_decoder", "create_encoder", "TeeBranch"))
+            globals().update(make_element=make_tee,
+                             create_decoder=lambda codec: _Element("dec-" + codec.encoding_name),
+                             create_encoder=lambda codec: _Element("enc-" + codec.encoding_name),
+                             TeeBranch=_Branch)
+            self.context = _Context()
+            self.cache = _EncoderCache(self.context)
+
+        def tearDown(self):
+            globals().update(self.patched)
+
+        def names(self):
+            return sorted(element.name for element in self.context.elements)
+
+        def test_source_shared(self):
+            source = _media_source(CODEC.PCMA)
+            a = self.cache.source(source)
+            b = self.cache.source(source)
+            self.assertTrue(a is b)
+            self.assertEqual(source.gst_pad.peers, [a.tee.sink_pad])
+            self.cache.release(a)
+            self.assertEqual(self.names(), ["tee1"])
+            self.cache.release(b)
+            self.assertEqual(self.names(), [])
+            self.assertEqual(source.gst_pad.peers, [])
+
+        def test_decoded_and_encoded_shared(self):
+            source = _media_source(CODEC.PCMA)
+            shared = METRICS.counter("transcoding.shared").value
+            direct = self.cache.source(source)
+            decoded = self.cache.decoded(source)
+            pcmu = [self.cache.encoded(source, CODEC.PCMU) for _ in range(2)]
+            opus = self.cache.encoded(source, CODEC.OPUS)
+            self.assertTrue(pcmu[0] is pcmu[1])
+            self.assertTrue(opus.parent is decoded and pcmu[0].parent is decoded)
+            self.assertTrue(decoded.parent is direct)
+            self.assertEqual([n for n in self.names() if not n.startswith("tee")],
+                             ["dec-PCMA", "enc-PCMU", "enc-opus"])
+            # decoded taken again by both encoders, PCMU encoder by its second link
+            self.assertEqual(METRICS.counter("transcoding.shared").value - shared, 3)
+
+            self.cache.release(pcmu[0])
+            self.cache.release(decoded)
+            self.assertTrue("enc-PCMU" in self.names() and "dec-PCMA" in self.names())
+            self.cache.release(pcmu[1])
+            self.assertEqual(self.context.removed, ["enc-PCMU", pcmu[0].tee.name])
+            self.assertTrue(pcmu[0].branch.disposed)
+            self.assertTrue("dec-PCMA" in self.names())
+
+            # encoder goes first, then decoder it was the last user of, source tee stays for direct link
+            self.cache.release(opus)
+            self.assertEqual(self.context.removed[2:], ["enc-opus", opus.tee.name, "dec-PCMA", decoded.tee.name])
+            self.assertEqual(self.names(), [direct.tee.name])
+            self.cache.release(direct)
+            self.assertEqual(self.names(), [])
+
+    unittest.main()
@@ -0,0 +1,575 @@
+#! /usr/bin/env python
+"""
+Audio mixer
+
+every sending participant is decoded once into a tee (input),
+every sending participant has own mix (audiomixer) of all other inputs (N-1 mix),
+participants not sending media yet share one mix of all inputs.
+Each mix is encoded once per codec of its receivers and shared by receivers with same codec.
+
+    source -> decoder -> convert -> tee --+--> queue -> mix(B) -> tee -> [convert] -> encoder(PCMA) -> tee -> queue -> B
+                                          +--> queue -> mix(C) -> ...
+                                          +--> queue -> mix(*) -> ...  (listeners)
+
+Inputs, mixes and encoders are added and removed as participants come and go,
+source and destination are linked when they are resolved (on first rtp and on remote sdp).
+
+Inputs are converted to the mix format: the highest rate and channels of participants' codecs
+(8 kHz mono while all are G.711 or raw), mix is converted back to the format of every encoder.
+Participant with a codec wider than the mix format rebuilds all inputs and mixes in the wider format
+(audio of the room breaks for a moment), format is not narrowed when such participant leaves.
+
+Test with audiotestsrc fed rtp endpoints on localhost (AudioMixerTopologyTest needs no running gstreamer):
+    # python -m a3.transcoding.gst1._mixer [AudioMixerTopologyTest]
+"""
+
+__author__ = 'RCSLabs'
+
+
+from ...logging import LOG
+from ...media import RawCodec
+from .._base import IAudioMixer
+from ._base import Gst
+from ._elements import GstElement, GstBin, TeeBranch, make_element
+from ._endec import create_decoder, create_encoder
+from ._pads import MediaSource, MediaDestination
+
+import threading
+
+
+# all inputs are converted to the same format (rate, channels) before mixing
+CONVERT = "audioconvert ! audioresample ! audio/x-raw,format=S16LE,rate=%d,channels=%d"
+
+# mix format until a participant's codec needs a wider one
+NARROWBAND = (8000, 1)
+
+# audiomixer is in gst-plugins-base since 1.14, liveadder is its predecessor in gst-plugins-bad
+MIXER_ELEMENTS = ("audiomixer", "liveadder")
+
+# key of mix shared by participants not sending media
+LISTENERS = None
+
+
+def _audio_format(codec):
+    """
+    :return: (rate, channels) codec carries, None - raw codec (any format)
+    """
+    if type(codec) is RawCodec:
+        return None
+    return (codec.clock_rate, codec.channels)
+
+
+def _make_mixer():
+    for factory_name in MIXER_ELEMENTS:
+        element = Gst.ElementFactory.make(factory_name, None)
+        if element:
+            return GstElement(element)
+    assert not "No gstreamer audio mixer element (%s)" % ", ".join(MIXER_ELEMENTS)
+
+
+class _Input(object):
+    """
+    source -> [decoder] -> convert -> tee
+    """
+    def __init__(self, context, media_source, mix_format):
+        assert type(media_source) is MediaSource
+        self.__context = context
+        self.__decoder = None if media_source.is_raw() else create_decoder(media_source.codec)
+        self.__convert = GstBin(CONVERT % mix_format)
+        self.tee = make_element("tee", allow_not_linked=True)
+        self.__source_pad = media_source.gst_pad
+
+        for element in filter(None, (self.__decoder, self.__convert, self.tee)):
+            context.add(element)
+        self.__convert.link(self.tee)
+        if self.__decoder is not None:
+            self.__decoder.link(self.__convert)
+            self.__source_pad.link(self.__decoder.sink_pad)
+        else:
+            self.__source_pad.link(self.__convert.sink_pad)
+
+    def dispose(self):
+        first = self.__decoder or self.__convert
+        self.__source_pad.unlink(first.sink_pad)
+        for element in filter(None, (self.__decoder, self.__convert, self.tee)):
+            element.stop()
+            self.__context.remove(element)
+
+
+class _Mix(object):
+    """
+    inputs -> mixer -> tee -> [[convert ->] encoder -> tee] -> outputs
+    """
+    def __init__(self, context, mix_format):
+        self.__context = context
+        self.__format = mix_format
+        self.__mixer = _make_mixer()
+        self.__tee = make_element("tee", allow_not_linked=True)
+        context.add(self.__mixer)
+        context.add(self.__tee)
+        self.__mixer.link(self.__tee)
+        self.__inputs = {}                  # participant id -> TeeBranch
+        self.__outputs = {}                 # participant id -> (codec or None, TeeBranch)
+        self.__encoders = {}                # codec -> (TeeBranch, elements, tee), elements - [convert,] encoder
+
+    @property
+    def empty(self):
+        return not self.__outputs
+
+    def add_input(self, participant_id, tee):
+        assert participant_id not in self.__inputs
+        self.__inputs[participant_id] = TeeBranch(self.__context, tee, sink_element=self.__mixer)
+
+    def remove_input(self, participant_id):
+        branch = self.__inputs.pop(participant_id, None)
+        if branch is not None:
+            branch.dispose()
+
+    def add_output(self, participant_id, media_destination):
+        assert type(media_destination) is MediaDestination
+        assert participant_id not in self.__outputs
+        if media_destination.accepts_raw():
+            codec, tee = None, self.__tee
+        else:
+            codec = media_destination.acceptable_codecs[0]
+            tee = self.__get_encoder(codec)
+        self.__outputs[participant_id] = (codec, TeeBranch(self.__context, tee, sink_pad=media_destination.gst_pad))
+
+    def remove_output(self, participant_id):
+        (codec, branch) = self.__outputs.pop(participant_id)
+        branch.dispose()
+        if codec is not None and not [c for (c, _) in self.__outputs.values() if c == codec]:
+            (branch, elements, tee) = self.__encoders.pop(codec)
+            branch.dispose()
+            for element in elements + [tee]:
+                element.stop()
+                self.__context.remove(element)
+
+    def dispose(self):
+        for participant_id in self.__outputs.keys():
+            self.remove_output(participant_id)
+        for participant_id in self.__inputs.keys():
+            self.remove_input(participant_id)
+        for element in (self.__mixer, self.__tee):
+            element.stop()
+            self.__context.remove(element)
+
+    def __get_encoder(self, codec):
+        if codec not in self.__encoders:
+            LOG.debug("AudioMixer: encoding mix to %s", codec)
+            elements = [create_encoder(codec)]
+            codec_format = _audio_format(codec)
+            if codec_format != self.__format:
+                elements.insert(0, GstBin(CONVERT % codec_format))
+            tee = make_element("tee", allow_not_linked=True)
+            for element in elements + [tee]:
+                self.__context.add(element)
+            for (element, next_element) in zip(elements, elements[1:] + [tee]):
+                element.link(next_element)
+            self.__encoders[codec] = (TeeBranch(self.__context, self.__tee, sink_pad=elements[0].sink_pad),
+                                      elements, tee)
+        return self.__encoders[codec][2]
+
+
+class _Participant(object):
+    def __init__(self, participant_id):
+        self.participant_id = participant_id
+        self.source = None
+        self.input = None
+        self.mix_key = None                 # key of mix linked to destination
+        self.destination = None
+        self.removed = False
+
+
+class AudioMixer(IAudioMixer):
+    def __init__(self, context):
+        self.__context = context
+        self.__participants = {}
+        self.__mixes = {}                   # id of excluded participant or LISTENERS -> _Mix
+        self.__format = NARROWBAND
+        self.__lock = threading.RLock()     # sources are resolved in streaming threads
+
+    def add(self, participant_id, media_source, media_destination):
+        with self.__lock:
+            assert participant_id not in self.__participants
+            participant = _Participant(participant_id)
+            self.__participants[participant_id] = participant
+        LOG.debug("AudioMixer: add %s", participant_id)
+        media_source.subscribe(lambda source: self.__on_source(participant, source))
+        media_destination.subscribe(lambda destination: self.__on_destination(participant, destination))
+
+    def remove(self, participant_id):
+        LOG.debug("AudioMixer: remove %s", participant_id)
+        with self.__lock:
+            participant = self.__participants.pop(participant_id, None)
+            if participant is None:
+                return
+            participant.removed = True
+            if participant.destination is not None:
+                self.__unlink_output(participant)
+            if participant.input is not None:
+                for mix in self.__mixes.values():
+                    mix.remove_input(participant_id)
+                self.__mixes.pop(participant_id).dispose()
+                participant.input.dispose()
+
+    def dispose(self):
+        with self.__lock:
+            for participant_id in self.__participants.keys():
+                self.remove(participant_id)
+            for mix in self.__mixes.values():
+                mix.dispose()
+            self.__mixes.clear()
+
+    #
+    # private
+    #
+    def __on_source(self, participant, media_source):
+        with self.__lock:
+            if participant.removed:
+                return
+            LOG.debug("AudioMixer: %s sends %s", participant.participant_id, media_source)
+            participant.source = media_source
+            if self.__widen(_audio_format(media_source.codec)):
+                return
+            self.__add_input(participant)
+            if participant.destination is not None:
+                self.__unlink_output(participant)
+                self.__link_output(participant)
+
+    def __on_destination(self, participant, media_destination):
+        with self.__lock:
+            if participant.removed:
+                return
+            participant.destination = media_destination
+            if media_destination.accepts_raw() or not self.__widen(
+                    _audio_format(media_destination.acceptable_codecs[0])):
+                self.__link_output(participant)
+
+    def __widen(self, codec_format):
+        """
+        rebuild inputs and mixes if codec_format does not fit into the mix format
+        :return: True if rebuilt (resolved sources and destinations are linked)
+        """
+        if codec_format is None:
+            return False
+        mix_format = (max(self.__format[0], codec_format[0]), max(self.__format[1], codec_format[1]))
+        if mix_format == self.__format:
+            return False
+        LOG.info("AudioMixer: mix format %d Hz x %d -> %d Hz x %d", *(self.__format + mix_format))
+        participants = self.__participants.values()
+        for participant in participants:
+            if participant.mix_key is not None:
+                self.__unlink_output(participant)
+        for mix in self.__mixes.values():
+            mix.dispose()
+        self.__mixes.clear()
+        for participant in participants:
+            if participant.input is not None:
+                participant.input.dispose()
+                participant.input = None
+        self.__format = mix_format
+        for participant in participants:
+            if participant.source is not None:
+                self.__add_input(participant)
+        for participant in participants:
+            if participant.destination is not None:
+                self.__link_output(participant)
+        return True
+
+    def __add_input(self, participant):
+        participant_id = participant.participant_id
+        participant.input = _Input(self.__context, participant.source, self.__format)
+
+        # own mix hears every other sending participant
+        own_mix = self.__mixes[participant_id] = _Mix(self.__context, self.__format)
+        for other in self.__participants.values():
+            if other is not participant and other.input is not None:
+                own_mix.add_input(other.participant_id, other.input.tee)
+
+        # every other mix (including listeners) hears this participant
+        for (key, mix) in self.__mixes.items():
+            if key != participant_id:
+                mix.add_input(participant_id, participant.input.tee)
+
+    def __link_output(self, participant):
+        key = participant.participant_id if participant.input is not None else LISTENERS
+        if key not in self.__mixes:
+            mix = self.__mixes[key] = _Mix(self.__context, self.__format)
+            for other in self.__participants.values():
+                if other.input is not None:
+                    mix.add_input(other.participant_id, other.input.tee)
+        self.__mixes[key].add_output(participant.participant_id, participant.destination)
+        participant.mix_key = key
+
+    def __unlink_output(self, participant):
+        mix = self.__mixes[participant.mix_key]
+        mix.remove_output(participant.participant_id)
+        if participant.mix_key is LISTENERS and mix.empty:
+            self.__mixes.pop(LISTENERS).dispose()
+        participant.mix_key = None
+
+
+if __name__ == "__main__":
+    import unittest
+    from ._base import GLib
+    from ._elements import GstPipeline
+    from ._rtp_frontend import RtpFrontend
+    from ...config.profile import Profile
+    from ...media import MediaType, RtpCodec, CODEC
+
+    PCMA = RtpCodec(CODEC.PCMA, 8)
+
+    class _Pad(object):
+        def __init__(self, name):
+            self.name = name
+            self.peers = []
+
+        def link(self, pad):
+            self.peers.append(pad)
+
+        def unlink(self, pad):
+            self.peers.remove(pad)
+
+    class _Element(object):
+        def __init__(self, name):
+            self.name = name
+            self.sink_pad = _Pad(name + ".sink")
+            self.linked = []
+
+        def link(self, element):
+            self.linked.append(element)
+
+        def stop(self):
+            pass
+
+    class _Branch(object):
+        def __init__(self, context, tee, sink_pad=None, sink_element=None):
+            self.tee = tee
+            self.sink = sink_element.name if sink_element is not None else sink_pad.name
+            context.branches.append(self)
+
+        def dispose(self):
+            self.sink = None
+
+    class _Context(object):
+        def __init__(self):
+            self.elements = []
+            self.branches = []
+
+        def add(self, element):
+            self.elements.append(element)
+
+        def remove(self, element):
+            self.elements.remove(element)
+
+        def names(self, prefix):
+            return sorted(element.name for element in self.elements if element.name.startswith(prefix))
+
+        def feeds(self, sink):
+            """
+            names of tees linked to sink (mixer or destination pad)
+            """
+            return sorted(branch.tee.name for branch in self.branches if branch.sink == sink)
+
+    class _Endpoint(object):
+        """
+        media source and destination of participant, resolved by test
+        """
+        def __init__(self, name, codec, raw=False):
+            self.gst_pad = _Pad(name)
+            self.codec = codec
+            self.acceptable_codecs = [codec]
+            self.raw = raw
+            self.listener = None
+
+        def is_raw(self):
+            return self.raw
+
+        def accepts_raw(self):
+            return self.raw
+
+        def subscribe(self, listener):
+            self.listener = listener
+
+        def resolve(self):
+            self.listener(self)
+
+    class AudioMixerTopologyTest(unittest.TestCase):
+        def setUp(self):
+            counter = {"tee": 0, "mixer": 0}
+
+            def make(prefix):
+                counter[prefix] += 1
+                return _Element("%s%d" % (prefix, counter[prefix]))
+
+            def make_convert(description):
+                caps = dict(field.split("=") for field in description.split("audio/x-raw,")[1].split(","))
+                return _Element("convert-%s-%s" % (caps["rate"], caps["channels"]))
+
+            self.patched = dict((name, globals()[name]) for name in ("make_element", "_make_mixer", "GstBin", "TeeBranch",
+                                                                     "create_decoder", "create_encoder",
+                                                                     "MediaSource", "MediaDestination"))
+            globals().update(make_element=lambda factory, **kwargs: make("tee"),
+                             _make_mixer=lambda: make("mixer"),
+                             GstBin=make_convert,
+                             TeeBranch=_Branch,
+                             create_decoder=lambda codec: _Element("dec-%s" % codec),
+                             create_encoder=lambda codec: _Element("enc-%s" % codec),
+                             MediaSource=_Endpoint, MediaDestination=_Endpoint)
+            self.context = _Context()
+            self.mixer = AudioMixer(self.context)
+            self.endpoints = {}
+
+        def tearDown(self):
+            globals().update(self.patched)
+
+        def add(self, participant_id, codec=CODEC.PCMA, send=True, receive=True):
+            source = _Endpoint(participant_id + ".src", codec, raw=codec is CODEC.RAW_AUDIO)
+            destination = _Endpoint(participant_id + ".dst", codec, raw=codec is CODEC.RAW_AUDIO)
+            self.endpoints[participant_id] = (source, destination)
+            self.mixer.add(participant_id, source, destination)
+            if send:
+                source.resolve()
+            if receive:
+                destination.resolve()
+
+        def mixes(self):
+            return self.mixer._AudioMixer__mixes
+
+        def heard(self, participant_id):
+            """
+            participants mixed for participant_id
+            """
+            return sorted(self.mixes()[participant_id]._Mix__inputs.keys())
+
+        def test_n_minus_one(self):
+            for participant_id in ("a", "b", "c"):
+                self.add(participant_id)
+            self.assertEqual(sorted(self.mixes().keys()), ["a", "b", "c"])
+            self.assertEqual([self.heard(p) for p in "abc"], [["b", "c"], ["a", "c"], ["a", "b"]])
+            # one decoder per input, one encoder per mix, no conversion of narrowband mix for PCMA
+            self.assertEqual(len(self.context.names("dec-")), 3)
+            self.assertEqual(len(self.context.names("enc-")), 3)
+            self.assertEqual(self.context.names("convert-"), ["convert-8000-1"] * 3)
+            for participant_id in "abc":
+                self.assertEqual(len(self.context.feeds(participant_id + ".dst")), 1)
+
+        def test_listeners(self):
+            self.add("a")
+            self.add("b", send=False)
+            self.add("c", send=False)
+            self.assertEqual(sorted(self.mixes().keys()), [LISTENERS, "a"])
+            self.assertEqual(self.heard(LISTENERS), ["a"])
+            self.assertEqual(self.heard("a"), [])
+            # listeners with same codec share the encoder of their mix
+            self.assertEqual(self.context.feeds("b.dst"), self.context.feeds("c.dst"))
+            self.endpoints["b"][0].resolve()
+            self.assertEqual(self.heard("b"), ["a"])
+            self.assertEqual(self.heard("a"), ["b"])
+            self.assertEqual(self.heard(LISTENERS), ["a", "b"])
+            self.mixer.remove("c")
+            self.assertEqual(sorted(self.mixes().keys()), ["a", "b"])
+
+        def test_remove(self):
+            for participant_id in ("a", "b", "c"):
+                self.add(participant_id)
+            self.mixer.remove("b")
+            self.assertEqual(sorted(self.mixes().keys()), ["a", "c"])
+            self.assertEqual([self.heard("a"), self.heard("c")], [["c"], ["a"]])
+            self.assertEqual(len(self.context.names("dec-")), 2)
+            self.mixer.dispose()
+            self.assertEqual(self.context.elements, [])
+            self.assertEqual([branch for branch in self.context.branches if branch.sink is not None], [])
+
+        def test_raw_participant(self):
+            self.add("a")
+            self.add("r", codec=CODEC.RAW_AUDIO)
+            self.assertEqual(self.heard("r"), ["a"])
+            self.assertEqual(self.context.names("dec-"), ["dec-PCMA/8000"])
+            self.assertEqual(self.context.names("enc-"), ["enc-PCMA/8000"])
+            # raw destination takes the mix as it is
+            self.assertEqual(self.context.feeds("r.dst"), [self.mixes()["r"]._Mix__tee.name])
+
+        def test_wideband(self):
+            self.add("a")
+            self.add("b")
+            self.add("w", codec=CODEC.OPUS2, send=False)
+            # inputs and mixes are rebuilt in the format of the widest codec
+            self.assertEqual(self.mixer._AudioMixer__format, (48000, 2))
+            self.assertEqual(self.context.names("convert-"), ["convert-48000-2"] * 2 + ["convert-8000-1"] * 2)
+            self.assertEqual([self.heard(p) for p in ("a", "b", LISTENERS)], [["b"], ["a"], ["a", "b"]])
+            self.assertEqual(len(self.context.names("enc-opus")), 1)
+            self.endpoints["w"][0].resolve()
+            self.assertEqual(self.context.names("convert-"), ["convert-48000-2"] * 3 + ["convert-8000-1"] * 2)
+            self.assertEqual(self.heard("w"), ["a", "b"])
+            for participant_id in ("a", "b", "w"):
+                self.assertEqual(len(self.context.feeds(participant_id + ".dst")), 1)
+            # format is kept when wideband participant leaves
+            self.mixer.remove("w")
+            self.add("c")
+            self.assertEqual(self.context.names("convert-"), ["convert-48000-2"] * 3 + ["convert-8000-1"] * 3)
+            self.mixer.dispose()
+            self.assertEqual(self.context.elements, [])
+
+    CLIENT = """audiotestsrc is-live=true freq=%(freq)d ! audioconvert ! alawenc ! rtppcmapay pt=8 !
+                udpsink host=127.0.0.1 port=%(mc_port)d sync=false async=false
+                udpsrc port=%(port)d caps="application/x-rtp,media=audio,encoding-name=PCMA,clock-rate=8000" !
+                rtppcmadepay ! alawdec ! fakesink name=sink signal-handoffs=true sync=false"""
+
+    class _Client(object):
+        """
+        rtp endpoint sending tone of freq and counting received audio buffers
+        """
+        def __init__(self, freq, port, mc_port):
+            self.received = 0
+            self.pipeline = Gst.parse_launch(CLIENT % dict(freq=freq, port=port, mc_port=mc_port))
+            self.pipeline.get_by_name("sink").connect("handoff", self.__on_handoff)
+            self.pipeline.set_state(Gst.State.PLAYING)
+
+        def __on_handoff(self, sink, buffer_, pad):
+            self.received += 1
+
+        def stop(self):
+            self.pipeline.set_state(Gst.State.NULL)
+
+    class AudioMixerTest(unittest.TestCase):
+        def test_three_participants(self):
+            context = GstPipeline()
+            mixer = AudioMixer(context)
+            profile = Profile("127.0.0.1:41000-41100")
+            frontends, clients = [], []
+            for (i, freq) in enumerate((440, 660, 880)):
+                frontend = RtpFrontend(MediaType.AUDIO, profile)
+                client_port = 42000 + 2 * i
+                frontend.create_sender([PCMA], "127.0.0.1", client_port, client_port + 1)
+                frontend.create_receiver([PCMA])
+                frontend.set_context(context)
+                mixer.add("p%d" % i, frontend.get_media_source(), frontend.get_media_destination())
+                frontends.append(frontend)
+                clients.append(_Client(freq, client_port, frontend.rtp_port))
+            context.play()
+
+            loop = GLib.MainLoop()
+            GLib.timeout_add(3000, loop.quit)
+            loop.run()
+
+            for client in clients:
+                self.assertTrue(client.received > 0)
+
+            mixer.remove("p1")
+            received = [client.received for client in clients]
+            GLib.timeout_add(1000, loop.quit)
+            loop.run()
+            self.assertTrue(clients[0].received > received[0])
+            self.assertTrue(clients[2].received > received[2])
+
+            for client in clients:
+                client.stop()
+            context.stop()
+            mixer.dispose()
+            for frontend in frontends:
+                frontend.set_context(None)
+                frontend.dispose()
+
+    unittest.main()
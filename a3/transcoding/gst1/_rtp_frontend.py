@@ -1,11 +1,22 @@
 #! /usr/bin/env python
 """
+Rtp frontend: socket pair, rtpbin, depay of remote media and pay of local media
 
+    udpsrc  -> rtpbin -> depay -> [src]
+    udpsink <- valve <- rtpbin <- pay <- [sink]
+
+Re-negotiated SDP is applied to running frontend (see RtpMediaPoint.update_remote_media_description):
+    set_destination     moves udpsinks to new remote address
+    sending             opens/closes valve (hold/resume), rtcp keeps going
+    update_sender       changes pt of pay, or replaces pay and media destination on codec change
+    update_receiver     clears pt map of rtpbin, replaces depay and media source if codec of running
+                        depay is not offered any more (new depay is made on next pad of rtpbin)
 """
 
 __author__ = 'RCSLabs'
 
 from ...logging import LOG
+from ...ledger import LEDGER, KIND
 from ...config.profile import Profile
 from ...media import MediaType, Codec, RtpCodec
 from .._base import IRtpFrontend
@@ -27,27 +38,29 @@ def get_caps_for_rtp_codec(rtp_codec):
 
 
 class RtpFrontend(IRtpFrontend):
-    def __init__(self, media_type, profile):
+    def __init__(self, media_type, profile, ports=None):
         from .factory import Gst1TranscodingFactory
         assert type(media_type) is MediaType
         assert type(profile) is Profile
 
         self.__media_type = media_type
         self.__local_codec = None
-        #self.__remote_codec = None
+        self.__remote_codec = None
         self.__remote_rtp_codecs = None
 
-        self.__conn = RtpSocketPair(profile, Gst1TranscodingFactory())
+        self.__conn = RtpSocketPair(profile, Gst1TranscodingFactory(), ports)
 
         self.__context = None
         self.__bin = GstBin()
         self.__rtp_bin = RtpBin(pad_added=self.pad_added, request_pt_map=self.request_pt_map)
         self.__bin.add(self.__rtp_bin)
+        LEDGER.acquire(KIND.GST_BIN, self.__bin)
         self.__rtp_sink = None
         self.__rtcp_sink = None
         self.__rtp_src = None
         self.__rtcp_src = None
         self.__fakesink = None
+        self.__valve = None
 
         self.__depay = None
         self.__pay = None
@@ -120,15 +133,14 @@ class RtpFrontend(IRtpFrontend):
             assert len(rtp_codecs) == 1
             if self.__depay is None:
                 self.__create_depay(rtp_codecs[0], pad)
+            elif rtp_codecs[0].base_codec == self.__remote_codec:
+                # another stream of the same codec is started (new ssrc or pt), it replaces current one
+                peer = self.__depay.sink_pad.get_peer()
+                if peer is not None:
+                    peer.unlink(self.__depay.sink_pad)
+                pad.link(self.__depay.sink_pad)
             else:
-                # another stream is started
-                # we can use a new one or reuse existing
-                if payload_type == 8:
-                    # hack: replace current stream with a new one
-                    pass
-                else:
-                    # ignore
-                    pass
+                LOG.warning("RtpFrontend: ignoring stream pt=%d, %s is received", payload_type, self.__remote_codec)
 
     def request_pt_map(self, obj, _, pt, extra):
         LOG.debug("RtpFrontend: request_pt_map on pt=%d", pt)
@@ -152,6 +164,10 @@ class RtpFrontend(IRtpFrontend):
     def rtcp_port(self):
         return self.__conn.rtcp_port
 
+    @property
+    def packets_received(self):
+        return self.__rtp_bin.packets_received
+
     def stop(self):
         pass
 
@@ -177,9 +193,12 @@ class RtpFrontend(IRtpFrontend):
 
         self.__rtp_sink = UdpSink(socket=self.__conn.rtp_socket, host=remote_host, port=remote_rtp_port)
         self.__rtcp_sink = UdpSink(socket=self.__conn.rtcp_socket, host=remote_host, port=remote_rtcp_port)
+        self.__valve = make_element("valve", drop=False)
         self.__bin.add(self.__rtp_sink)
         self.__bin.add(self.__rtcp_sink)
-        self.__rtp_bin._element.get_static_pad("send_rtp_src_0").link(self.__rtp_sink.sink_pad)
+        self.__bin.add(self.__valve)
+        self.__rtp_bin._element.get_static_pad("send_rtp_src_0").link(self.__valve.sink_pad)
+        self.__valve.link(self.__rtp_sink)
         self.__rtp_bin._element.get_request_pad("send_rtcp_src_0").link(self.__rtcp_sink.sink_pad)
 
         self.__create_pay(local_rtp_codec)
@@ -211,6 +230,58 @@ class RtpFrontend(IRtpFrontend):
         assert rtcp_src_pad
         rtcp_src_pad.link(rtcp_sink_pad)
 
+    def set_destination(self, remote_host, remote_rtp_port, remote_rtcp_port):
+        assert type(remote_host) is str
+        assert self.__rtp_sink is not None
+        LOG.debug("RtpFrontend.set_destination %s:%d,%d", remote_host, remote_rtp_port, remote_rtcp_port)
+        self.__rtp_sink.set_destination(remote_rtp_port, remote_host)
+        self.__rtcp_sink.set_destination(remote_rtcp_port, remote_host)
+
+    @property
+    def sending(self):
+        return self.__valve is not None and not self.__valve.get_property("drop")
+
+    @sending.setter
+    def sending(self, sending):
+        assert self.__valve is not None
+        self.__valve.element.set_property("drop", not sending)
+
+    def update_sender(self, local_rtp_codecs):
+        """
+        :return: True if media destination is replaced (codec changed)
+        """
+        assert len(local_rtp_codecs) >= 1
+        assert self.__pay is not None
+        local_rtp_codec = local_rtp_codecs[0]
+        if local_rtp_codec == self.__local_codec:
+            return False
+        LOG.debug("RtpFrontend.update_sender %s -> %s", self.__local_codec, local_rtp_codec)
+        if local_rtp_codec.base_codec == self.__local_codec.base_codec:
+            self.__pay.element.set_property("pt", local_rtp_codec.payload_type)
+            self.__local_codec = local_rtp_codec
+            return False
+        self.__remove_pay()
+        self.__local_codec = local_rtp_codec
+        self.__media_destination = VirtualMediaDestination()
+        self.__create_pay(local_rtp_codec)
+        return True
+
+    def update_receiver(self, remote_rtp_codecs):
+        """
+        :return: True if media source is replaced (codec changed)
+        """
+        assert self.__rtp_src is not None
+        if remote_rtp_codecs == self.__remote_rtp_codecs:
+            return False
+        LOG.debug("RtpFrontend.update_receiver %s", ", ".join(str(c) for c in remote_rtp_codecs))
+        self.__remote_rtp_codecs = remote_rtp_codecs
+        self.__rtp_bin.element.emit("clear-pt-map")
+        if self.__depay is None or self.__remote_codec in [c.base_codec for c in remote_rtp_codecs]:
+            return False
+        self.__remove_depay()
+        self.__media_source = VirtualMediaSource()
+        return True
+
     def __create_depay(self, remote_codec, pad):
         """
         creates decoder of remote media
@@ -218,6 +289,7 @@ class RtpFrontend(IRtpFrontend):
         """
         assert type(remote_codec) is RtpCodec
         self.__depay = create_depay(remote_codec)
+        self.__remote_codec = remote_codec.base_codec
         self.__bin.add(self.__depay)
         pad.link(self.__depay.sink_pad)
 
@@ -244,7 +316,28 @@ class RtpFrontend(IRtpFrontend):
 
         self.__media_destination.resolve(MediaDestination(sink_pad, [local_rtp_codec.base_codec]))
 
+    def __remove_depay(self):
+        peer = self.__depay.sink_pad.get_peer()
+        if peer is not None:
+            peer.unlink(self.__depay.sink_pad)
+        self.__bin._element.remove_pad(self.__bin.get_pad("src"))
+        self.__depay.stop()
+        self.__bin.remove(self.__depay)
+        self.__depay = None
+        self.__remote_codec = None
+
+    def __remove_pay(self):
+        self.__pay.src_pad.unlink(self.__rtp_bin._element.get_static_pad("send_rtp_sink_0"))
+        self.__bin._element.remove_pad(self.__bin.get_pad("sink"))
+        self.__pay.stop()
+        self.__bin.remove(self.__pay)
+        self.__pay = None
+
     def dispose(self):
         assert self.__conn is not None
+        # stop udp elements before their sockets are closed
+        self.set_context(None)
+        self.__bin.dispose()
+        LEDGER.release(KIND.GST_BIN, self.__bin)
         self.__conn.close()
         self.__conn = None
@@ -11,8 +11,10 @@ from ._socket import Socket as _Socket
 from _dtmf_sender import DtmfSender as _DtmfSender
 from ._rtp_frontend import RtpFrontend as _RtpFrontend
 from ._rtmp_frontend import RtmpFrontend as _RtmpFrontend
-from ._endec import RTP_CAPS
+from ._endec import RTP_CAPS, PLANNER
 from ._link import Link as _Link
+from ._mixer import AudioMixer as _AudioMixer
+from ._forwarder import VideoForwarder as _VideoForwarder
 from ._elements import *
 
 
@@ -23,8 +25,8 @@ class _Gst1TranscodingFactoryImpl(ITranscodingFactory):
     def create_socket(self, port, interface="0.0.0.0"):
         return _Socket(port, interface)
 
-    def create_rtp_frontend(self, media_type, profile):
-        return _RtpFrontend(media_type, profile)
+    def create_rtp_frontend(self, media_type, profile, ports=None):
+        return _RtpFrontend(media_type, profile, ports)
 
     def create_rtmp_frontend(self, media_type, profile):
         return _RtmpFrontend(media_type, profile)
@@ -38,6 +40,15 @@ class _Gst1TranscodingFactoryImpl(ITranscodingFactory):
     def create_link(self, context, media_source, media_destination):
         return _Link(context, media_source, media_destination)
 
+    def create_audio_mixer(self, context):
+        return _AudioMixer(context)
+
+    def create_video_forwarder(self, context):
+        return _VideoForwarder(context)
+
+    def get_planner(self):
+        return PLANNER
+
     def get_supported_codecs(self):
         return RTP_CAPS.keys()
 
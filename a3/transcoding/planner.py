@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""
+Codec conversion planner
+
+codecs and RAW of every media type are nodes of a graph,
+decoding (codec -> RAW) and encoding (RAW -> codec) are edges weighted by their cost.
+Planner finds the cheapest path from source codec to any acceptable destination codec
+(ties go to the codec destination prefers, i.e. the earlier one in its list)
+and caches plans per (source codec, acceptable codecs).
+
+Rtp payloading is done by rtp frontends on both ends of every path, so it is not part of the graph.
+
+Example:
+    planner = Planner(decode_costs={CODEC.PCMA: 1}, encode_costs={CODEC.PCMA: 1})
+    plan = planner.plan(CODEC.RAW_AUDIO, [CODEC.PCMA])
+    plan.steps      # (("encode", CODEC.PCMA),)
+"""
+
+__author__ = 'RCSLabs'
+
+
+from ..logging import LOG
+from ..media import ICodec, RawCodec, CODEC
+
+import heapq
+import threading
+
+
+DECODE = "decode"
+ENCODE = "encode"
+
+
+class PlanError(Exception):
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return str(self.value)
+
+
+class Plan(object):
+    def __init__(self, source, target, steps, cost):
+        self.__source = source
+        self.__target = target
+        self.__steps = tuple(steps)
+        self.__cost = cost
+
+    @property
+    def source(self):
+        return self.__source
+
+    @property
+    def target(self):
+        return self.__target
+
+    @property
+    def steps(self):
+        """
+        :return: ((DECODE | ENCODE, codec), ...)
+        """
+        return self.__steps
+
+    @property
+    def cost(self):
+        return self.__cost
+
+    @property
+    def decodes(self):
+        return any(step == DECODE for (step, _) in self.__steps)
+
+    @property
+    def encodes(self):
+        return any(step == ENCODE for (step, _) in self.__steps)
+
+    def __str__(self):
+        path = ", ".join("%s %s" % (step, codec) for (step, codec) in self.__steps) or "direct"
+        return "%s -> %s via [%s], cost %d" % (self.__source, self.__target, path, self.__cost)
+
+
+class Planner(object):
+    def __init__(self, decode_costs, encode_costs):
+        """
+        :param decode_costs: {codec: cost of decoding to RAW}, codecs missing here cannot be decoded
+        :param encode_costs: {codec: cost of encoding RAW}, codecs missing here cannot be encoded
+        """
+        self.__decode_costs = dict(decode_costs)
+        self.__encode_costs = dict(encode_costs)
+        self.__plans = {}
+        self.__lock = threading.Lock()
+
+    def plan(self, source_codec, acceptable_codecs):
+        """
+        :return: cheapest Plan from source_codec to one of acceptable_codecs
+        raises: PlanError if there is no path
+        """
+        assert isinstance(source_codec, ICodec)
+        assert len(acceptable_codecs) > 0
+        key = (source_codec, tuple(acceptable_codecs))
+        with self.__lock:
+            plan = self.__plans.get(key)
+        if plan is None:
+            plan = self.__find(source_codec, list(acceptable_codecs))
+            LOG.info("Planner: %s (acceptable: %s)", plan, ", ".join(str(c) for c in acceptable_codecs))
+            with self.__lock:
+                self.__plans[key] = plan
+        return plan
+
+    def __edges(self, codec, acceptable_codecs):
+        """
+        yield (step, next codec, cost)
+        """
+        if type(codec) is RawCodec:
+            for target in acceptable_codecs:
+                if type(target) is not RawCodec and target.media_type is codec.media_type \
+                        and target in self.__encode_costs:
+                    yield ENCODE, target, self.__encode_costs[target]
+        elif codec in self.__decode_costs:
+            yield DECODE, CODEC.RAW(codec.media_type), self.__decode_costs[codec]
+
+    def __find(self, source_codec, acceptable_codecs):
+        """
+        Dijkstra over codecs, ties are broken by destination preference
+        """
+        preference = dict((codec, i) for (i, codec) in reversed(list(enumerate(acceptable_codecs))))
+        worst = len(acceptable_codecs)
+        queue = [(0, preference.get(source_codec, worst), 0, source_codec, ())]
+        visited = set()
+        counter = 1
+        while queue:
+            (cost, _, _, codec, steps) = heapq.heappop(queue)
+            if codec in preference:
+                return Plan(source_codec, codec, steps, cost)
+            if codec in visited:
+                continue
+            visited.add(codec)
+            for (step, target, step_cost) in self.__edges(codec, acceptable_codecs):
+                if target not in visited:
+                    heapq.heappush(queue, (cost + step_cost, preference.get(target, worst), counter,
+                                           target, steps + ((step, target),)))
+                    counter += 1
+        raise PlanError("No conversion from %s to any of %s" %
+                        (source_codec, ", ".join(str(c) for c in acceptable_codecs)))
+
+
+if __name__ == "__main__":
+    import unittest
+
+    class PlannerTest(unittest.TestCase):
+        def setUp(self):
+            self.planner = Planner(decode_costs={CODEC.PCMA: 1, CODEC.H264: 20, CODEC.VP8: 20},
+                                   encode_costs={CODEC.PCMA: 1, CODEC.H264: 100, CODEC.VP8: 120})
+
+        def test_direct(self):
+            plan = self.planner.plan(CODEC.VP8, [CODEC.H264, CODEC.VP8])
+            self.assertEqual(plan.target, CODEC.VP8)
+            self.assertEqual(plan.steps, ())
+            self.assertEqual(plan.cost, 0)
+
+        def test_cheapest_encoder(self):
+            plan = self.planner.plan(CODEC.RAW_VIDEO, [CODEC.VP8, CODEC.H264])
+            self.assertEqual(plan.target, CODEC.H264)
+            self.assertEqual(plan.steps, (("encode", CODEC.H264),))
+
+        def test_transcode(self):
+            plan = self.planner.plan(CODEC.VP8, [CODEC.H264])
+            self.assertEqual(plan.steps, (("decode", CODEC.RAW_VIDEO), ("encode", CODEC.H264)))
+            self.assertEqual(plan.cost, 120)
+            self.assertTrue(plan.decodes and plan.encodes)
+
+        def test_decode_to_raw(self):
+            plan = self.planner.plan(CODEC.PCMA, [CODEC.RAW_AUDIO, CODEC.PCMU])
+            self.assertEqual(plan.target, CODEC.RAW_AUDIO)
+            self.assertEqual(plan.cost, 1)
+
+        def test_preference_on_tie(self):
+            planner = Planner(decode_costs={}, encode_costs={CODEC.H264: 10, CODEC.VP8: 10})
+            self.assertEqual(planner.plan(CODEC.RAW_VIDEO, [CODEC.VP8, CODEC.H264]).target, CODEC.VP8)
+            self.assertEqual(planner.plan(CODEC.RAW_VIDEO, [CODEC.H264, CODEC.VP8]).target, CODEC.H264)
+
+        def test_no_path(self):
+            self.assertRaises(PlanError, self.planner.plan, CODEC.OPUS, [CODEC.PCMA])
+
+        def test_cached(self):
+            self.assertTrue(self.planner.plan(CODEC.VP8, [CODEC.H264]) is
+                            self.planner.plan(CODEC.VP8, [CODEC.H264]))
+
+    unittest.main()
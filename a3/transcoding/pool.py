@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+"""
+Pool of ready rtp frontends
+
+Creating RtpFrontend opens a socket pair (probing ports of profile) and builds gstreamer bins,
+all before SDP_OFFER can be sent. RtpFrontendPool is ITranscodingFactory decorator keeping up to size
+ready frontends per (media type, profile), create_rtp_frontend checks out one of them,
+the pool is refilled by a background thread.
+
+Frontend disposed while still pristine (only ports and ssrc/cname were used, i.e. point removed
+before SDP_ANSWER) goes back to the pool instead of being destroyed.
+
+Resources of every frontend are recorded in the ledger (see a3.ledger) under its own token "rtp_pool-<n>",
+checked out frontend is transferred to the current owner (the point) as "<owner>/rtp_pool-<n>",
+recycled one is transferred back.
+
+Example:
+    factory = RtpFrontendPool(Gst1TranscodingFactory(), 4, warm=[(MediaType.AUDIO, profile)])
+
+Metrics:
+    rtp_pool.hit            checkouts served from pool (counter)
+    rtp_pool.miss           checkouts that created frontend synchronously (counter)
+    rtp_pool.hit_rate       hit / (hit + miss) (gauge)
+    rtp_pool.checkout       create_rtp_frontend time (histogram)
+    rtp_pool.recycled       frontends returned to pool on dispose (counter)
+    rtp_pool.idle           ready frontends in pool (gauge)
+"""
+
+__author__ = 'RCSLabs'
+
+
+from ..ledger import LEDGER
+from ..logging import LOG
+from ..metrics import METRICS
+from ._base import ITranscodingFactory, IRtpFrontend
+
+import collections
+import itertools
+import threading
+
+
+class _PooledRtpFrontend(IRtpFrontend):
+    """
+    wraps frontend of pool, anything but ports, ssrc/cname and stop() makes it dirty
+    """
+    def __init__(self, pool, key, frontend, owner):
+        self.__dict__["_pool"] = pool
+        self.__dict__["_key"] = key
+        self.__dict__["_frontend"] = frontend
+        self.__dict__["_owner"] = owner
+        self.__dict__["_pristine"] = True
+
+    @property
+    def rtp_port(self):
+        return self._frontend.rtp_port
+
+    @property
+    def rtcp_port(self):
+        return self._frontend.rtcp_port
+
+    @property
+    def packets_received(self):
+        return self._frontend.packets_received
+
+    @property
+    def ssrc_id(self):
+        return self._frontend.ssrc_id
+
+    @property
+    def cname(self):
+        return self._frontend.cname
+
+    @cname.setter
+    def cname(self, cname):
+        self._frontend.cname = cname
+
+    def stop(self):
+        self._frontend.stop()
+
+    def get_media_source(self):
+        self.__dict__["_pristine"] = False
+        return self._frontend.get_media_source()
+
+    def get_media_destination(self):
+        self.__dict__["_pristine"] = False
+        return self._frontend.get_media_destination()
+
+    def dispose(self):
+        frontend = self._frontend
+        assert frontend is not None
+        self.__dict__["_frontend"] = None
+        self._pool._release(self._key, frontend, self._owner, self._pristine)
+
+    def __getattr__(self, name):
+        self.__dict__["_pristine"] = False
+        return getattr(self._frontend, name)
+
+    def __setattr__(self, name, value):
+        if name == "cname":
+            object.__setattr__(self, name, value)
+        else:
+            self.__dict__["_pristine"] = False
+            setattr(self._frontend, name, value)
+
+
+class RtpFrontendPool(ITranscodingFactory):
+    def __init__(self, transcoding_factory, size, warm=()):
+        """
+        :param size: ready frontends kept per (media type, profile)
+        :param warm: (media type, profile) pairs to fill at start, others are added on first use
+        """
+        assert isinstance(transcoding_factory, ITranscodingFactory)
+        assert type(size) is int and size > 0
+        self.__factory = transcoding_factory
+        self.__size = size
+        self.__idle = collections.defaultdict(list)         # key -> [frontend]
+        self.__tokens = {}                                  # frontend -> ledger token
+        self.__counter = itertools.count(1)
+        self.__profiles = {}                                # key -> (media type, profile)
+        self.__condition = threading.Condition()
+        self.__stopped = False
+
+        self.__hit_counter = METRICS.counter("rtp_pool.hit")
+        self.__miss_counter = METRICS.counter("rtp_pool.miss")
+        self.__hit_rate_gauge = METRICS.gauge("rtp_pool.hit_rate")
+        self.__checkout_histogram = METRICS.histogram("rtp_pool.checkout")
+        self.__recycled_counter = METRICS.counter("rtp_pool.recycled")
+        self.__idle_gauge = METRICS.gauge("rtp_pool.idle")
+
+        for (media_type, profile) in warm:
+            self.__profiles[self.__key(media_type, profile)] = (media_type, profile)
+
+        self.__thread = threading.Thread(target=self.__refill, name="rtp-pool")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """
+        stop refilling and dispose idle frontends
+        """
+        with self.__condition:
+            self.__stopped = True
+            idle = [f for frontends in self.__idle.values() for f in frontends]
+            self.__idle.clear()
+            self.__idle_gauge.set(0)
+            self.__condition.notify()
+        self.__thread.join()
+        for frontend in idle:
+            self.__dispose(frontend)
+
+    #
+    # ITranscodingFactory
+    #
+    def create_rtp_frontend(self, media_type, profile, ports=None):
+        if ports is not None:
+            return self.__factory.create_rtp_frontend(media_type, profile, ports)
+        with self.__checkout_histogram.time():
+            key = self.__key(media_type, profile)
+            with self.__condition:
+                self.__profiles.setdefault(key, (media_type, profile))
+                frontends = self.__idle[key]
+                frontend = frontends.pop() if frontends else None
+                if frontend is not None:
+                    self.__idle_gauge.dec()
+                self.__condition.notify()
+            if frontend is not None:
+                self.__hit_counter.inc()
+            else:
+                self.__miss_counter.inc()
+                frontend = self.__create(media_type, profile)
+            hits = self.__hit_counter.value
+            self.__hit_rate_gauge.set(float(hits) / (hits + self.__miss_counter.value))
+            token = self.__tokens[frontend]
+            owner = token if LEDGER.current() is None else LEDGER.current() + "/" + token
+            LEDGER.transfer(token, owner)
+            return _PooledRtpFrontend(self, key, frontend, owner)
+
+    def create_socket(self, port, interface="0.0.0.0"):
+        return self.__factory.create_socket(port, interface)
+
+    def create_rtmp_frontend(self, media_type, profile):
+        return self.__factory.create_rtmp_frontend(media_type, profile)
+
+    def create_transcoding_context(self):
+        return self.__factory.create_transcoding_context()
+
+    def create_inband_dtmf_sender(self):
+        return self.__factory.create_inband_dtmf_sender()
+
+    def create_link(self, context, media_source, media_destination):
+        return self.__factory.create_link(context, media_source, media_destination)
+
+    def create_audio_mixer(self, context):
+        return self.__factory.create_audio_mixer(context)
+
+    def create_video_forwarder(self, context):
+        return self.__factory.create_video_forwarder(context)
+
+    def get_planner(self):
+        return self.__factory.get_planner()
+
+    def get_supported_codecs(self):
+        return self.__factory.get_supported_codecs()
+
+    #
+    # private
+    #
+    @staticmethod
+    def __key(media_type, profile):
+        return media_type, str(profile)
+
+    def __create(self, media_type, profile):
+        token = "rtp_pool-%d" % next(self.__counter)
+        with LEDGER.owner(token):
+            frontend = self.__factory.create_rtp_frontend(media_type, profile)
+        with self.__condition:
+            self.__tokens[frontend] = token
+        return frontend
+
+    def __dispose(self, frontend):
+        with self.__condition:
+            self.__tokens.pop(frontend, None)
+        frontend.dispose()
+
+    def _release(self, key, frontend, owner, pristine):
+        """
+        called on dispose of checked out frontend
+        """
+        if pristine:
+            LEDGER.transfer(owner, self.__tokens[frontend])
+        if pristine and self.__put(key, frontend):
+            self.__recycled_counter.inc()
+        else:
+            self.__dispose(frontend)
+
+    def __put(self, key, frontend):
+        with self.__condition:
+            if self.__stopped or len(self.__idle[key]) >= self.__size:
+                return False
+            self.__idle[key].append(frontend)
+            self.__idle_gauge.inc()
+            return True
+
+    def __missing(self):
+        """
+        :return: (key, media type, profile) of the first pool lacking frontends or None
+        """
+        for (key, (media_type, profile)) in self.__profiles.items():
+            if len(self.__idle[key]) < self.__size:
+                return key, media_type, profile
+        return None
+
+    def __refill(self):
+        while True:
+            with self.__condition:
+                missing = self.__missing()
+                while missing is None and not self.__stopped:
+                    self.__condition.wait()
+                    missing = self.__missing()
+                if self.__stopped:
+                    return
+            (key, media_type, profile) = missing
+            try:
+                frontend = self.__create(media_type, profile)
+            except Exception:
+                LOG.exception("RtpFrontendPool: could not create frontend for %s %s", media_type, profile)
+                with self.__condition:
+                    # do not retry until next checkout
+                    self.__profiles.pop(key, None)
+                continue
+            if not self.__put(key, frontend):
+                self.__dispose(frontend)
+
+
+if __name__ == "__main__":
+    import time
+    import unittest
+
+    class _Frontend(IRtpFrontend):
+        count = 0
+
+        def __init__(self):
+            _Frontend.count += 1
+            self.rtp_port, self.rtcp_port = 2 * _Frontend.count, 2 * _Frontend.count + 1
+            self.disposed = False
+
+        rtp_port = rtcp_port = None
+        packets_received = 0
+        ssrc_id = 1L
+        cname = ""
+
+        def stop(self):
+            pass
+
+        def get_media_source(self):
+            pass
+
+        def get_media_destination(self):
+            pass
+
+        def create_receiver(self, codecs):
+            pass
+
+        def dispose(self):
+            self.disposed = True
+
+    class _Factory(ITranscodingFactory):
+        def create_rtp_frontend(self, media_type, profile, ports=None):
+            return _Frontend()
+
+        create_socket = create_rtmp_frontend = create_transcoding_context = None
+        create_inband_dtmf_sender = create_link = create_audio_mixer = create_video_forwarder = None
+        get_planner = get_supported_codecs = None
+
+    class RtpFrontendPoolTest(unittest.TestCase):
+        def wait_idle(self, pool, n):
+            deadline = time.time() + 1
+            while len(pool._RtpFrontendPool__idle[("audio", "p")]) < n and time.time() < deadline:
+                time.sleep(0.01)
+
+        def test_checkout_and_recycle(self):
+            pool = RtpFrontendPool(_Factory(), 2, warm=[("audio", "p")])
+            self.wait_idle(pool, 2)
+            hits = pool._RtpFrontendPool__hit_counter.value
+
+            first = pool.create_rtp_frontend("audio", "p")
+            self.assertEqual(pool._RtpFrontendPool__hit_counter.value, hits + 1)
+            inner = first._frontend
+            first.cname = "x"
+            first.rtp_port
+            first.stop()
+            first.dispose()                                 # pristine: back to pool, unless refilled already
+            self.wait_idle(pool, 2)
+            idle = pool._RtpFrontendPool__idle[("audio", "p")]
+            self.assertEqual(len(idle), 2)
+            self.assertEqual(inner.disposed, inner not in idle)
+
+            second = pool.create_rtp_frontend("audio", "p")
+            second.create_receiver([])
+            inner = second._frontend
+            second.dispose()                                # used: destroyed
+            self.assertTrue(inner.disposed)
+            pool.stop()
+            self.assertTrue(all(f.disposed for f in idle))
+
+    unittest.main()
@@ -1,28 +1,59 @@
 #!/usr/bin/env python
 """
 Open two ports from profile
+
+pairs are taken from profile.allocator and given back on close,
+pair busy in OS is returned as busy and the next one is tried,
+pair given explicitly (ports of point restored after restart) is the only one tried
 """
 
 
 from ..logging import LOG
 from ..config.profile import Profile
+from ..ledger import LEDGER, KIND
 from ._base import ITranscodingFactory
-from ._socket import ISocket, SocketError
+from ._socket import ISocket, SocketError, PortNotFound
 
 
 class RtpSocketPair(object):
-    def __init__(self, profile, transcoding_factory):
+    def __init__(self, profile, transcoding_factory, pair=None):
+        """
+        raises: SocketError if given pair can not be opened, PortNotFound if no pair of profile can
+        """
         assert type(profile) is Profile
         assert isinstance(transcoding_factory, ITranscodingFactory)
         self.__transcoding_factory = transcoding_factory
+        self.__allocator = profile.allocator
+        self.__pair = None
         self._rtp_socket = None
         self._rtcp_socket = None
 
-        for (rtp_port, rtcp_port) in profile.ports_range:
-            if self._try_open(rtp_port, rtcp_port, profile.interface):
-                return
-
-        # TODO: raise PortNotFound
+        if pair is not None:
+            if self.__allocator.allocate(pair) is None:
+                raise SocketError("Ports %s are in use" % (pair,))
+            if not self._try_open(pair[0], pair[1], profile.interface):
+                self.__allocator.release(pair, busy=True)
+                raise SocketError("Ports %s are busy" % (pair,))
+            self.__pair = tuple(pair)
+            return
+
+        busy = []
+        while True:
+            pair = self.__allocator.allocate()
+            if pair is None:
+                break
+            if self._try_open(pair[0], pair[1], profile.interface):
+                self.__pair = pair
+                break
+            busy.append(pair)
+
+        # busy pairs are given back after the search, so each is tried once
+        for pair in busy:
+            self.__allocator.release(pair, busy=True)
+
+        if self.__pair is None:
+            LOG.warning("RtpSocketPair: no free ports in %s (%d busy)", profile.ports_range, len(busy))
+            raise PortNotFound("No free ports in %s" % profile.ports_range)
 
     def _try_open(self, rtp_port, rtcp_port, interface="0.0.0.0"):
         try:
@@ -30,6 +61,8 @@ class RtpSocketPair(object):
             self._rtcp_socket = self.__transcoding_factory.create_socket(rtcp_port, interface)
             assert isinstance(self._rtp_socket, ISocket)
             assert isinstance(self._rtcp_socket, ISocket)
+            LEDGER.acquire(KIND.SOCKET, self._rtp_socket)
+            LEDGER.acquire(KIND.SOCKET, self._rtcp_socket)
             LOG.debug("RtpSocketPair.Succeeded %d, %d", rtp_port, rtcp_port)
             return True
 
@@ -54,6 +87,11 @@ class RtpSocketPair(object):
         return self._rtcp_socket.port
 
     def close(self):
+        if self.__pair is not None:
+            self.__allocator.release(self.__pair)
+            self.__pair = None
+        LEDGER.release(KIND.SOCKET, self._rtp_socket)
+        LEDGER.release(KIND.SOCKET, self._rtcp_socket)
         if self._rtp_socket:
             self._rtp_socket.close()
             self._rtp_socket = None
@@ -66,4 +104,51 @@ class RtpSocketPair(object):
 
 
 if __name__ == "__main__":
-    pass
+    import unittest
+
+    class _Socket(object):
+        def __init__(self, port, interface):
+            self.port = port
+
+        def close(self):
+            pass
+
+    ISocket.register(_Socket)
+
+    class _TranscodingFactory(object):
+        def __init__(self, busy=()):
+            self.busy = set(busy)
+
+        def create_socket(self, port, interface):
+            if port in self.busy:
+                raise SocketError("Port %d is busy" % port)
+            return _Socket(port, interface)
+
+    ITranscodingFactory.register(_TranscodingFactory)
+
+    class RtpSocketPairTest(unittest.TestCase):
+        def setUp(self):
+            self.profile = Profile("127.0.0.1:41000-41004 (127.0.0.1)")
+            self.allocator = self.profile.allocator
+
+        def test_ports_exhausted(self):
+            pairs = [RtpSocketPair(self.profile, _TranscodingFactory()) for _ in range(len(self.allocator))]
+            self.assertEqual(sorted(pair.rtp_port for pair in pairs), [41000, 41002])
+            self.assertRaises(PortNotFound, RtpSocketPair, self.profile, _TranscodingFactory())
+            pairs[0].close()
+            self.assertTrue(RtpSocketPair(self.profile, _TranscodingFactory()))
+
+        def test_all_busy(self):
+            factory = _TranscodingFactory(busy=range(41000, 41004))
+            self.assertRaises(PortNotFound, RtpSocketPair, self.profile, factory)
+            # busy pairs are given back
+            self.assertEqual(self.allocator.used, 0)
+
+        def test_given_pair(self):
+            pair = RtpSocketPair(self.profile, _TranscodingFactory(), pair=(41002, 41003))
+            self.assertEqual((pair.rtp_port, pair.rtcp_port), (41002, 41003))
+            self.assertRaises(SocketError, RtpSocketPair, self.profile, _TranscodingFactory(), (41002, 41003))
+            pair.close()
+            self.assertEqual(self.allocator.used, 0)
+
+    unittest.main()
@@ -3,6 +3,8 @@
 
 import threading
 from subprocess import Popen, PIPE
+import fcntl
+import os
 import re
 from abc import ABCMeta, abstractmethod
 
@@ -21,19 +23,46 @@ class Agent(threading.Thread):
             line = self.pipe.stdout.readline()
             if not line:
                 break
+            self.__on_line(line)
 
-            g = re.findall(r"(\w+)=(\S+)", line)
-            #print "RECEIVED FROM", self.name, ":", g
-            msg = {}
-            for pair in g:
-                name = pair[0]
-                value = pair[1]
-                msg[name] = value
+        print self.name, " closed"
 
-            if "type" in msg:
-                self.on_message(msg, None)
+    def attach(self, loop):
+        """
+        read agent stdout on event loop instead of running the thread
+        """
+        fd = self.pipe.stdout.fileno()
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        state = dict(buffer="", source_id=None)
 
-        print self.name, " closed"
+        def on_readable():
+            try:
+                data = os.read(fd, 4096)
+            except OSError:
+                return
+            if not data:
+                loop.remove_reader(state["source_id"])
+                print self.name, " closed"
+                return
+            lines = (state["buffer"] + data).split("\n")
+            state["buffer"] = lines.pop()
+            for line in lines:
+                self.__on_line(line)
+
+        state["source_id"] = loop.add_reader(fd, on_readable)
+
+    def __on_line(self, line):
+        g = re.findall(r"(\w+)=(\S+)", line)
+        #print "RECEIVED FROM", self.name, ":", g
+        msg = {}
+        for pair in g:
+            name = pair[0]
+            value = pair[1]
+            msg[name] = value
+
+        if "type" in msg:
+            self.on_message(msg, None)
 
     def send_message(self, message):
         s = []
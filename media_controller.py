@@ -5,10 +5,41 @@ Main media controller executable
 preferred way to run is to execute command
 # python -m media_controller
 
+messages are handled on a3.executor.ShardedExecutor workers (option "workers"),
+keyed by pointId: messages of one point are handled in order,
+different points are handled in parallel, bulk message is handled in order with the messages
+of all its points (it waits for their workers and holds them meanwhile)
+
+received messages wait in a3.messaging.InboundQueue (options "inbound-queue-*"),
+REMOVE/UNJOIN are handled before CREATE/JOIN, but never before messages of the same points queued earlier
+(bulk messages are keyed by pointIds of their items), CREATE is rejected when overloaded
+
+with "rtp-pool-size" rtp frontends (ports and gstreamer bins) are created ahead in a3.transcoding.pool
+
+metrics (point transition timings, queues, executor) are logged every "metrics-interval" seconds
+
+new points and joins are admitted within "cpu-budget" (a3.point.admission),
+GET_LOAD is answered with the accounting for dispatchers
+
+DRAIN message (or SIGTERM) takes controller out of rotation: CREATE_MEDIA_POINT is rejected,
+shared queues are left, existing points finish their calls, controller exits when no points
+are left or after "drain-timeout" seconds (remaining points are removed)
+
+with "journal" point state is written to a file on every transition (a3.point.journal),
+restarted controller rebuilds rtp points of the journal on the same ports and rejoins their rooms
+
+CREATE_MEDIA_POINTS, REMOVE_MEDIA_POINTS and JOIN_ROOMS carry requests of many points in "points"
+(fields common to all of them, e.g. roomId, may be set on the bulk message), they are handled as one task
+grouped by room (a3.point.manager) and answered with one reply listing the first reply of every point
+(a3.messaging.batch), SDP_OFFER of created points and REMOVE_MEDIA_POINT_OK of removed points included
+
+points stuck in CREATING_OFFER/WAITING_REMOTE_SDP, or connected without rtp, longer than "ttl-*" options
+are removed on their worker with reason "expired" (a3.point.point_controller.TTL_OPTIONS)
 
 """
 
 
+import signal
 import time
 
 from a3 import messaging
@@ -16,8 +47,17 @@ from netpoint.balancer import Balancer
 from a3.point.point_controller import PointController, PointControllerError, Event as PointEvent
 from a3.logging import LOG
 from a3.transcoding._base import ITranscodingFactory
+from a3.transcoding.pool import RtpFrontendPool
+from a3.media import MediaType
 from a3.config import IConfig
 from a3.point.manager import Manager, ManagerError
+from a3.point.admission import AdmissionError
+from a3.point.journal import Journal
+from a3.point.point_controller import State as PointState
+from a3.sdp.capabilities import Vv
+from a3.executor import ShardedExecutor
+from a3.metrics import METRICS
+from a3 import timer
 
 
 class MessageType:
@@ -32,22 +72,108 @@ class MessageType:
     CRITICAL_ERROR = "CRITICAL_ERROR"
 
     JOIN_ROOM = "JOIN_ROOM"
+    JOIN_ROOM_FAILED = "JOIN_ROOM_FAILED"
     UNJOIN_ROOM = "UNJOIN_ROOM"
     SDP_OFFER = "SDP_OFFER"
     SDP_ANSWER = "SDP_ANSWER"
 
     SEND_DTMF = "SEND_DTMF"
 
+    GET_LOAD = "GET_LOAD"
+    GET_LOAD_OK = "GET_LOAD_OK"
+
+    DRAIN = "DRAIN"
+    DRAIN_OK = "DRAIN_OK"
+
+    CREATE_POINTS = "CREATE_MEDIA_POINTS"
+    CREATE_POINTS_OK = "CREATE_MEDIA_POINTS_OK"
+    REMOVE_POINTS = "REMOVE_MEDIA_POINTS"
+    REMOVE_POINTS_OK = "REMOVE_MEDIA_POINTS_OK"
+    JOIN_ROOMS = "JOIN_ROOMS"
+    JOIN_ROOMS_OK = "JOIN_ROOMS_OK"
+
+
+# bulk message type -> (type of its items, type of aggregated reply)
+BULK_TYPES = {
+    MessageType.CREATE_POINTS: (MessageType.CREATE_POINT, MessageType.CREATE_POINTS_OK),
+    MessageType.REMOVE_POINTS: (MessageType.REMOVE_POINT, MessageType.REMOVE_POINTS_OK),
+    MessageType.JOIN_ROOMS: (MessageType.JOIN_ROOM, MessageType.JOIN_ROOMS_OK),
+}
+
+
+# inbound queue priorities, lower is handled first
+PRIORITIES = {
+    MessageType.REMOVE_POINT: 0,
+    MessageType.UNJOIN_ROOM: 0,
+    MessageType.SDP_ANSWER: 1,
+    MessageType.SEND_DTMF: 1,
+    MessageType.GET_LOAD: 1,
+    MessageType.DRAIN: 0,
+    MessageType.CREATE_POINT: 2,
+    MessageType.JOIN_ROOM: 2,
+    MessageType.REMOVE_POINTS: 0,
+    MessageType.CREATE_POINTS: 2,
+    MessageType.JOIN_ROOMS: 2,
+}
+
+# executor worker queues are kept short, so backlog stays in the priority queue
+WORKER_QUEUE_SIZE = 4
+
+# seconds between drain progress checks
+DRAIN_CHECK_INTERVAL = 1.0
+DRAIN_RETRY_INTERVAL = 10.0
+
+# "reason" of CREATE_MEDIA_POINT_FAILED while draining
+DRAINING_REASON = "draining"
+
+# "reason" of replies for journal points not restored after restart
+RESTART_REASON = "restarted"
+
+# seconds before reap of expired point is submitted again when its worker is busy
+REAP_RETRY_INTERVAL = 1.0
+
+# executor label of removing expired points
+REAP_LABEL = "REAP"
+
+# journal points in these states are rebuilt on restart
+RESTORED_STATES = (PointState.WAITING_REMOTE_SDP, PointState.CONNECTED)
+
 
 class MediaController(messaging.IMessageListener):
 
     def __init__(self, config, transcoding_factory):
         assert isinstance(config, IConfig)
         assert isinstance(transcoding_factory, ITranscodingFactory)
-        self.__manager = Manager(config, transcoding_factory)
+        pool_size = config.int_option("rtp-pool-size")
+        if pool_size:
+            warm = [(media_type, config.profile(name))
+                    for name in config.profiles for media_type in (MediaType.AUDIO, MediaType.VIDEO)]
+            transcoding_factory = RtpFrontendPool(transcoding_factory, pool_size, warm)
+        self.__journal = Journal(config.option("journal")) if config.option("journal") else None
+        self.__manager = Manager(config, transcoding_factory, self.__journal, reap=self.__reap)
         self.__balancer = Balancer()
         self.__config = config
         self.__transcoding_factory = transcoding_factory
+        self.__executor = ShardedExecutor(config.int_option("workers"), "mc.executor", WORKER_QUEUE_SIZE)
+        self.__handlers = {
+            MessageType.CREATE_POINT: self.__on_message_create_point,
+            MessageType.REMOVE_POINT: self.__on_message_remove_point,
+            MessageType.JOIN_ROOM: self.__on_message_join,
+            MessageType.UNJOIN_ROOM: self.__on_message_unjoin,
+            MessageType.SDP_ANSWER: self.set_remote_sdp,
+            MessageType.SEND_DTMF: self.__send_dtmf,
+            MessageType.GET_LOAD: self.__on_message_get_load,
+            MessageType.DRAIN: self.__on_message_drain,
+            MessageType.CREATE_POINTS: self.__on_message_create_points,
+            MessageType.REMOVE_POINTS: self.__on_message_remove_points,
+            MessageType.JOIN_ROOMS: self.__on_message_join_rooms,
+        }
+        self.__drain_deadline = None
+        self.__drained = False
+        self.__manager.timer_wheel.call_periodic(DRAIN_CHECK_INTERVAL, self.__check_drain)
+        metrics_interval = config.float_option("metrics-interval")
+        if metrics_interval > 0:
+            self.__manager.timer_wheel.call_periodic(metrics_interval, self.__log_metrics)
 
     def __get_point_by_id(self, point_id):
         return self.__manager.get_point(point_id)
@@ -58,6 +184,142 @@ class MediaController(messaging.IMessageListener):
     def on_timer(self):
         self.__manager.on_timer()
 
+    def __log_metrics(self):
+        LOG.info("Metrics:\n%s", METRICS)
+
+    @property
+    def draining(self):
+        return self.__drain_deadline is not None
+
+    @property
+    def drained(self):
+        """
+        True when drain is over and the process may exit
+        """
+        return self.__drained
+
+    def drain(self, transport=None):
+        """
+        stop accepting new points and leave shared queues of transport,
+        only sets state, so it may be called from signal handler
+        """
+        if self.draining:
+            return
+        timeout = self.__config.float_option("drain-timeout")
+        LOG.info("MC: draining, deadline in %d sec", timeout)
+        self.__drain_deadline = time.time() + timeout
+        if transport is not None:
+            transport.unsubscribe()
+
+    def restore(self, transport):
+        """
+        rebuild points of journal after restart, replies go through transport,
+        call before transport listens
+        """
+        if self.__journal is None:
+            return
+        records = self.__journal.points()
+        if not records:
+            return
+        start = time.time()
+        restored = len([record for record in records if self.__restore_point(record, transport)])
+        elapsed = time.time() - start
+        METRICS.gauge("journal.restore_per_1000").set(elapsed * 1000 / len(records))
+        LOG.info("MC: restored %d of %d points in %.3f sec (%.3f sec per 1000 points)",
+                 restored, len(records), elapsed, elapsed * 1000 / len(records))
+
+    def __restore_point(self, record, transport):
+        """
+        rtp points are rebuilt, others (srtp needs stun-agent state, rtmp, not offered yet) are dropped
+        :return: True if point is restored
+        """
+        point_id = str(record["id"])
+        fields = dict((str(name), value) for (name, value) in record["message"].items())
+        message = messaging.Message(str(fields.pop("type")), fields)
+        message.transport = transport
+
+        local_sdp = record.get("local_sdp")
+        ports = dict((MediaType.from_string(str(media_type)), tuple(pair))
+                     for (media_type, pair) in record.get("ports", {}).items())
+        if record["state"] not in RESTORED_STATES or record.get("conns") or \
+                len(ports) != len([line for line in local_sdp.splitlines() if line.startswith("m=")]):
+            self.__drop_restored_point(record, message)
+            return False
+
+        try:
+            point = self.__manager.create_point(media_types=ports.keys(),
+                                                point_id=point_id,
+                                                initiator_message=message,
+                                                config=self.__config,
+                                                balancer=self.__balancer,
+                                                transcoding_factory=self.__transcoding_factory)
+            remote_sdp = record.get("remote_sdp")
+            point.event(PointEvent.RESTORE,
+                        local_sdp=str(local_sdp),
+                        remote_sdp=str(remote_sdp) if remote_sdp is not None else None,
+                        profile=self.__config.profile(str(fields.get("profile", ""))),
+                        ports=ports)
+            if record.get("room") is not None:
+                self.__manager.join_room(point_id, str(record["room"]))
+            return True
+        except Exception:
+            LOG.exception("MC: point [%s] is not restored", point_id)
+            if self.__manager.get_point(point_id) is not None:
+                self.__manager.remove_point(point_id)
+            self.__drop_restored_point(record, message)
+            return False
+
+    def __drop_restored_point(self, record, message):
+        """
+        stun-agent conns of dropped srtp point were closed with the agent process, only initiator is told
+        """
+        LOG.info("MC: dropping point [%s] of journal in state %s", record["id"], record["state"])
+        if record["state"] in (PointState.START, PointState.CREATING_OFFER):
+            message.reply(MessageType.CREATE_POINT_FAILED, {"reason": RESTART_REASON})
+        else:
+            message.reply(MessageType.REMOVE_POINT_OK, {"reason": RESTART_REASON})
+        self.__journal.remove(str(record["id"]))
+
+    def __reap(self, point_id, state):
+        """
+        expired point is removed on its worker, after messages of the point queued before;
+        with workers=0 it is removed right on timer thread, concurrently with messages;
+        timer thread never waits for a busy worker, reap is retried later instead
+        """
+        if not self.__executor.try_submit(point_id, REAP_LABEL, self.__manager.reap_point, point_id, state):
+            self.__manager.timer_wheel.call_later(REAP_RETRY_INTERVAL, self.__reap, point_id, state)
+
+    def __check_drain(self):
+        if not self.draining or self.__drained:
+            return
+        point_ids = self.__manager.get_point_ids()
+        load = self.__manager.load()
+        if not point_ids:
+            LOG.info("MC: drained")
+            self.__drained = True
+        elif time.time() >= self.__drain_deadline:
+            LOG.warning("MC: drain deadline passed, removing %d points", len(point_ids))
+            for point_id in point_ids:
+                self.__executor.try_submit(point_id, MessageType.DRAIN, self.__remove_point_by_id, point_id)
+            # points failing to be removed (or not submitted to busy workers) are retried
+            self.__drain_deadline = time.time() + DRAIN_RETRY_INTERVAL
+        else:
+            LOG.info("MC: draining, %d points in %d rooms left", load["points"], load["rooms"])
+
+    def create_inbound_queue(self):
+        """
+        return InboundQueue to put between transport and this controller
+        """
+        reason = self.__config.option("overload-reason")
+        return messaging.InboundQueue(self,
+                                      size=self.__config.int_option("inbound-queue-size"),
+                                      high_watermark=self.__config.int_option("inbound-queue-watermark"),
+                                      priority=lambda message: PRIORITIES.get(message.type, 1),
+                                      keys=messaging.point_ids,
+                                      shed=lambda message: message.type in (MessageType.CREATE_POINT,
+                                                                            MessageType.CREATE_POINTS),
+                                      overload=lambda message: self.__fail_create(message, reason))
+
     #
     #
     #  Message dispatcher
@@ -68,33 +330,75 @@ class MediaController(messaging.IMessageListener):
         received message from bus
         :param message: message object
         """
-        assert type(message) is messaging.Message
+        assert isinstance(message, messaging.Message)
         message_type = message.type
 
-        if message_type == MessageType.CREATE_POINT:
-            self.__on_message_create_point(message)
-
-        elif message_type == MessageType.REMOVE_POINT:
-            self.__on_message_remove_point(message)
-
-        elif message_type == MessageType.JOIN_ROOM:
-            self.__on_message_join(message)
-
-        elif message_type == MessageType.UNJOIN_ROOM:
-            self.__on_message_unjoin(message)
-
-        elif message_type == MessageType.SDP_ANSWER:
-            self.set_remote_sdp(message)
-
-        elif message_type == MessageType.SEND_DTMF:
-            self.__send_dtmf(message)
+        handler = self.__handlers.get(message_type)
+        if handler is None:
+            LOG.warning("Unknown message type: %s", repr(message_type))
+            return
 
+        point_ids = messaging.point_ids(message)
+        if point_ids:
+            # bulk message runs in order with messages of each of its points
+            self.__executor.submit_all(point_ids, message_type, handler, message)
+        elif message.has("roomId"):
+            self.__executor.submit("room:" + message.room_id, message_type, handler, message)
         else:
-            LOG.warning("Unknown message type: %s", repr(message_type))
+            self.__executor.submit(message_type, message_type, handler, message)
+
+    @staticmethod
+    def __reject(message, reply_type, error):
+        assert type(error) is AdmissionError
+        LOG.warning("Rejected %s [%s]: %s", message.type, message.get("pointId"), error)
+        data = {"reason": str(error)}
+        if error.redirect:
+            data["redirect"] = error.redirect
+        message.reply(reply_type, data)
+
+    @staticmethod
+    def __batch(message):
+        (item_type, reply_type) = BULK_TYPES[message.type]
+        return messaging.Batch(message, item_type, reply_type)
+
+    def __fail_create(self, message, reason):
+        """
+        reply CREATE_MEDIA_POINT_FAILED to single or bulk create
+        """
+        if message.type == MessageType.CREATE_POINTS:
+            for item in self.__batch(message).items:
+                item.reply(MessageType.CREATE_POINT_FAILED, {"reason": reason})
+        else:
+            message.reply(MessageType.CREATE_POINT_FAILED, {"reason": reason})
 
     def __on_message_create_point(self, message):
+        error = self.__create_point(message)
+        if error is not None:
+            LOG.warning(error)
+
+    def __on_message_create_points(self, message):
+        for item in self.__batch(message).items:
+            try:
+                error = self.__create_point(item)
+            except Exception as e:
+                # failed item must not keep the aggregated reply from being sent
+                LOG.exception("MC: point [%s] of %s is not created", item.get("pointId"), message.type)
+                error = "%s: %s" % (type(e).__name__, e) if str(e) else type(e).__name__
+            if error is not None:
+                LOG.warning(error)
+                item.reply(MessageType.CREATE_POINT_FAILED, {"reason": error})
+
+    def __create_point(self, message):
+        """
+        :return: error if point is not created and nothing is replied
+        """
+        if self.draining:
+            message.reply(MessageType.CREATE_POINT_FAILED, {"reason": DRAINING_REASON})
+            return None
+        media_types = Vv(message.get("vv")).media_types if message.has("vv") else ()
         try:
-            point = self.__manager.create_point(point_id=str(message.point_id),
+            point = self.__manager.create_point(media_types=media_types,
+                                                point_id=str(message.point_id),
                                                 initiator_message=message,
                                                 config=self.__config,
                                                 balancer=self.__balancer,
@@ -103,19 +407,30 @@ class MediaController(messaging.IMessageListener):
             if message.has("cc") and message.has("vv"):
                 profile_name = message.get("profile", "")
                 profile = self.__config.profile(profile_name)
-                assert profile is not None
                 try:
+                    assert profile is not None
                     point.event(PointEvent.CREATE_OFFER,
                                 cc=message.get("cc"),
                                 vv=message.get("vv"),
                                 profile=profile)
                 except PointControllerError:
                     self.__remove_point(point)
+                except Exception:
+                    self.__remove_point(point)
+                    raise
             else:
-                LOG.warning("No cc or vv in initiator message")
                 LOG.warning("Answer model not implemented")
+                return "No cc or vv in initiator message"
+        except AdmissionError as e:
+            self.__reject(message, MessageType.CREATE_POINT_FAILED, e)
         except ManagerError as e:
-            LOG.warning(str(e))
+            return str(e)
+        return None
+
+    def __on_message_drain(self, message):
+        self.drain(message.transport)
+        load = self.__manager.load()
+        message.reply(MessageType.DRAIN_OK, {"points": load["points"], "rooms": load["rooms"]})
 
     def __remove_point(self, point):
         assert type(point) is PointController
@@ -126,8 +441,22 @@ class MediaController(messaging.IMessageListener):
             LOG.warning(str(e))
 
     def __on_message_remove_point(self, message):
+        self.__remove_point_by_id(str(message.point_id))
+
+    def __on_message_remove_points(self, message):
+        items = self.__batch(message).items
+        errors = self.__manager.remove_points([item.point_id for item in items],
+                                              dict((item.point_id, item) for item in items))
+        for item in items:
+            error = errors.get(item.point_id)
+            if error is not None:
+                LOG.warning(str(error))
+                item.reply(MessageType.REMOVE_POINT_FAILED, {"reason": str(error)})
+            item.done()
+
+    def __remove_point_by_id(self, point_id):
         try:
-            self.__manager.remove_point(str(message.point_id))
+            self.__manager.remove_point(point_id)
         except ManagerError as e:
             LOG.warning(str(e))
 
@@ -135,22 +464,33 @@ class MediaController(messaging.IMessageListener):
         self.__manager.remove_room(room.room_id)
 
     def set_remote_sdp(self, message):
-        point_id = str(message.point_id)
-        point = self.__get_point_by_id(point_id)
-
-        if point is not None:
-            point.event(PointEvent.SDP_ANSWER, sdp=str(message.get("sdp", "")))
-        else:
-            LOG.warning("Unknown point " + str(point_id))
+        try:
+            self.__manager.set_remote_sdp(str(message.point_id), str(message.get("sdp", "")))
+        except ManagerError as e:
+            LOG.warning(str(e))
 
     def __on_message_join(self, message):
         try:
             point_id = str(message.point_id)
             room_id = str(message.room_id)
             self.__manager.join_room(point_id, room_id)
+        except AdmissionError as e:
+            self.__reject(message, MessageType.JOIN_ROOM_FAILED, e)
         except ManagerError as e:
             LOG.warning(str(e))
 
+    def __on_message_join_rooms(self, message):
+        items = self.__batch(message).items
+        errors = self.__manager.join_rooms([(item.point_id, item.room_id) for item in items])
+        for item in items:
+            error = errors.get(item.point_id)
+            if isinstance(error, AdmissionError):
+                self.__reject(item, MessageType.JOIN_ROOM_FAILED, error)
+            elif error is not None:
+                LOG.warning(str(error))
+                item.reply(MessageType.JOIN_ROOM_FAILED, {"reason": str(error)})
+            item.done()
+
     def __on_message_unjoin(self, message):
         try:
             point_id = str(message.point_id)
@@ -158,13 +498,18 @@ class MediaController(messaging.IMessageListener):
         except ManagerError as e:
             LOG.warning(str(e))
 
+    def __on_message_get_load(self, message):
+        load = self.__manager.load()
+        load["draining"] = self.draining
+        message.reply(MessageType.GET_LOAD_OK, load)
+
     def __send_dtmf(self, message):
         point_id = str(message.point_id)
         point = self.__get_point_by_id(point_id)
         if point is None:
             LOG.warning("Attempt to unjoin with unexisting point")
             return
-        point.event("SEND_DTMF", dtmf=str(message.get("dtmf", "")))
+        point.event(PointEvent.SEND_DTMF, dtmf=str(message.get("dtmf", "")))
 
 if __name__ == "__main__":
     from a3.config import CommandLineConfig, IniConfig, DefaultConfig
@@ -177,9 +522,33 @@ if __name__ == "__main__":
     transcoding_factory = Gst1TranscodingFactory()
 
     media_controller = MediaController(config, transcoding_factory)
-
-    messaging.create(config.mq, media_controller).listen()
-
-    while True:
-        time.sleep(1)
-        media_controller.on_timer()
+    recorder = messaging.recorder.Recorder(config.option("record")) if config.option("record") else None
+
+    if config.option("event-loop") == "glib":
+        from a3.eventloop import EventLoop
+        loop = EventLoop()
+        Balancer().set_event_loop(loop)
+        mq = messaging.create(config.mq, media_controller.create_inbound_queue(), loop=loop, recorder=recorder)
+        signal.signal(signal.SIGTERM, lambda signum, frame: media_controller.drain(mq))
+        media_controller.restore(mq)
+        mq.listen()
+
+        def on_tick():
+            media_controller.on_timer()
+            if media_controller.drained:
+                loop.stop()
+        loop.call_periodic(timer.TICK, on_tick)
+        loop.run()
+
+    else:
+        mq = messaging.create(config.mq, media_controller.create_inbound_queue(), recorder=recorder)
+        signal.signal(signal.SIGTERM, lambda signum, frame: media_controller.drain(mq))
+        media_controller.restore(mq)
+        mq.listen()
+
+        while not media_controller.drained:
+            time.sleep(timer.TICK)
+            media_controller.on_timer()
+
+    # replies to the last removals
+    mq.flush()
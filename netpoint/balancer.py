@@ -26,6 +26,11 @@ class Balancer(object):
 
     def __init__(self):
         self.rtp_agents = []
+        self.__loop = None
+
+    def set_event_loop(self, loop):
+        """ agents started after this call are read on the loop instead of own threads """
+        self.__loop = loop
 
     def get_rtp_agent(self):
         """ returns stun agent"""
@@ -34,6 +39,9 @@ class Balancer(object):
                 return agent
 
         agent = RtpPointAgent("127.0.0.1")
-        agent.start()
+        if self.__loop is not None:
+            agent.attach(self.__loop)
+        else:
+            agent.start()
         self.rtp_agents.append(agent)
         return agent
@@ -73,7 +73,7 @@ class RtpPointAgent(Agent):
         self.__conns.append(request_id)
         self.send_message({"type":      "OPEN_CONN",
                            "iface":     profile.interface,
-                           "port":      "%d-%d" % (profile.ports_range.start, profile.ports_range.end),
+                           "port":      ",".join("%d-%d" % (r.start, r.end) for r in profile.ports_range.ranges),
                            "requestId": request_id})
 
     def close_conn(self, conn):
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+"""
+Replay recorded bus traffic into MediaController without message queue server
+
+execute:
+    # python replay.py <recording> [--speed=<n>] [--drain=<sec>] [--batch=<n>] [media controller options...]
+
+recording - JSON lines written by media controller with --record=<file> (see a3.messaging.recorder)
+speed - replay speed-up, 0 - as fast as possible (default 1)
+drain - seconds to wait for late replies (e.g. SDP_OFFER after stun) after the last message (default 2)
+batch - up to n consecutive CREATE_MEDIA_POINT, REMOVE_MEDIA_POINT or JOIN_ROOM messages of one sender
+        are sent as one bulk message (CREATE_MEDIA_POINTS etc.), to compare bulk handling with n singles
+        (default 1, no bulk messages)
+
+Received ("in") messages of the recording are passed to MediaController.on_message
+with recorded intervals divided by speed, replies are caught on a3.messaging LoopbackBus.
+Inbound queue is not used. Run with workers=0 (default): messages are handled inline,
+with workers > 0 on_message only submits them (handling time is mc.executor.handle.<type> then).
+
+Results are printed as metrics:
+    replay.handle.<type>    on_message time per message type (handling time with workers=0)
+    replay.reply.<type>     time from the last message of the point to reply, per reply type
+                            (per point result type for replies of bulk messages)
+and controller own metrics (mc.executor.* etc.)
+"""
+
+__author__ = 'RCSLabs'
+
+
+import json
+import sys
+import threading
+import time
+
+from a3 import messaging
+from a3.config import CommandLineConfig, IniConfig, DefaultConfig
+from a3.logging import LOG
+from a3.metrics import METRICS
+from a3.timer import TICK
+from a3.messaging.recorder import read_records
+from a3.messaging.serdes import JsonSerDes
+from a3.messaging.serdes_transport import SerDesTransport
+from a3.messaging.transport import LoopbackTransport, LoopbackBus
+from media_controller import MediaController, BULK_TYPES
+
+
+# single message type -> bulk message type
+BULK_OF = dict((item_type, bulk_type) for (bulk_type, (item_type, _)) in BULK_TYPES.items())
+
+
+def parse_arguments(argv):
+    """
+    take replay arguments out of argv, the rest is left for CommandLineConfig
+    :return: (recording, speed, drain, batch)
+    """
+    recording, speed, drain, batch = None, 1.0, 2.0, 1
+    for arg in list(argv[1:]):
+        if arg.startswith("--speed="):
+            speed = float(arg[len("--speed="):])
+        elif arg.startswith("--drain="):
+            drain = float(arg[len("--drain="):])
+        elif arg.startswith("--batch="):
+            batch = int(arg[len("--batch="):])
+        elif not arg.startswith("--") and recording is None:
+            recording = arg
+        else:
+            continue
+        argv.remove(arg)
+    return recording, speed, drain, batch
+
+
+def bulk_records(records, size):
+    """
+    join up to size consecutive records of the same bulk-able type and sender into bulk messages
+    """
+    result = []
+    for record in records:
+        message = record["message"]
+        bulk_type = BULK_OF.get(message["type"])
+        if bulk_type is None:
+            result.append(record)
+            continue
+        item = dict((name, value) for (name, value) in message.items() if name not in ("type", "sender"))
+        last = result[-1]["message"] if result else None
+        if last is not None and last["type"] == bulk_type and last.get("sender") == message.get("sender") \
+                and len(last["points"]) < size:
+            last["points"].append(item)
+        else:
+            bulk = {"type": bulk_type, "points": [item]}
+            if "sender" in message:
+                bulk["sender"] = message["sender"]
+            result.append(dict(record, message=bulk))
+    return result
+
+
+class Replay(object):
+    def __init__(self, media_controller, channel):
+        self.__media_controller = media_controller
+        self.__bus = LoopbackBus()
+        self.__bus.sink = self.__on_reply
+        self.__serdes = JsonSerDes(messaging.message.Factory())
+        self.__transport = SerDesTransport(LoopbackTransport(channel, self.__bus), self.__serdes)
+        self.__last_message_time = {}
+        self.__histograms = {}
+        self.__messages = 0
+        self.__replies = 0
+
+    def run(self, records, speed, batch=1):
+        records = [r for r in records if r["dir"] == "in"]
+        if batch > 1:
+            records = bulk_records(records, batch)
+        if not records:
+            return
+        start = time.time()
+        first = records[0]["t"]
+        for record in records:
+            if speed:
+                delay = start + (record["t"] - first) / speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            self.__feed(record["message"])
+
+    def __feed(self, fields):
+        message = self.__serdes.deserialize(json.dumps(fields))
+        message.transport = self.__transport
+        now = time.time()
+        if message.has("pointId"):
+            self.__last_message_time[message.point_id] = now
+        for item in message.get("points") or []:
+            if "pointId" in item:
+                self.__last_message_time[str(item["pointId"])] = now
+        with self.__histogram("replay.handle", message.type).time():
+            self.__media_controller.on_message(message, self.__transport)
+        self.__messages += 1
+
+    def __on_reply(self, channel, data):
+        message = self.__serdes.deserialize(data)
+        results = message.get("results") or [dict(message.all(), type=message.type)]
+        for result in results:
+            sent = self.__last_message_time.get(str(result["pointId"])) if "pointId" in result else None
+            if sent is not None:
+                self.__histogram("replay.reply", str(result["type"])).observe(time.time() - sent)
+        self.__replies += 1
+
+    def __histogram(self, prefix, message_type):
+        name = "%s.%s" % (prefix, message_type)
+        if name not in self.__histograms:
+            self.__histograms[name] = METRICS.histogram(name)
+        return self.__histograms[name]
+
+    def __str__(self):
+        return "%d messages replayed, %d replies" % (self.__messages, self.__replies)
+
+
+if __name__ == "__main__":
+    from a3.transcoding.gst1.factory import Gst1TranscodingFactory
+
+    recording, speed, drain, batch = parse_arguments(sys.argv)
+    if recording is None:
+        print __doc__
+        sys.exit(1)
+
+    config = CommandLineConfig(IniConfig(DefaultConfig()))
+    LOG.info("Config:\n%s", config)
+    if config.int_option("workers"):
+        LOG.warning("Replay: workers=%d, replay.handle.* is submit time, see mc.executor.handle.*",
+                    config.int_option("workers"))
+    media_controller = MediaController(config, Gst1TranscodingFactory())
+
+    def timer():
+        while True:
+            time.sleep(TICK)
+            media_controller.on_timer()
+    timer_thread = threading.Thread(target=timer)
+    timer_thread.daemon = True
+    timer_thread.start()
+
+    replay = Replay(media_controller, config.mq.channel)
+    replay.run(read_records(recording), speed, batch)
+    time.sleep(drain)
+
+    print replay
+    print METRICS